@@ -0,0 +1,349 @@
+import asyncio
+import contextlib
+import heapq
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time as dt_time, timedelta
+
+import pytz
+
+from route_store import Route
+
+
+logger = logging.getLogger(__name__)
+
+ALERTS_DB = "alerts.db"
+MOSCOW_TZ = pytz.timezone('Europe/Moscow')
+
+KIND_BEFORE = "before"
+KIND_DIGEST = "digest"
+
+# Пропущенное (например, во время перезапуска) напоминание ещё отправляется в пределах этого окна
+MISSED_GRACE = 300
+DIGEST_TRAINS = 5
+# Сколько уведомлений отправляется одновременно; частоту держит очередь отправки
+SEND_CONCURRENCY = 100
+# Сколько при остановке ждать уже начатых отправок
+STOP_TIMEOUT = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    route_name TEXT NOT NULL,
+    from_station TEXT NOT NULL,
+    from_name TEXT NOT NULL,
+    to_station TEXT NOT NULL,
+    to_name TEXT NOT NULL,
+    minutes INTEGER,
+    digest_time TEXT,
+    fire_at REAL NOT NULL,
+    departure REAL
+);
+CREATE INDEX IF NOT EXISTS alerts_user ON alerts (user_id);
+"""
+
+FIELDS = ('id', 'user_id', 'chat_id', 'kind', 'route_name', 'from_station', 'from_name',
+          'to_station', 'to_name', 'minutes', 'digest_time', 'fire_at', 'departure')
+
+
+class Alert:
+    """Подписка на уведомление по маршруту"""
+    __slots__ = FIELDS
+
+    def __init__(self, **fields):
+        for field in FIELDS:
+            setattr(self, field, fields.get(field))
+
+    @property
+    def pair(self) -> tuple:
+        return self.from_station, self.to_station
+
+    def as_row(self) -> tuple:
+        return tuple(getattr(self, field) for field in FIELDS)
+
+    def describe(self) -> str:
+        if self.kind == KIND_BEFORE:
+            departure = datetime.fromtimestamp(self.departure, MOSCOW_TZ).strftime('%d.%m %H:%M')
+            return f"🔔 {self.route_name}: за {self.minutes} мин до электрички в {departure}"
+        return f"📰 {self.route_name}: ежедневно в {self.digest_time}"
+
+
+def next_digest_time(digest_time: str, now: float) -> float:
+    hours, minutes = map(int, digest_time.split(":"))
+    now_moscow = datetime.fromtimestamp(now, MOSCOW_TZ)
+    fire = MOSCOW_TZ.localize(datetime.combine(now_moscow.date(), dt_time(hours, minutes)))
+    if fire.timestamp() <= now:
+        fire = MOSCOW_TZ.normalize(fire + timedelta(days=1))
+    return fire.timestamp()
+
+
+class AlertStore:
+    """Подписки в SQLite; запись в отдельном потоке"""
+
+    def __init__(self, path: str = ALERTS_DB, partition: tuple = (0, 1)):
+        self.path = path
+        # Несколько воркеров делят файл: каждый обслуживает пользователей с user_id % count == index
+        self.partition = partition
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="alert-store")
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def load_all(self) -> list:
+        index, count = self.partition
+        rows = self._conn.execute(f"SELECT {', '.join(FIELDS)} FROM alerts WHERE user_id % ? = ?", (count, index))
+        return [Alert(**dict(zip(FIELDS, row))) for row in rows]
+
+    def _insert(self, alert: Alert) -> int:
+        with self._conn:
+            cursor = self._conn.execute(
+                f"INSERT INTO alerts VALUES ({', '.join('?' * len(FIELDS))})", alert.as_row()
+            )
+        return cursor.lastrowid
+
+    async def insert(self, alert: Alert) -> int:
+        """Сохранить новую подписку; id назначает база"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._insert, alert)
+
+    def _write(self, upserts: list, deletes: list):
+        with self._conn:
+            if upserts:
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO alerts VALUES ({', '.join('?' * len(FIELDS))})",
+                    [alert.as_row() for alert in upserts]
+                )
+            if deletes:
+                self._conn.executemany("DELETE FROM alerts WHERE id = ?", [(alert_id,) for alert_id in deletes])
+
+    async def write(self, upserts: list = (), deletes: list = ()):
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._write, list(upserts), list(deletes))
+
+    def close(self):
+        self._executor.shutdown()
+        self._conn.close()
+
+
+class AlertScheduler:
+    """Планировщик уведомлений на одной куче по времени срабатывания.
+
+    Вместо задачи asyncio на каждую подписку одна задача спит до ближайшего
+    срабатывания. Сработавшие подписки группируются по паре станций, и на
+    группу делается один запрос расписания. Пачка отправляется отдельной
+    задачей, по SEND_CONCURRENCY уведомлений одновременно, а планировщик
+    сразу возвращается к куче: утренняя пачка не задерживает следующие.
+    """
+
+    def __init__(self, store: AlertStore, fetch, send, clock=time.time):
+        # fetch(from_station, to_station, day) -> (окно расписания с этого дня, устарело ли); send(chat_id, text)
+        self.store = store
+        self.fetch = fetch
+        self.send = send
+        self._clock = clock
+        self._alerts = {}
+        # user_id → {id: подписка} для /alerts без обхода всех подписок
+        self._by_user = {}
+        self._heap = []
+        self._wakeup = asyncio.Event()
+        self._task = None
+        # Задачи отправки сработавших пачек
+        self._batches = set()
+        self.fired = 0
+        self.lookups = 0
+
+    def __len__(self):
+        return len(self._alerts)
+
+    def start(self):
+        now = self._clock()
+        missed = []
+        for alert in self.store.load_all():
+            if alert.fire_at < now - MISSED_GRACE:
+                if alert.kind == KIND_BEFORE:
+                    missed.append(alert.id)
+                    continue
+                alert.fire_at = next_digest_time(alert.digest_time, now)
+            self._push(alert)
+        if missed:
+            asyncio.get_running_loop().create_task(self.store.write(deletes=missed))
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        logger.info("Восстановлено подписок на уведомления: %d", len(self._alerts))
+
+    async def stop(self):
+        if self._task is not None:
+            task, self._task = self._task, None
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        if self._batches:
+            _, pending = await asyncio.wait(self._batches, timeout=STOP_TIMEOUT)
+            for batch in pending:
+                batch.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def _push(self, alert: Alert):
+        self._alerts[alert.id] = alert
+        self._by_user.setdefault(alert.user_id, {})[alert.id] = alert
+        if not self._heap or alert.fire_at < self._heap[0][0]:
+            self._wakeup.set()
+        heapq.heappush(self._heap, (alert.fire_at, alert.id))
+
+    def _forget(self, alert: Alert):
+        del self._alerts[alert.id]
+        user_alerts = self._by_user[alert.user_id]
+        del user_alerts[alert.id]
+        if not user_alerts:
+            del self._by_user[alert.user_id]
+
+    def _active(self, alert: Alert) -> bool:
+        """Подписка всё ещё действует (её не отменили, пока шла отправка)"""
+        return self._alerts.get(alert.id) is alert
+
+    def user_alerts(self, user_id: int) -> list:
+        return sorted(self._by_user.get(user_id, {}).values(), key=lambda a: a.id)
+
+    async def _upcoming(self, from_station: str, to_station: str, after: float) -> tuple:
+        """Расписание и индексы отправлений после момента after из окна «сегодня и завтра»"""
+        self.lookups += 1
+        timetable, _ = await self.fetch(from_station, to_station, datetime.fromtimestamp(after, MOSCOW_TZ))
+        return timetable, range(timetable.index_after(after), len(timetable))
+
+    async def subscribe_before(self, user_id: int, chat_id: int, route: Route, minutes: int):
+        """Напомнить за minutes минут до ближайшей электрички; None, если рейсов нет"""
+        now = self._clock()
+        timetable, upcoming = await self._upcoming(route.from_station, route.to_station, now + minutes * 60)
+        if not upcoming:
+            return None
+        departure = timetable.departures[upcoming[0]]
+        alert = self._new_alert(user_id, chat_id, KIND_BEFORE, route, minutes=minutes,
+                                fire_at=departure - minutes * 60, departure=departure)
+        alert.id = await self.store.insert(alert)
+        self._push(alert)
+        return alert
+
+    async def subscribe_digest(self, user_id: int, chat_id: int, route: Route, digest_time: str):
+        """Ежедневная сводка по маршруту в digest_time (ЧЧ:ММ по Москве)"""
+        alert = self._new_alert(user_id, chat_id, KIND_DIGEST, route, digest_time=digest_time,
+                                fire_at=next_digest_time(digest_time, self._clock()))
+        alert.id = await self.store.insert(alert)
+        self._push(alert)
+        return alert
+
+    def _new_alert(self, user_id: int, chat_id: int, kind: str, route: Route, **fields) -> Alert:
+        return Alert(
+            user_id=user_id, chat_id=chat_id, kind=kind, route_name=route.name,
+            from_station=route.from_station, from_name=route.from_name,
+            to_station=route.to_station, to_name=route.to_name, **fields
+        )
+
+    async def unsubscribe(self, user_id: int, alert_id: int) -> bool:
+        alert = self._alerts.get(alert_id)
+        if alert is None or alert.user_id != user_id:
+            return False
+        # Запись в куче удаляется лениво: при срабатывании её просто не окажется в _alerts
+        self._forget(alert)
+        await self.store.write(deletes=[alert_id])
+        return True
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            timeout = None
+            if self._heap:
+                timeout = self._heap[0][0] - self._clock()
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due = self._pop_due()
+            if due:
+                batch = asyncio.get_running_loop().create_task(self._fire_batch(due))
+                self._batches.add(batch)
+                batch.add_done_callback(self._batches.discard)
+
+    async def _fire_batch(self, due: list):
+        try:
+            await self._fire(due)
+        except Exception as e:
+            logger.error("Ошибка отправки уведомлений: %s", e)
+
+    def _pop_due(self) -> list:
+        now = self._clock()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            fire_at, alert_id = heapq.heappop(self._heap)
+            alert = self._alerts.get(alert_id)
+            # Пропускаем отписки и устаревшие записи после переноса
+            if alert is not None and alert.fire_at == fire_at:
+                due.append(alert)
+        return due
+
+    async def _fire(self, due: list):
+        groups = {}
+        for alert in due:
+            groups.setdefault(alert.pair, []).append(alert)
+
+        upserts, deletes = [], []
+        semaphore = asyncio.Semaphore(SEND_CONCURRENCY)
+
+        async def fire_alert(alert: Alert, upcoming):
+            if not self._active(alert):
+                return
+            async with semaphore:
+                await self._notify(alert, upcoming)
+            self.fired += 1
+            # Пока шла отправка, пользователь мог отписаться: тогда подписку уже удалил unsubscribe
+            if not self._active(alert):
+                return
+            if alert.kind == KIND_DIGEST:
+                alert.fire_at = next_digest_time(alert.digest_time, self._clock())
+                self._push(alert)
+                upserts.append(alert)
+            else:
+                self._forget(alert)
+                deletes.append(alert.id)
+
+        async def fire_group(from_station: str, to_station: str, alerts: list):
+            upcoming = None
+            if any(alert.kind == KIND_DIGEST for alert in alerts):
+                try:
+                    upcoming = await self._upcoming(from_station, to_station, self._clock())
+                except Exception as e:
+                    logger.error("Ошибка получения расписания для уведомлений: %s", e)
+            await asyncio.gather(*(fire_alert(alert, upcoming) for alert in alerts))
+
+        await asyncio.gather(*(fire_group(*pair, alerts) for pair, alerts in groups.items()))
+
+        # И то же за время остальных отправок: отменённая сводка не должна вернуться в базу
+        upserts = [alert for alert in upserts if self._active(alert)]
+        await self.store.write(upserts=upserts, deletes=deletes)
+
+    async def _notify(self, alert: Alert, upcoming):
+        if alert.kind == KIND_BEFORE:
+            departure = datetime.fromtimestamp(alert.departure, MOSCOW_TZ)
+            text = (
+                f"🔔 *{alert.route_name}*: электричка {alert.from_name} → {alert.to_name}\n"
+                f"🕐 отправляется в *{departure.strftime('%H:%M')}* (через {alert.minutes} мин)"
+            )
+        elif upcoming is None:
+            text = f"📰 *{alert.route_name}*: не удалось получить расписание"
+        elif not upcoming[1]:
+            text = f"📰 *{alert.route_name}*: рейсов не найдено ни на сегодня, ни на завтра"
+        else:
+            timetable, indices = upcoming
+            lines = [f"📰 *{alert.route_name}*: {alert.from_name} → {alert.to_name}"]
+            for i in indices[:DIGEST_TRAINS]:
+                lines.append(f"🕐 *{timetable.departure_text[i]}* - {timetable.arrival_text[i]}")
+            text = "\n".join(lines)
+
+        try:
+            await self.send(alert.chat_id, text)
+        except Exception as e:
+            logger.error("Не удалось отправить уведомление пользователю %s: %s", alert.user_id, e)
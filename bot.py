@@ -1,18 +1,47 @@
-import requests
+import asyncio
 import json
 from datetime import datetime, timedelta
 import logging
-import pickle
 import os
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler
+import time
+from telegram import InlineQueryResultArticle, InlineQueryResultsButton, InputTextMessageContent, Update
+from telegram.error import BadRequest
+from telegram.ext import (
+    Application, CallbackQueryHandler, CommandHandler, InlineQueryHandler, MessageHandler, TypeHandler, filters,
+    ContextTypes, ConversationHandler
+)
+import httpx
 import pytz
 
+import logs
+import metrics
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+from alerts import AlertScheduler, AlertStore
+from flood import FloodControl
+from journeys import (
+    JOURNEY_FIRST_BUILD, JOURNEY_MAX_PAIRS, JOURNEY_REFRESH, JOURNEY_RELOAD_INTERVAL, JOURNEYS_FILE, JourneyPlanner,
+)
+from persistence import SQLitePersistence, restore_conversations
+from prefetch import PREFETCH_RATE, RoutePrefetcher
+from rendering import (
+    BACK_BUTTON, NEXT_TRAINS, SCHEDULE_CALLBACK, Keyboards, MessageCache, parse_schedule_callback, render_journeys,
+    render_next_trains, render_tomorrow, reply_keyboard, schedule_buttons
 )
+from resilience import UpstreamUnavailable
+from route_store import Route, RouteIndex, RouteStore, SQLiteRouteStore, UserRoutes, WriteBehindRouteStore
+from schedule_cache import ScheduleCache
+from send_queue import GLOBAL_RATE, PRIORITY_ALERT, SendQueue
+from snapshot import SNAPSHOT_FILE, SNAPSHOT_INTERVAL, Snapshot, current_entries, restore, write_snapshot
+from stations import StationIndex, STATIONS_MAX_AGE, SCORE_EXACT, SCORE_PREFIX
+from timetable import Timetable
+from update_processor import PerUserUpdateProcessor
+from yandex_client import RATE_BURST as YANDEX_RATE_BURST, RATE_LIMIT as YANDEX_RATE_LIMIT, YandexClient
+
+
+# Записи пишет фоновый поток; формат (JSON или текст) — logs.LOG_JSON
+logs.setup()
+# httpx логирует каждый запрос вместе с apikey в строке запроса
+logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 SELECTING_ACTION, CHOOSING_STATION_FROM, CHOOSING_STATION_TO, SAVING_ROUTE, MANAGING_ROUTES = range(5)
@@ -20,13 +49,45 @@ SELECTING_ACTION, CHOOSING_STATION_FROM, CHOOSING_STATION_TO, SAVING_ROUTE, MANA
 
 API_KEY = "YaAPI"  # <- яндекс API ключ сюда
 API_URL = "https://api.rasp.yandex-net.ru/v3.0/search/"
+STATIONS_URL = "https://api.rasp.yandex.net/v3.0/stations_list/"
 
 
-ROUTES_FILE = "user_routes.pkl"
+ROUTES_FILE = "user_routes.pkl"  # старый формат, переносится в ROUTES_DB при первом запуске
+ROUTES_DB = "user_routes.db"
+ROUTES_JOURNAL = "user_routes.journal"
+ALERTS_DB = "alerts.db"
+CONVERSATIONS_DB = "conversations.db"
+
+# Режим webhook: пустой WEBHOOK_URL — обычный polling в одном процессе
+WEBHOOK_URL = ""  # <- публичный https-адрес, который Telegram будет вызывать
+WEBHOOK_LISTEN = "0.0.0.0"
+WEBHOOK_PORT = 8080
+WEBHOOK_SECRET = ""
+WEBHOOK_WORKERS = os.cpu_count() or 1
+
+# Порт эндпоинта метрик Prometheus (0 — метрики выключены); воркер N слушает METRICS_PORT + N
+METRICS_PORT = 0
 
 # Московский часовой пояс
 MOSCOW_TZ = pytz.timezone('Europe/Moscow')
 
+# Как часто воркеры, кроме первого, проверяют обновление справочника станций
+STATIONS_RELOAD_INTERVAL = 3600
+
+# Сколько вариантов станции предлагать при неоднозначном вводе
+STATION_CANDIDATES = 6
+
+# На сколько дней вперёд загружается окно расписания (сегодня, завтра, ...)
+WINDOW_DAYS = 2
+
+# Inline-режим (@бот Клин Москва): сколько секунд Telegram кэширует ответ,
+# сколько сохранённых маршрутов показывать на пустой запрос и до скольких слов разбирать запрос
+INLINE_CACHE_TIME = 30
+INLINE_ROUTES = 5
+INLINE_MAX_WORDS = 8
+ROUTE_SEPARATORS = ("→", "->", " - ", " — ", " – ")
+
+
 POPULAR_STATIONS = { 
     "Москва (Ленинградский вокзал)": "s2006004",
     "Солнечногорск (Подсолнечная)": "s9603468",
@@ -36,62 +97,297 @@ POPULAR_STATIONS = {
 }
 
 class YandexScheduleBot:
-    def __init__(self, token: str):
-        self.application = Application.builder().token(token).build()
-        self.user_routes = self.load_routes()
+    def __init__(self, token: str, route_store: RouteStore = None, worker: tuple = (0, 1), base_url: str = None):
+        # worker — (номер, число воркеров) в режиме webhook; пользователи делятся по user_id % число
+        self.worker_index, self.worker_count = worker
+        self.persistence = SQLitePersistence(CONVERSATIONS_DB)
+        # Общий лимит Bot API делится между воркерами, лимиты чатов — нет: чаты закреплены за воркером
+        self.send_queue = SendQueue(global_rate=GLOBAL_RATE / self.worker_count)
+        # Пользователи обслуживаются параллельно, обновления одного пользователя — по порядку
+        self.update_processor = PerUserUpdateProcessor()
+        builder = (
+            Application.builder().token(token)
+            .concurrent_updates(self.update_processor)
+            .persistence(self.persistence)
+            .rate_limiter(self.send_queue)
+            .post_init(self.post_init)
+            .post_stop(self.post_stop)
+            .post_shutdown(self.post_shutdown)
+        )
+        if base_url:
+            builder = builder.base_url(base_url)
+        self.application = builder.build()
+        # Квота API — на ключ, а не на процесс: как и лимит Bot API, она делится между воркерами
+        self.yandex = YandexClient(
+            API_KEY, search_url=API_URL, stations_url=STATIONS_URL,
+            rate_limit=YANDEX_RATE_LIMIT / self.worker_count,
+            rate_burst=max(1.0, YANDEX_RATE_BURST / self.worker_count),
+        )
+        self.schedule_cache = ScheduleCache()
+        self.station_index = StationIndex()
+        self.route_store = route_store or self.open_route_store()
+        # Маршруты подгружаются из хранилища при первом обращении пользователя
+        self.user_routes = {}
+        # Пара станций → пользователи с таким маршрутом (для прогрева и уведомлений)
+        self.route_index = RouteIndex()
+        # Кэш расписаний у каждого процесса свой: воркер прогревает его парами своих пользователей,
+        # а квоту прогрева, как и квоту API, воркеры делят
+        self.prefetcher = RoutePrefetcher(self.refresh_schedule, self.own_pair_counts,
+                                          rate=PREFETCH_RATE / self.worker_count)
+        self.alerts = AlertScheduler(AlertStore(ALERTS_DB, partition=worker), self.fetch_window, self.send_alert)
+        self.journeys = JourneyPlanner(self.fetch_window, self.journey_pairs, path=JOURNEYS_FILE)
+        self.snapshot_stats = {"restored": 0, "bytes": 0, "save_seconds": 0.0}
+        self.flood = FloodControl()
+        self.metrics_server = metrics.MetricsServer() if METRICS_PORT else None
+        self.keyboards = Keyboards(POPULAR_STATIONS)
+        self.messages = MessageCache()
         self.setup_handlers()
     
-    def load_routes(self):
-        if os.path.exists(ROUTES_FILE):
+    @property
+    def is_main_worker(self) -> bool:
+        """Общие фоновые задачи (справочник станций, снимок, таблица пересадок) выполняет только первый воркер"""
+        return self.worker_index == 0
+    
+    async def post_init(self, application: Application):
+        if self.metrics_server:
+            metrics.REGISTRY.add_collector(self.collect_metrics)
+            await self.metrics_server.start(METRICS_PORT + self.worker_index)
+        self.restore_snapshot()
+        self.route_store.start()
+        self.route_index.load(self.route_store.user_pairs())
+        self.alerts.start()
+        self.station_index.set_popularity(self.station_popularity())
+        await self.station_index.load_async()
+        await self.journeys.load()
+        if application.job_queue:
+            self.prefetcher.schedule(application.job_queue)
+            if self.is_main_worker:
+                application.job_queue.run_repeating(
+                    self.refresh_stations_job,
+                    interval=STATIONS_MAX_AGE,
+                    first=max(1, self.station_index.seconds_until_stale())
+                )
+                application.job_queue.run_repeating(
+                    self.snapshot_job, interval=SNAPSHOT_INTERVAL, first=SNAPSHOT_INTERVAL
+                )
+                # Таблицу пересадок собирает только первый воркер; сохранённая при прошлом запуске
+                # уже загружена, а новую не стоит собирать раньше, чем бот начнёт отвечать
+                application.job_queue.run_repeating(
+                    self.journeys.rebuild_job,
+                    interval=JOURNEY_REFRESH,
+                    first=max(JOURNEY_FIRST_BUILD, self.journeys.seconds_until_stale())
+                )
+            else:
+                application.job_queue.run_repeating(self.reload_stations_job, interval=STATIONS_RELOAD_INTERVAL)
+                application.job_queue.run_repeating(self.journeys.reload_job, interval=JOURNEY_RELOAD_INTERVAL)
+    
+    async def post_stop(self, application: Application):
+        if self.metrics_server:
+            await self.metrics_server.stop()
+        await self.alerts.stop()
+        try:
+            await self.route_store.flush()
+        except Exception as e:
+            logger.error("Ошибка сохранения маршрутов при остановке: %s", e)
+        if self.is_main_worker:
+            await self.save_snapshot()
+    
+    def restore_snapshot(self):
+        """Заполнить кэш расписаний из снимка, оставленного предыдущим запуском"""
+        try:
+            snapshot = Snapshot(SNAPSHOT_FILE)
+            if snapshot.load():
+                self.snapshot_stats["restored"] = restore(self.schedule_cache, snapshot)
+                logger.info("Из снимка восстановлено расписаний: %d", self.snapshot_stats["restored"])
+        except Exception as e:
+            logger.error("Ошибка чтения снимка расписаний: %s", e)
+    
+    async def save_snapshot(self):
+        started = time.perf_counter()
+        try:
+            entries = current_entries(self.schedule_cache)
+            self.snapshot_stats["bytes"] = await asyncio.to_thread(write_snapshot, SNAPSHOT_FILE, entries)
+        except Exception as e:
+            logger.error("Ошибка сохранения снимка расписаний: %s", e)
+            return
+        self.snapshot_stats["save_seconds"] = time.perf_counter() - started
+    
+    async def snapshot_job(self, context: ContextTypes.DEFAULT_TYPE):
+        await self.save_snapshot()
+    
+    async def post_shutdown(self, application: Application):
+        await self.yandex.aclose()
+        await self.route_store.close()
+        self.alerts.store.close()
+        self.persistence.close()
+        self.station_index.close()
+    
+    def collect_metrics(self) -> list:
+        """Счётчики компонентов для /metrics; читаются только в момент запроса"""
+        cache = self.schedule_cache.stats()
+        flood = self.flood.stats()
+        samples = [
+            ("schedule_cache_entries", "gauge", "Записей в кэше расписаний", cache["entries"]),
+            ("schedule_cache_hits_total", "counter", "Попадания в кэш расписаний", cache["hits"]),
+            ("schedule_cache_misses_total", "counter", "Промахи кэша расписаний", cache["misses"]),
+            ("schedule_cache_coalesced_total", "counter", "Запросы, дождавшиеся чужой загрузки", cache["coalesced"]),
+            ("schedule_cache_stale_total", "counter", "Ответы устаревшим расписанием", cache["stale_hits"]),
+            ("schedule_cache_hit_ratio", "gauge", "Доля запросов расписания без обращения к API", cache["hit_rate"]),
+            ("yandex_retries_total", "counter", "Повторы запросов к API", self.yandex.retried),
+            ("yandex_circuit_open", "gauge", "Число разомкнутых предохранителей API",
+             sum(breaker.state != breaker.CLOSED for breaker in self.yandex.breakers.values())),
+            ("yandex_rate_limited_total", "counter", "Запросы, отклонённые из-за квоты", self.yandex.limiter.throttled),
+            ("flood_users", "gauge", "Пользователи в окне ограничения частоты", flood["users"]),
+            ("flood_duplicate_total", "counter", "Отброшенные повторные нажатия", flood["duplicate"]),
+            ("flood_rate_limited_total", "counter", "Обновления сверх лимита пользователя", flood["rate_limited"]),
+            ("flood_stale_total", "counter", "Отброшенные устаревшие обновления", flood["stale"]),
+            ("snapshot_restored", "gauge", "Расписаний, восстановленных из снимка при запуске",
+             self.snapshot_stats["restored"]),
+            ("snapshot_bytes", "gauge", "Размер последнего снимка расписаний", self.snapshot_stats["bytes"]),
+            ("snapshot_save_seconds", "gauge", "Длительность последнего сохранения снимка",
+             self.snapshot_stats["save_seconds"]),
+            ("journey_connections", "gauge", "Рейсов в таблице пересадок",
+             len(self.journeys.table) if self.journeys.table else 0),
+            ("journey_build_seconds", "gauge", "Длительность последней сборки таблицы пересадок",
+             self.journeys.last_build_seconds),
+            ("journey_loads_total", "counter", "Загрузки таблицы пересадок из файла", self.journeys.loads),
+            ("message_cache_hits_total", "counter", "Сообщения с расписанием, отданные готовыми", self.messages.hits),
+            ("message_cache_misses_total", "counter", "Сообщения с расписанием, собранные заново", self.messages.misses),
+            ("route_cache_users", "gauge", "Пользователей с маршрутами в памяти", len(self.user_routes)),
+            ("updates_in_progress", "gauge", "Обновления, обрабатываемые сейчас",
+             self.update_processor.current_concurrent_updates),
+            ("alerts_scheduled", "gauge", "Активные подписки на уведомления", len(self.alerts)),
+            ("alerts_fired_total", "counter", "Отправленные уведомления", self.alerts.fired),
+            ("conversations_flushes_total", "counter", "Сбросы состояния диалогов", self.persistence.flushes),
+        ]
+        outbox = self.send_queue.stats()
+        log_queue = logs.stats()
+        samples += [
+            ("log_queue_depth", "gauge", "Записи лога, ждущие потока записи", log_queue["queued"]),
+            ("log_dropped_total", "counter", "Записи лога, отброшенные при переполнении очереди", log_queue["dropped"]),
+            ("telegram_queue_depth", "gauge", "Сообщения в очереди на отправку", outbox["depth"]),
+            ("telegram_queue_chats", "gauge", "Чаты с состоянием в очереди отправки", outbox["chats"]),
+            ("telegram_sent_total", "counter", "Отправленные запросы к Bot API", outbox["sent"]),
+            ("telegram_merged_total", "counter", "Сообщения, склеенные с предыдущими", outbox["merged"]),
+            ("telegram_retry_after_total", "counter", "Повторы после ответа 429", outbox["retried"]),
+            ("telegram_failed_total", "counter", "Запросы к Bot API, завершившиеся ошибкой", outbox["failed"]),
+        ]
+        if hasattr(self.route_store, "stats"):
+            routes = self.route_store.stats()
+            samples.append(("route_store_pending_users", "gauge", "Пользователи с несохранёнными маршрутами",
+                            routes["pending_users"]))
+            samples.append(("route_store_journal_syncs_total", "counter", "Групповые fsync журнала маршрутов",
+                            routes["journal_syncs"]))
+        return samples
+    
+    async def refresh_stations(self):
+        try:
+            await self.station_index.refresh(self.yandex)
+        except Exception as e:
+            logger.error("Ошибка обновления справочника станций: %s", e)
+    
+    async def refresh_stations_job(self, context: ContextTypes.DEFAULT_TYPE):
+        await self.refresh_stations()
+    
+    async def reload_stations_job(self, context: ContextTypes.DEFAULT_TYPE):
+        # Справочник перестраивает первый воркер, остальные подхватывают новый файл
+        try:
+            await self.station_index.reload_if_changed()
+        except Exception as e:
+            logger.error("Ошибка загрузки справочника станций: %s", e)
+    
+    def open_route_store(self) -> RouteStore:
+        store = SQLiteRouteStore(ROUTES_DB)
+        journal = ROUTES_JOURNAL
+        if self.worker_count > 1:
+            # У каждого воркера свой журнал; перенос pickle делает запускающий процесс
+            journal = f"{ROUTES_JOURNAL}.{self.worker_index}"
+        else:
+            try:
+                store.migrate_pickle(ROUTES_FILE)
+            except Exception as e:
+                logger.error("Ошибка переноса маршрутов из %s: %s", ROUTES_FILE, e)
+        return WriteBehindRouteStore(store, journal)
+    
+    def get_user_routes(self, user_id: int) -> UserRoutes:
+        routes = self.user_routes.get(user_id)
+        if routes is None:
             try:
-                with open(ROUTES_FILE, 'rb') as f:
-                    return pickle.load(f)
+                routes = UserRoutes(self.route_store.load_user(user_id))
             except Exception as e:
-                logger.error(f"Ошибка загрузки маршрутов: {e}")
-        return {}
+                logger.error("Ошибка загрузки маршрутов: %s", e)
+                return UserRoutes()
+            self.user_routes[user_id] = routes
+        return routes
     
-    def save_routes(self):
+    async def save_user_routes(self, user_id: int):
         try:
-            with open(ROUTES_FILE, 'wb') as f:
-                pickle.dump(self.user_routes, f)
+            await self.route_store.save_user(user_id, list(self.user_routes.get(user_id, ())))
         except Exception as e:
-            logger.error(f"Ошибка сохранения маршрутов: {e}")
-    
-    def get_user_routes(self, user_id: int):
-        return self.user_routes.get(user_id, [])
-    
-    def add_user_route(self, user_id: int, route_name: str, from_station: str, from_name: str, to_station: str, to_name: str):
-        if user_id not in self.user_routes:
-            self.user_routes[user_id] = []
-        
-        for route in self.user_routes[user_id]:
-            if route['from_station'] == from_station and route['to_station'] == to_station:
-                return False
-        
-        route_data = {
-            'name': route_name,
-            'from_station': from_station,
-            'from_name': from_name,
-            'to_station': to_station,
-            'to_name': to_name,
-            'created_at': datetime.now(MOSCOW_TZ)
-        }
-        
-        self.user_routes[user_id].append(route_data)
-        self.save_routes()
+            logger.error("Ошибка сохранения маршрутов: %s", e)
+    
+    async def add_user_route(self, user_id: int, route_name: str, from_station: str, from_name: str, to_station: str, to_name: str):
+        route = Route(route_name, from_station, from_name, to_station, to_name, time.time())
+        if not self.get_user_routes(user_id).add(route):
+            return False
+        
+        self.route_index.add(user_id, route.pair)
+        await self.save_user_routes(user_id)
         return True
     
-    def delete_user_route(self, user_id: int, route_index: int):
-        if user_id in self.user_routes and 0 <= route_index < len(self.user_routes[user_id]):
-            del self.user_routes[user_id][route_index]
-            if not self.user_routes[user_id]:
-                del self.user_routes[user_id]
-            self.save_routes()
-            return True
-        return False
+    async def delete_user_route(self, user_id: int, route: Route):
+        user_routes = self.get_user_routes(user_id)
+        user_routes.remove(route)
+        if not user_routes.by_pair(*route.pair):
+            self.route_index.discard(user_id, route.pair)
+        await self.save_user_routes(user_id)
+    
+    def pair_counts(self) -> dict:
+        """Число пользователей на пару станций; в webhook-режиме — из общей БД, где видны маршруты всех воркеров"""
+        if self.worker_count > 1:
+            return self.route_store.pair_counts()
+        return self.route_index.counts()
+    
+    def own_pair_counts(self) -> dict:
+        """Число пользователей этого воркера на пару станций (все пользователи, если воркер один)"""
+        if self.worker_count > 1:
+            return self.route_index.counts(partition=(self.worker_index, self.worker_count))
+        return self.route_index.counts()
+    
+    def journey_pairs(self) -> list:
+        """Пары для таблицы пересадок: все направления коридора и популярные сохранённые маршруты"""
+        corridor = list(POPULAR_STATIONS.values())
+        pairs = [(a, b) for a in corridor for b in corridor if a != b]
+        known = set(pairs)
+        counts = self.pair_counts()
+        for pair in sorted(counts, key=lambda pair: counts[pair], reverse=True)[:JOURNEY_MAX_PAIRS]:
+            if pair not in known:
+                pairs.append(pair)
+        return pairs
+    
+    def station_popularity(self) -> dict:
+        """Популярность станций: сколько раз они встречаются в сохранённых маршрутах"""
+        weights = {code: 10 for code in POPULAR_STATIONS.values()}
+        for (from_station, to_station), users in self.pair_counts().items():
+            for code in (from_station, to_station):
+                weights[code] = weights.get(code, 0) + users
+        return weights
+    
+    async def load_user_state(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Ленивая загрузка user_data и состояния диалога при первом обновлении пользователя"""
+        if not update.effective_user:
+            return
+        loaded = await self.persistence.load_user(update.effective_user.id)
+        if loaded is None:
+            return
+        user_data, conversations = loaded
+        context.user_data.update(user_data)
+        states = conversations.get(self.conv_handler.name)
+        if states:
+            restore_conversations(self.conv_handler, states)
     
     def setup_handlers(self):
-        conv_handler = ConversationHandler(
+        self.conv_handler = conv_handler = ConversationHandler(
             entry_points=[CommandHandler('start', self.start)],
             states={
                 SELECTING_ACTION: [
@@ -111,15 +407,32 @@ class YandexScheduleBot:
                 ],
             },
             fallbacks=[CommandHandler('cancel', self.cancel)],
+            name="main",
+            persistent=True,
         )
         
+        # Повторы, поток и устаревшие обновления отсекаются раньше всего остального
+        self.application.add_handler(TypeHandler(Update, self.flood.check), group=-2)
+        # Состояние пользователя подгружается из persistence до остальных обработчиков
+        self.application.add_handler(TypeHandler(Update, self.load_user_state), group=-1)
         self.application.add_handler(conv_handler)
+        self.application.add_handler(InlineQueryHandler(self.inline_query))
+        self.application.add_handler(CallbackQueryHandler(self.handle_schedule_button, pattern=f"^{SCHEDULE_CALLBACK}:"))
         self.application.add_handler(CommandHandler("myroutes", self.show_my_routes))
+        self.application.add_handler(CommandHandler("notify", self.notify))
+        self.application.add_handler(CommandHandler("digest", self.digest))
+        self.application.add_handler(CommandHandler("alerts", self.show_alerts))
+        self.application.add_handler(CommandHandler("unalert", self.unalert))
+        self.application.add_handler(CommandHandler("journey", self.journey))
     
     def get_moscow_time(self):
         """Получить текущее московское время"""
         return datetime.now(MOSCOW_TZ)
     
+    def day_start(self, dt) -> float:
+        """Timestamp полуночи по Москве для даты dt"""
+        return MOSCOW_TZ.localize(datetime.combine(dt.date(), datetime.min.time())).timestamp()
+    
     def format_moscow_time(self, dt):
         """Форматировать datetime в московское время"""
         if dt.tzinfo is None:
@@ -128,6 +441,62 @@ class YandexScheduleBot:
             dt = dt.astimezone(MOSCOW_TZ)
         return dt
     
+    async def load_timetable(self, from_station: str, to_station: str, date: str) -> Timetable:
+        data = await self.yandex.search(from_station, to_station, date, limit=50)
+        return Timetable.from_response(data, date)
+    
+    async def fetch_schedule(self, from_station: str, to_station: str, date: str) -> Timetable:
+        """Расписание на дату через кэш: одинаковые запросы не уходят в API повторно"""
+        return await self.schedule_cache.get(
+            (from_station, to_station, date),
+            lambda: self.load_timetable(from_station, to_station, date)
+        )
+    
+    async def fetch_schedule_or_stale(self, from_station: str, to_station: str, date: str) -> tuple:
+        """(расписание, устарело ли оно): при недоступности API — последнее известное из кэша"""
+        try:
+            return await self.fetch_schedule(from_station, to_station, date), False
+        except (httpx.HTTPError, UpstreamUnavailable) as e:
+            timetable = self.schedule_cache.stale((from_station, to_station, date))
+            if timetable is None:
+                raise
+            logger.warning("API недоступно (%s), отдаём сохранённое расписание", type(e).__name__)
+            return timetable, True
+    
+    async def fetch_window(self, from_station: str, to_station: str, start: datetime, days: int = WINDOW_DAYS) -> tuple:
+        """(окно расписания на days дней с даты start, устарело ли оно).
+
+        Даты запрашиваются одновременно и сливаются в один поток отправлений.
+        Ошибка первого дня пробрасывается, а не загруженные следующие дни
+        просто отсутствуют в window.dates.
+        """
+        dates = [(start + timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(days)]
+        results = await asyncio.gather(
+            *(self.fetch_schedule_or_stale(from_station, to_station, date) for date in dates),
+            return_exceptions=True
+        )
+        if isinstance(results[0], BaseException):
+            raise results[0]
+        
+        timetables = []
+        stale = False
+        for date, result in zip(dates, results):
+            if isinstance(result, BaseException):
+                logger.error("Ошибка при получении расписания на %s: %s", date, result)
+                continue
+            timetables.append(result[0])
+            stale = stale or result[1]
+        return Timetable.merge(timetables), stale
+    
+    async def refresh_schedule(self, from_station: str, to_station: str, date: str, ttl: float = None) -> Timetable:
+        """Загрузить расписание в кэш заново (для прогрева перед часами пик)"""
+        return await self.schedule_cache.refresh(
+            (from_station, to_station, date),
+            lambda: self.load_timetable(from_station, to_station, date),
+            ttl
+        )
+    
+    @metrics.timed
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         user = update.message.from_user
         logger.info("Пользователь %s начал разговор", user.first_name)
@@ -136,16 +505,7 @@ class YandexScheduleBot:
         
         user_routes = self.get_user_routes(user.id)
         
-        keyboard = [
-            ["📅 Получить расписание"],
-            ["⭐ Мои маршруты"] if user_routes else ["⭐ Добавить маршрут"],
-        ]
-        
-        if user_routes:
-            for route in user_routes[:3]:
-                keyboard.append([f"🚆 {route['name']}"])
-        
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        reply_markup = self.keyboards.main_menu(user_routes)
         
         current_time = self.get_moscow_time().strftime("%H:%M")
         
@@ -158,20 +518,16 @@ class YandexScheduleBot:
         
         return SELECTING_ACTION
     
+    @metrics.timed
     async def handle_main_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         text = update.message.text
         user_id = update.message.from_user.id
         
-        user_routes = self.get_user_routes(user_id)
-        for i, route in enumerate(user_routes):
-            if f"🚆 {route['name']}" == text:
-
-                context.user_data['from_station'] = route['from_station']
-                context.user_data['from_station_name'] = route['from_name']
-                context.user_data['to_station'] = route['to_station']
-                context.user_data['to_station_name'] = route['to_name']
-                await self.get_schedule(update, context, is_favorite=True)
-                return await self.start(update, context)
+        route = self.get_user_routes(user_id).by_label(text)
+        if route:
+            self.select_route(context, route)
+            await self.get_schedule(update, context, is_favorite=True)
+            return await self.start(update, context)
         
         if "расписание" in text.lower():
             return await self.ask_station_from(update, context)
@@ -184,16 +540,13 @@ class YandexScheduleBot:
             return SELECTING_ACTION
     
     async def ask_station_from(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-        keyboard = [[station] for station in POPULAR_STATIONS.keys()]
-        keyboard.append(["↩️ Назад"])
-        
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
         await update.message.reply_text(
             "Выберите станцию отправления из списка или введите название своей станции:",
-            reply_markup=reply_markup
+            reply_markup=self.keyboards.stations
         )
         return CHOOSING_STATION_FROM
     
+    @metrics.timed
     async def handle_station_from(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         station_name = update.message.text
         
@@ -201,72 +554,55 @@ class YandexScheduleBot:
             return await self.start(update, context)
         
         # Сохраняем выбранную станцию отправления
-        if station_name in POPULAR_STATIONS:
-            context.user_data['from_station'] = POPULAR_STATIONS[station_name]
-            context.user_data['from_station_name'] = station_name
-        else:
-            # Поиск станции по названию
-            station_code, full_name = await self.search_station(station_name)
-            if station_code:
-                context.user_data['from_station'] = station_code
-                context.user_data['from_station_name'] = full_name
-            else:
-                await update.message.reply_text("❌ Станция не найдена. Попробуйте еще раз:")
-                return CHOOSING_STATION_FROM
+        station_code, full_name = await self.resolve_station(update, context, station_name)
+        if not station_code:
+            return CHOOSING_STATION_FROM
+        context.user_data['from_station'] = station_code
+        context.user_data['from_station_name'] = full_name
         
         # Запрашиваем станцию назначения
-        keyboard = [[station] for station in POPULAR_STATIONS.keys()]
-        keyboard.append(["↩️ Назад"])
-        
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
         await update.message.reply_text(
             f"📍 Отправление: {context.user_data['from_station_name']}\n"
             "Теперь выберите станцию назначения:",
-            reply_markup=reply_markup
+            reply_markup=self.keyboards.stations
         )
         
         return CHOOSING_STATION_TO
     
+    @metrics.timed
     async def handle_station_to(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         station_name = update.message.text
         
         if "назад" in station_name.lower():
             return await self.ask_station_from(update, context)
         
-        if station_name in POPULAR_STATIONS:
-            context.user_data['to_station'] = POPULAR_STATIONS[station_name]
-            context.user_data['to_station_name'] = station_name
-        else:
-            station_code, full_name = await self.search_station(station_name)
-            if station_code:
-                context.user_data['to_station'] = station_code
-                context.user_data['to_station_name'] = full_name
-            else:
-                await update.message.reply_text("❌ Станция не найдена. Попробуйте еще раз:")
-                return CHOOSING_STATION_TO
+        station_code, full_name = await self.resolve_station(update, context, station_name)
+        if not station_code:
+            return CHOOSING_STATION_TO
+        context.user_data['to_station'] = station_code
+        context.user_data['to_station_name'] = full_name
 
         await self.show_schedule(update, context)
         
         user_routes = self.get_user_routes(update.message.from_user.id)
         if len(user_routes) < 10: 
-            keyboard = [["💾 Сохранить маршрут"], ["❌ Не сохранять"]]
-            reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
             await update.message.reply_text(
                 "Хотите сохранить этот маршрут в избранное для быстрого доступа?",
-                reply_markup=reply_markup
+                reply_markup=self.keyboards.save_route
             )
             return SAVING_ROUTE
         else:
             await update.message.reply_text("⚠️ Достигнут лимит избранных маршрутов (10)")
             return await self.start(update, context)
     
+    @metrics.timed
     async def handle_save_route(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         text = update.message.text
         
         if "сохранить" in text.lower():
             await update.message.reply_text(
                 "Придумайте название для этого маршрута (например: 'Работа-дом'):",
-                reply_markup=ReplyKeyboardRemove()
+                reply_markup=self.keyboards.remove
             )
             context.user_data['waiting_for_route_name'] = True
             return SAVING_ROUTE
@@ -284,7 +620,7 @@ class YandexScheduleBot:
                 to_station = context.user_data.get('to_station')
                 to_name = context.user_data.get('to_station_name')
                 
-                if self.add_user_route(user_id, route_name, from_station, from_name, to_station, to_name):
+                if await self.add_user_route(user_id, route_name, from_station, from_name, to_station, to_name):
                     await update.message.reply_text(f"✅ Маршрут '{route_name}' сохранен в избранное!")
                 else:
                     await update.message.reply_text("❌ Этот маршрут уже сохранен")
@@ -297,6 +633,7 @@ class YandexScheduleBot:
         else:
             return await self.start(update, context)
     
+    @metrics.timed
     async def show_schedule(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показ расписания (без сохранения маршрута)"""
         try:
@@ -309,160 +646,194 @@ class YandexScheduleBot:
                 await update.message.reply_text("❌ Ошибка: не указаны станции")
                 return
             
-            params = {
-                "apikey": API_KEY,
-                "format": "json",
-                "from": from_station,
-                "to": to_station,
-                "lang": "ru_RU",
-                "date": self.get_moscow_time().strftime("%Y-%m-%d"),
-                "transport_types": "suburban",
-                "limit": 50
-            }
-            
-            response = requests.get(API_URL, params=params, timeout=10)
-            data = response.json()
-            
-            if 'segments' not in data or not data['segments']:
-                await update.message.reply_text("❌ Рейсов не найдено на сегодня")
-                return
-            
-            now_moscow = self.get_moscow_time()
-            
-            upcoming_trains = []
-            
-            for segment in data['segments']:
-                departure_time = datetime.strptime(segment['departure'], '%Y-%m-%dT%H:%M:%S%z')
-                departure_time_moscow = self.format_moscow_time(departure_time)
-                
-                if departure_time_moscow >= now_moscow:
-                    upcoming_trains.append(segment)
-            
-            upcoming_trains.sort(key=lambda x: x['departure'])
-            
-            if not upcoming_trains:
-                await self.show_tomorrow_schedule(update, from_station, to_station, from_name, to_name)
-                return
-            
-            message = f"🚆 *Расписание электричек:*\n"
-            message += f"📍 *{from_name}* → *{to_name}*\n"
-            message += f"📅 *{now_moscow.strftime('%d.%m.%Y')}*\n"
-            message += f"🕐 *Текущее время: {now_moscow.strftime('%H:%M')}*\n\n"
-            
-            for segment in upcoming_trains[:8]:
-                departure = datetime.strptime(segment['departure'], '%Y-%m-%dT%H:%M:%S%z')
-                arrival = datetime.strptime(segment['arrival'], '%Y-%m-%dT%H:%M:%S%z')
-                
-                departure_moscow = self.format_moscow_time(departure)
-                arrival_moscow = self.format_moscow_time(arrival)
-                
-                time_until_departure = departure_moscow - now_moscow
-                total_minutes = int(time_until_departure.total_seconds() // 60)
-                hours_until = total_minutes // 60
-                minutes_until = total_minutes % 60
-                
-                time_until_text = ""
-                if hours_until > 0:
-                    time_until_text = f"⏳ Через {hours_until}ч {minutes_until}мин"
-                else:
-                    time_until_text = f"⏳ Через {minutes_until}мин"
-                
-                departure_local = departure_moscow.strftime('%H:%M')
-                arrival_local = arrival_moscow.strftime('%H:%M')
-                
-                message += (
-                    f"🕐 *{departure_local}* - {arrival_local}\n"
-                    f"🚄 {segment['thread']['title']}\n"
-                    f"⏱ В пути: {segment['duration'] // 60} мин\n"
-                    f"{time_until_text}\n"
-                    f"——\n"
-                )
-            
-            if len(upcoming_trains) > 8:
-                message += f"\n... и еще {len(upcoming_trains) - 8} рейсов"
-            
-            await update.message.reply_text(message, parse_mode='Markdown')
+            message, reply_markup = await self.schedule_message(from_station, to_station, from_name, to_name)
+            await update.message.reply_text(message, parse_mode='Markdown', reply_markup=reply_markup)
             
         except Exception as e:
-            logger.error(f"Ошибка при получении расписания: {e}")
+            logger.error("Ошибка при получении расписания: %s", e)
             await update.message.reply_text("❌ Произошла ошибка при получении расписания")
     
     async def get_schedule(self, update: Update, context: ContextTypes.DEFAULT_TYPE, is_favorite: bool = False):
         await self.show_schedule(update, context)
     
-    async def show_tomorrow_schedule(self, update: Update, from_station: str, to_station: str, from_name: str, to_name: str):
+    async def schedule_message(self, from_station: str, to_station: str, from_name: str, to_name: str,
+                               offset: int = 0) -> tuple:
+        """(текст, inline-кнопки) расписания пары; offset — сколько ближайших поездов пропустить"""
+        # Текст зависит только от пары и минуты: время до отправления считается
+        # от середины минуты, и готовое сообщение получают все, кто смотрит эту пару
+        logs.bind(pair=f"{from_station}-{to_station}")
+        now_moscow = self.get_moscow_time().replace(second=30, microsecond=0)
+        key = (from_station, to_station, from_name, to_name, offset, now_moscow.strftime("%Y-%m-%d %H:%M"))
+        cached = self.messages.get(key)
+        if cached:
+            return cached
+        
+        # Сегодня и завтра одним окном: после последнего поезда не нужен второй запрос
+        window, stale = await self.fetch_window(from_station, to_station, now_moscow)
+        tomorrow_start = window.index_after(self.day_start(now_moscow + timedelta(days=1)))
+        
+        if not tomorrow_start:
+            message = "❌ Рейсов не найдено на сегодня", schedule_buttons(from_station, to_station, 0, False)
+            self.messages.put(key, message)
+            return message
+        
+        first_upcoming = window.index_after(now_moscow.timestamp()) + offset
+        upcoming_count = tomorrow_start - first_upcoming
+        
+        if upcoming_count <= 0:
+            try:
+                text = self.tomorrow_text(window, stale, from_name, to_name)
+            except Exception as e:
+                logger.error("Ошибка при получении расписания на завтра: %s", e)
+                return "❌ На сегодня рейсов нет, но произошла ошибка при проверке на завтра", None
+            message = text, schedule_buttons(from_station, to_station, 0, False)
+        else:
+            text = render_next_trains(window, first_upcoming, upcoming_count, from_name, to_name, now_moscow, stale)
+            message = text, schedule_buttons(from_station, to_station, offset, upcoming_count > NEXT_TRAINS)
+        self.messages.put(key, message)
+        return message
+    
+    def tomorrow_text(self, window: Timetable, stale: bool, from_name: str, to_name: str) -> str:
+        """Первые поезда завтрашнего дня из уже загруженного окна расписания"""
+        tomorrow = self.get_moscow_time() + timedelta(days=1)
+        
+        if tomorrow.strftime("%Y-%m-%d") not in window.dates:
+            raise LookupError("расписание на завтра не загружено")
+        
+        first = window.index_after(self.day_start(tomorrow))
+        last = window.index_after(self.day_start(tomorrow + timedelta(days=1)))
+        
+        if first == last:
+            return "❌ Рейсов не найдено ни на сегодня, ни на завтра"
+        return render_tomorrow(window, first, last, from_name, to_name, tomorrow, stale)
+    
+    @metrics.timed
+    async def handle_schedule_button(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Кнопки под расписанием: перерисовать то же сообщение, а не отправлять новое"""
+        query = update.callback_query
+        parsed = parse_schedule_callback(query.data or "")
+        if not parsed:
+            await query.answer()
+            return
+        
+        from_station, to_station, offset = parsed
         try:
-            tomorrow = self.get_moscow_time() + timedelta(days=1)
-            
-            params = {
-                "apikey": API_KEY,
-                "format": "json",
-                "from": from_station,
-                "to": to_station,
-                "lang": "ru_RU",
-                "date": tomorrow.strftime("%Y-%m-%d"),
-                "transport_types": "suburban",
-                "limit": 5
-            }
-            
-            response = requests.get(API_URL, params=params, timeout=10)
-            data = response.json()
-            
-            if 'segments' not in data or not data['segments']:
-                await update.message.reply_text("❌ Рейсов не найдено ни на сегодня, ни на завтра")
-                return
-            
-            message = f"🚆 *Расписание на завтра:*\n"
-            message += f"📍 *{from_name}* → *{to_name}*\n"
-            message += f"📅 *{tomorrow.strftime('%d.%m.%Y')}*\n\n"
-            
-            for segment in data['segments'][:5]:
-                departure = datetime.strptime(segment['departure'], '%Y-%m-%dT%H:%M:%S%z')
-                arrival = datetime.strptime(segment['arrival'], '%Y-%m-%dT%H:%M:%S%z')
-                
-                departure_moscow = self.format_moscow_time(departure)
-                arrival_moscow = self.format_moscow_time(arrival)
-                
-                departure_local = departure_moscow.strftime('%H:%M')
-                arrival_local = arrival_moscow.strftime('%H:%M')
-                
-                message += (
-                    f"🕐 *{departure_local}* - {arrival_local}\n"
-                    f"🚄 {segment['thread']['title']}\n"
-                    f"⏱ В пути: {segment['duration'] // 60} мин\n"
-                    f"——\n"
-                )
-            
-            await update.message.reply_text(message, parse_mode='Markdown')
-            
+            message, reply_markup = await self.schedule_message(
+                from_station, to_station, self.station_name(from_station), self.station_name(to_station), offset
+            )
         except Exception as e:
-            logger.error(f"Ошибка при получении расписания на завтра: {e}")
-            await update.message.reply_text("❌ На сегодня рейсов нет, но произошла ошибка при проверке на завтра")
+            logger.error("Ошибка при получении расписания: %s", e)
+            await query.answer("❌ Произошла ошибка при получении расписания")
+            return
+        
+        try:
+            await query.edit_message_text(message, parse_mode='Markdown', reply_markup=reply_markup)
+        except BadRequest as e:
+            # «Обновить» в ту же минуту: текст не изменился, Telegram отвечает ошибкой
+            if "not modified" not in str(e):
+                raise
+        await query.answer()
+    
+    @metrics.timed
+    async def inline_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """@бот <откуда> <куда> — расписание в любом чате; пустой запрос — сохранённые маршруты"""
+        query = update.inline_query
+        text = query.query.strip()
+        if text:
+            route = self.parse_route_query(text)
+            routes = [route] if route else []
+        else:
+            routes = [
+                (route.from_station, route.from_name, route.to_station, route.to_name)
+                for route in self.get_user_routes(query.from_user.id)[:INLINE_ROUTES]
+            ]
+        
+        results = []
+        for route, result in zip(routes, await asyncio.gather(
+            *(self.inline_result(*route) for route in routes), return_exceptions=True
+        )):
+            if isinstance(result, Exception):
+                logger.error("Ошибка при получении расписания %s → %s: %s", route[0], route[2], result)
+            else:
+                results.append(result)
+        
+        await query.answer(
+            results,
+            cache_time=INLINE_CACHE_TIME,
+            # Без запроса показываются маршруты самого пользователя
+            is_personal=not text,
+            button=None if results else InlineQueryResultsButton(text="🚆 Открыть бота", start_parameter="inline"),
+        )
+    
+    async def inline_result(self, from_station: str, from_name: str, to_station: str, to_name: str):
+        message, reply_markup = await self.schedule_message(from_station, to_station, from_name, to_name)
+        return InlineQueryResultArticle(
+            id=f"{from_station}:{to_station}",
+            title=f"{from_name} → {to_name}",
+            description="Ближайшие электрички",
+            input_message_content=InputTextMessageContent(message, parse_mode='Markdown'),
+            reply_markup=reply_markup,
+        )
+    
+    def parse_route_query(self, text: str):
+        """(код, название) отправления и назначения из «Клин Москва» или «Клин - Москва»; None, если не нашлись"""
+        for separator in ROUTE_SEPARATORS:
+            if separator in text:
+                splits = [tuple(text.split(separator, 1))]
+                break
+        else:
+            # Без разделителя перебираем, где кончается первое название
+            words = text.split()
+            splits = [(" ".join(words[:i]), " ".join(words[i:])) for i in range(1, min(len(words), INLINE_MAX_WORDS))]
+        
+        best, best_score = None, 0
+        for from_text, to_text in splits:
+            origin = self.lookup_station(from_text)
+            destination = origin and self.lookup_station(to_text)
+            if not destination or origin[0] == destination[0]:
+                continue
+            if origin[2] + destination[2] > best_score:
+                best, best_score = (origin[0], origin[1], destination[0], destination[1]), origin[2] + destination[2]
+        return best
+    
+    def lookup_station(self, name: str):
+        """(код, название, балл) лучшей станции без обращения к API; None, если не нашлась"""
+        name = name.strip().lower()
+        if not name:
+            return None
+        for title, code in POPULAR_STATIONS.items():
+            if title.lower() == name:
+                return code, title, SCORE_EXACT
+        matches = self.station_index.search(name, limit=1)
+        if matches:
+            return matches[0].code, matches[0].title, matches[0].score
+        for title, code in POPULAR_STATIONS.items():
+            if title.lower().startswith(name):
+                return code, title, SCORE_PREFIX
+        return None
+    
+    def station_name(self, code: str) -> str:
+        """Название станции по коду для кнопок, где в callback_data только коды"""
+        for title, popular_code in POPULAR_STATIONS.items():
+            if popular_code == code:
+                return title
+        return self.station_index.title(code) or code
     
     async def manage_routes(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         user_id = update.message.from_user.id
         user_routes = self.get_user_routes(user_id)
         
         if not user_routes:
-            keyboard = [["📅 Найти расписание"], ["↩️ В главное меню"]]
-            reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
             await update.message.reply_text(
                 "У вас пока нет сохраненных маршрутов.",
-                reply_markup=reply_markup
+                reply_markup=self.keyboards.no_routes
             )
             return SELECTING_ACTION
         
         # Показываем список маршрутов с кнопками удаления
-        keyboard = []
-        for i, route in enumerate(user_routes):
-            keyboard.append([f"❌ Удалить {route['name']}"])
-            keyboard.append([f"🚆 {route['name']}"])
-        
-        keyboard.append(["📅 Найти расписание", "↩️ В главное меню"])
-        
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        reply_markup = self.keyboards.manage_routes(user_routes)
         
-        routes_list = "\n".join([f"🚆 {route['name']} ({route['from_name']} → {route['to_name']})" 
+        routes_list = "\n".join([f"{route.label} ({route.from_name} → {route.to_name})"
                                for route in user_routes])
         
         await update.message.reply_text(
@@ -473,6 +844,7 @@ class YandexScheduleBot:
         
         return MANAGING_ROUTES
     
+    @metrics.timed
     async def handle_manage_routes(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         text = update.message.text
         user_id = update.message.from_user.id
@@ -486,27 +858,19 @@ class YandexScheduleBot:
         elif "удалить" in text.lower():
             # Удаление маршрута
             route_name = text.replace("❌ Удалить ", "").strip()
-            user_routes = self.get_user_routes(user_id)
-            
-            for i, route in enumerate(user_routes):
-                if route['name'] == route_name:
-                    self.delete_user_route(user_id, i)
-                    await update.message.reply_text(f"✅ Маршрут '{route_name}' удален")
-                    break
+            route = self.get_user_routes(user_id).by_name(route_name)
+            if route:
+                await self.delete_user_route(user_id, route)
+                await update.message.reply_text(f"✅ Маршрут '{route_name}' удален")
             
             return await self.manage_routes(update, context)
         
         elif text.startswith("🚆 "):
             route_name = text.replace("🚆 ", "").strip()
-            user_routes = self.get_user_routes(user_id)
-            for route in user_routes:
-                if route['name'] == route_name:
-                    context.user_data['from_station'] = route['from_station']
-                    context.user_data['from_station_name'] = route['from_name']
-                    context.user_data['to_station'] = route['to_station']
-                    context.user_data['to_station_name'] = route['to_name']
-                    await self.get_schedule(update, context, is_favorite=True)
-                    break
+            route = self.get_user_routes(user_id).by_name(route_name)
+            if route:
+                self.select_route(context, route)
+                await self.get_schedule(update, context, is_favorite=True)
             
             return await self.manage_routes(update, context)
         
@@ -514,23 +878,170 @@ class YandexScheduleBot:
             await update.message.reply_text("Пожалуйста, выберите действие из меню:")
             return MANAGING_ROUTES
     
+    @metrics.timed
     async def show_my_routes(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         return await self.manage_routes(update, context)
     
+    @metrics.timed
+    async def resolve_station(self, update: Update, context: ContextTypes.DEFAULT_TYPE, station_name: str) -> tuple:
+        """Определить станцию по введённому тексту.
+        
+        Если подходит несколько станций, показывает клавиатуру с вариантами и возвращает (None, None)
+        """
+        candidates = context.user_data.pop('station_candidates', {})
+        if station_name in candidates:
+            return candidates[station_name]
+        if station_name in POPULAR_STATIONS:
+            return POPULAR_STATIONS[station_name], station_name
+        candidates = {}
+        
+        if not self.station_index.loaded:
+            station_code, full_name = await self.search_station(station_name)
+            if not station_code:
+                await update.message.reply_text("❌ Станция не найдена. Попробуйте еще раз:")
+            return station_code, full_name
+        
+        matches = self.station_index.search(station_name, limit=STATION_CANDIDATES)
+        if not matches:
+            await update.message.reply_text("❌ Станция не найдена. Попробуйте еще раз:")
+            return None, None
+        if len(matches) == 1 or matches[0].score >= SCORE_EXACT:
+            return matches[0].code, matches[0].title
+        
+        for match in matches:
+            label = match.title
+            if match.settlement and match.settlement.lower() not in match.title.lower():
+                label = f"{match.title} ({match.settlement})"
+            candidates.setdefault(label, (match.code, match.title))
+        context.user_data['station_candidates'] = candidates
+        
+        keyboard = [[label] for label in candidates]
+        keyboard.append([BACK_BUTTON])
+        reply_markup = reply_keyboard(keyboard)
+        await update.message.reply_text(
+            "🔎 Найдено несколько станций, выберите нужную:",
+            reply_markup=reply_markup
+        )
+        return None, None
+    
+    def find_user_route(self, user_id: int, route_name: str):
+        return self.get_user_routes(user_id).by_name(route_name)
+    
+    def select_route(self, context: ContextTypes.DEFAULT_TYPE, route: Route):
+        """Подставить станции сохранённого маршрута в user_data для показа расписания"""
+        context.user_data['from_station'] = route.from_station
+        context.user_data['from_station_name'] = route.from_name
+        context.user_data['to_station'] = route.to_station
+        context.user_data['to_station_name'] = route.to_name
+    
+    async def send_alert(self, chat_id: int, text: str):
+        await self.application.bot.send_message(chat_id, text, parse_mode='Markdown', rate_limit_args=PRIORITY_ALERT)
+    
+    @metrics.timed
+    async def notify(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/notify <минуты> <маршрут> — напомнить перед ближайшей электричкой"""
+        user_id = update.message.from_user.id
+        if len(context.args) < 2 or not context.args[0].isdigit():
+            await update.message.reply_text("Использование: /notify <минуты> <название маршрута>")
+            return
+        
+        minutes = int(context.args[0])
+        route = self.find_user_route(user_id, " ".join(context.args[1:]))
+        if not route:
+            await update.message.reply_text("❌ Маршрут не найден среди сохраненных")
+            return
+        
+        try:
+            alert = await self.alerts.subscribe_before(user_id, update.effective_chat.id, route, minutes)
+        except Exception as e:
+            logger.error("Ошибка создания уведомления: %s", e)
+            await update.message.reply_text("❌ Произошла ошибка при получении расписания")
+            return
+        
+        if alert:
+            await update.message.reply_text(f"✅ {alert.describe()}")
+        else:
+            await update.message.reply_text("❌ Рейсов не найдено ни на сегодня, ни на завтра")
+    
+    @metrics.timed
+    async def digest(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/digest <ЧЧ:ММ> <маршрут> — ежедневная сводка по маршруту"""
+        user_id = update.message.from_user.id
+        try:
+            digest_time = datetime.strptime(context.args[0], "%H:%M").strftime("%H:%M")
+        except (IndexError, ValueError):
+            digest_time = None
+        if not digest_time or len(context.args) < 2:
+            await update.message.reply_text("Использование: /digest <ЧЧ:ММ> <название маршрута>")
+            return
+        
+        route = self.find_user_route(user_id, " ".join(context.args[1:]))
+        if not route:
+            await update.message.reply_text("❌ Маршрут не найден среди сохраненных")
+            return
+        
+        alert = await self.alerts.subscribe_digest(user_id, update.effective_chat.id, route, digest_time)
+        await update.message.reply_text(f"✅ {alert.describe()}")
+    
+    @metrics.timed
+    async def show_alerts(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        alerts = self.alerts.user_alerts(update.message.from_user.id)
+        if not alerts:
+            await update.message.reply_text(
+                "У вас нет уведомлений.\n"
+                "/notify <минуты> <маршрут> — напомнить перед электричкой\n"
+                "/digest <ЧЧ:ММ> <маршрут> — ежедневная сводка"
+            )
+            return
+        
+        alerts_list = "\n".join(f"{alert.id}. {alert.describe()}" for alert in alerts)
+        await update.message.reply_text(f"Ваши уведомления:\n\n{alerts_list}\n\nОтключить: /unalert <номер>")
+    
+    @metrics.timed
+    async def unalert(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if not context.args or not context.args[0].isdigit():
+            await update.message.reply_text("Использование: /unalert <номер>")
+            return
+        
+        if await self.alerts.unsubscribe(update.message.from_user.id, int(context.args[0])):
+            await update.message.reply_text("✅ Уведомление отключено")
+        else:
+            await update.message.reply_text("❌ Уведомление не найдено")
+    
+    @metrics.timed
+    async def journey(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/journey <откуда> <куда> — маршрут с пересадками по таблице рейсов, без запросов к API"""
+        if not context.args:
+            await update.message.reply_text("Использование: /journey <откуда> <куда>, например /journey Торжок Москва")
+            return
+        if not self.journeys.ready:
+            await update.message.reply_text("⏳ Таблица пересадок ещё строится, попробуйте через минуту")
+            return
+        
+        route = self.parse_route_query(" ".join(context.args))
+        stations = self.journeys.stations()
+        if not route or route[0] not in stations or route[2] not in stations:
+            names = ", ".join(sorted(self.station_name(code) for code in stations if code in POPULAR_STATIONS.values()))
+            await update.message.reply_text(f"❌ По этим станциям нет данных о пересадках. Доступны, например: {names}")
+            return
+        
+        from_station, from_name, to_station, to_name = route
+        journeys = self.journeys.plan(from_station, to_station, self.get_moscow_time().timestamp())
+        if not journeys:
+            await update.message.reply_text("❌ Рейсов не найдено ни на сегодня, ни на завтра")
+            return
+        
+        message = render_journeys(journeys, from_name, to_name, self.station_name, MOSCOW_TZ, self.journeys.stale)
+        await update.message.reply_text(message, parse_mode='Markdown')
+    
+    @metrics.timed
     async def search_station(self, station_name: str) -> tuple:
-
+        if self.station_index.loaded:
+            return self.station_index.find(station_name)
+        
+        # Справочник ещё не скачан — ищем через API
         try:
-            url = "https://api.rasp.yandex.net/v3.0/stations_list/"
-            params = {
-                "apikey": API_KEY,
-                "format": "json",
-                "lang": "ru_RU",
-                "station": station_name
-            }
-            
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
+            data = await self.yandex.stations_list(station_name, timeout=10)
             
             if data.get('countries'):
                 for country in data['countries']:
@@ -541,13 +1052,14 @@ class YandexScheduleBot:
                                     return station['codes']['yandex_code'], station['title']
             
             return None, None
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Ошибка сети при поиске станции: {e}")
+        except httpx.HTTPError as e:
+            logger.error("Ошибка сети при поиске станции: %s", e)
             return None, None
         except Exception as e:
-            logger.error(f"Ошибка при поиске станции: {e}")
+            logger.error("Ошибка при поиске станции: %s", e)
             return None, None
     
+    @metrics.timed
     async def cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         user = update.message.from_user
         logger.info("Пользователь %s отменил разговор", user.first_name)
@@ -556,7 +1068,7 @@ class YandexScheduleBot:
         
         await update.message.reply_text(
             "До свидания! Если понадобится расписание - напишите /start",
-            reply_markup=ReplyKeyboardRemove()
+            reply_markup=self.keyboards.remove
         )
         return ConversationHandler.END
     
@@ -574,9 +1086,22 @@ def main():
         print("❌ Пожалуйста, установите ваш BOT_TOKEN и API_KEY")
         return
     
+    if WEBHOOK_URL:
+        from webhook import run_cluster
+        print(f"🤖 Бот запущен в режиме webhook ({WEBHOOK_WORKERS} воркеров)...")
+        run_cluster(
+            BOT_TOKEN, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_WORKERS,
+            webhook_url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET or None,
+            settings={"API_KEY": API_KEY}
+        )
+        return
+    
     bot = YandexScheduleBot(BOT_TOKEN)
     print("🤖 Бот запущен...")
     bot.run()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    try:
+        main()
+    finally:
+        logs.shutdown()
\ No newline at end of file
@@ -0,0 +1,144 @@
+"""Защита обработчиков от повторных нажатий и потока обновлений.
+
+FloodControl стоит перед всеми обработчиками (TypeHandler в отдельной
+группе) и останавливает обновление через ApplicationHandlerStop, если:
+
+- это повтор того же текста или той же кнопки от того же пользователя в
+  пределах DUPLICATE_WINDOW — на пачку нажатий отвечаем один раз;
+- пользователь превысил RATE_LIMIT обновлений (сообщений, нажатий и
+  inline-запросов) за RATE_WINDOW секунд.
+  Окно скользящее по корзинам: на пользователя хранится номер последней
+  корзины и RATE_BUCKETS счётчиков, без списка отметок времени;
+- сообщение отправлено больше STALE_UPDATE_AGE секунд назад (например,
+  накопилось, пока бот был недоступен) — отвечать на него уже поздно.
+"""
+import logging
+import time
+from array import array
+from collections import Counter
+
+from telegram.ext import ApplicationHandlerStop
+
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_WINDOW = 2.0
+RATE_WINDOW = 60
+RATE_BUCKETS = 6
+RATE_LIMIT = 30
+STALE_UPDATE_AGE = 60
+# Как часто забывать пользователей, от которых давно ничего не было
+PRUNE_INTERVAL = 300
+
+DUPLICATE = "duplicate"
+RATE_LIMITED = "rate_limited"
+STALE = "stale"
+
+
+class _UserState:
+    __slots__ = ('last_key', 'last_at', 'bucket', 'counts', 'warned_until')
+
+    def __init__(self):
+        self.last_key = None
+        self.last_at = 0.0
+        self.bucket = 0
+        self.counts = array('H', bytes(2 * RATE_BUCKETS))
+        self.warned_until = 0.0
+
+
+class FloodControl:
+    def __init__(self, rate_limit: int = RATE_LIMIT, rate_window: float = RATE_WINDOW,
+                 duplicate_window: float = DUPLICATE_WINDOW, stale_age: float = STALE_UPDATE_AGE,
+                 clock=time.monotonic):
+        self.rate_limit = rate_limit
+        self.bucket_seconds = rate_window / RATE_BUCKETS
+        self.duplicate_window = duplicate_window
+        self.stale_age = stale_age
+        self._clock = clock
+        self._users = {}
+        self._pruned_at = clock()
+        self.dropped = Counter()
+
+    def verdict(self, user_id: int, key: tuple, sent_at: float = None):
+        """Причина отбросить обновление (DUPLICATE, RATE_LIMITED, STALE) или None.
+
+        key — что именно прислано (текст, данные кнопки, inline-запрос);
+        sent_at — время отправки по часам Telegram, если известно.
+        """
+        if sent_at is not None and time.time() - sent_at > self.stale_age:
+            return STALE
+
+        now = self._clock()
+        if now - self._pruned_at > PRUNE_INTERVAL:
+            self._prune(now)
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = _UserState()
+
+        if key == state.last_key and now - state.last_at < self.duplicate_window:
+            return DUPLICATE
+        state.last_key = key
+        state.last_at = now
+
+        bucket = int(now // self.bucket_seconds)
+        counts = state.counts
+        if bucket != state.bucket:
+            # Обнулить корзины, которые вышли из окна с прошлого обновления
+            for stale_bucket in range(max(state.bucket + 1, bucket - RATE_BUCKETS + 1), bucket + 1):
+                counts[stale_bucket % RATE_BUCKETS] = 0
+            state.bucket = bucket
+        if sum(counts) >= self.rate_limit:
+            return RATE_LIMITED
+        counts[bucket % RATE_BUCKETS] += 1
+        return None
+
+    def should_warn(self, user_id: int) -> bool:
+        """Предупредить о лимите один раз за окно, а не на каждое отброшенное сообщение"""
+        state = self._users.get(user_id)
+        now = self._clock()
+        if state is None or state.warned_until > now:
+            return False
+        state.warned_until = now + self.bucket_seconds * RATE_BUCKETS
+        return True
+
+    async def check(self, update, context):
+        """TypeHandler перед остальными обработчиками"""
+        user = update.effective_user
+        if user is None:
+            return
+        if update.message:
+            reason = self.verdict(user.id, ("message", update.message.text), update.message.date.timestamp())
+        elif update.callback_query:
+            reason = self.verdict(user.id, ("callback", update.callback_query.data))
+        elif update.inline_query:
+            # Запросы приходят на каждую букву, и каждый может загрузить расписание
+            # из API — поэтому они тоже расходуют лимит пользователя
+            reason = self.verdict(user.id, ("inline", update.inline_query.query))
+        else:
+            return
+        if reason is None:
+            return
+
+        self.dropped[reason] += 1
+        if update.callback_query:
+            # Иначе у кнопки до таймаута крутятся часики
+            await update.callback_query.answer()
+        elif reason == RATE_LIMITED and update.message and self.should_warn(user.id):
+            await update.message.reply_text("⏳ Слишком много запросов, подождите минуту")
+        raise ApplicationHandlerStop
+
+    def _prune(self, now: float):
+        self._pruned_at = now
+        horizon = now - max(self.bucket_seconds * RATE_BUCKETS, self.duplicate_window)
+        idle = [user_id for user_id, state in self._users.items()
+                if state.last_at < horizon and state.warned_until < now]
+        for user_id in idle:
+            del self._users[user_id]
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._users),
+            "duplicate": self.dropped[DUPLICATE],
+            "rate_limited": self.dropped[RATE_LIMITED],
+            "stale": self.dropped[STALE],
+        }
@@ -0,0 +1,374 @@
+"""Маршруты с пересадками по локальной таблице рейсов.
+
+Расписания пар станций коридора (все упорядоченные пары POPULAR_STATIONS)
+и сохранённых маршрутов периодически загружаются через кэш и сливаются в
+одну таблицу рейсов («связей»): станция и время отправления, станция и
+время прибытия, нитка. Связи отсортированы по отправлению и лежат в
+массивах, как в Timetable.
+
+Поиск — connection scan по раундам, как в RAPTOR: раунд k добавляет
+k-й участок пути, и садиться в нём можно только на станциях, до которых
+предыдущий раунд добрался раньше, чем удавалось до того. Так за
+max_transfers + 1 линейных проходов получаются лучшие прибытия без
+пересадок, с одной, с двумя и т.д. Запрос не обращается к API.
+
+Таблицу строит только главный воркер — фоном, со своим лимитом запросов
+(JOURNEY_RATE пар в секунду), чтобы не отнимать квоту API у ответов
+пользователям. Готовая таблица сохраняется в файл (JOURNEYS_FILE), и
+остальные воркеры, как со справочником станций, подхватывают её по
+времени изменения; после перезапуска она читается из файла сразу.
+"""
+import asyncio
+import logging
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+
+import pytz
+
+from resilience import TokenBucket
+
+
+logger = logging.getLogger(__name__)
+
+MOSCOW_TZ = pytz.timezone('Europe/Moscow')
+
+MAX_TRANSFERS = 2
+# Минимальное время на пересадку, секунды
+MIN_TRANSFER = 5 * 60
+# Как часто перестраивать таблицу и сколько пар сохранённых маршрутов в неё брать
+JOURNEY_REFRESH = 1800
+JOURNEY_MAX_PAIRS = 200
+# Фоновая сборка: пар в секунду и одновременно, чтобы квоты API хватало ответам пользователям
+JOURNEY_RATE = 2.0
+JOURNEY_CONCURRENCY = 2
+# Первая сборка после запуска — когда бот уже отвечает пользователям и кэш восстановлен из снимка
+JOURNEY_FIRST_BUILD = 120
+# Файл с готовой таблицей и как часто остальные воркеры проверяют, не обновился ли он
+JOURNEYS_FILE = "journeys.bin"
+JOURNEY_RELOAD_INTERVAL = 60
+
+TABLE_MAGIC = b"JRNTBL\0\0"
+TABLE_VERSION = 1
+# Магия, версия, устарела ли, crc32 тела, число рейсов, станций и ниток, время сборки, длина тела
+TABLE_HEADER = struct.Struct("<8sHHIIIIdQ")
+
+
+class Leg:
+    """Участок маршрута: одна поездка без пересадки"""
+    __slots__ = ('from_station', 'to_station', 'departure', 'arrival', 'title')
+
+    def __init__(self, from_station: str, to_station: str, departure: int, arrival: int, title: str):
+        self.from_station = from_station
+        self.to_station = to_station
+        self.departure = departure
+        self.arrival = arrival
+        self.title = title
+
+
+class Journey:
+    __slots__ = ('legs',)
+
+    def __init__(self, legs: list):
+        self.legs = legs
+
+    @property
+    def departure(self) -> int:
+        return self.legs[0].departure
+
+    @property
+    def arrival(self) -> int:
+        return self.legs[-1].arrival
+
+    @property
+    def transfers(self) -> int:
+        return len(self.legs) - 1
+
+
+class ConnectionTable:
+    """Все известные рейсы между парами станций, отсортированные по отправлению"""
+
+    __slots__ = ('stations', 'station_ids', 'departures', 'arrivals', 'from_ids', 'to_ids', 'title_ids', 'titles',
+                 'built_at')
+
+    def __init__(self):
+        self.stations = []
+        self.station_ids = {}
+        self.departures = array('q')
+        self.arrivals = array('q')
+        self.from_ids = array('I')
+        self.to_ids = array('I')
+        self.title_ids = array('I')
+        self.titles = []
+        self.built_at = 0.0
+
+    @classmethod
+    def build(cls, timetables) -> "ConnectionTable":
+        """Таблица из пар (откуда, куда, Timetable)"""
+        table = cls()
+        rows = []
+        title_index = {}
+        for from_station, to_station, timetable in timetables:
+            from_id = table._station_id(from_station)
+            to_id = table._station_id(to_station)
+            for i in range(len(timetable)):
+                title = timetable.title(i)
+                title_id = title_index.get(title)
+                if title_id is None:
+                    title_id = title_index[title] = len(table.titles)
+                    table.titles.append(sys.intern(title))
+                rows.append((timetable.departures[i], timetable.arrivals[i], from_id, to_id, title_id))
+        rows.sort()
+        for departure, arrival, from_id, to_id, title_id in rows:
+            table.departures.append(departure)
+            table.arrivals.append(arrival)
+            table.from_ids.append(from_id)
+            table.to_ids.append(to_id)
+            table.title_ids.append(title_id)
+        table.built_at = time.time()
+        return table
+
+    def encode(self, stale: bool = False) -> bytes:
+        """Таблица в двоичном виде: строки (u32 длина + UTF-8), затем колонки рейсов"""
+        body = bytearray()
+        for value in (*self.stations, *self.titles):
+            encoded = value.encode("utf-8")
+            body += struct.pack("<I", len(encoded)) + encoded
+        for column in (self.departures, self.arrivals, self.from_ids, self.to_ids, self.title_ids):
+            body += column.tobytes()
+        header = TABLE_HEADER.pack(TABLE_MAGIC, TABLE_VERSION, int(stale), zlib.crc32(body), len(self),
+                                   len(self.stations), len(self.titles), self.built_at, len(body))
+        return header + bytes(body)
+
+    @classmethod
+    def decode(cls, data: bytes) -> tuple:
+        """(таблица, устарела ли) из encode(); ValueError, если данные не подходят"""
+        if len(data) < TABLE_HEADER.size:
+            raise ValueError("файл таблицы обрезан")
+        magic, version, stale, checksum, count, station_count, title_count, built_at, body_length = \
+            TABLE_HEADER.unpack_from(data)
+        body = memoryview(data)[TABLE_HEADER.size:]
+        if magic != TABLE_MAGIC or version != TABLE_VERSION or len(body) != body_length \
+                or zlib.crc32(body) != checksum or sys.byteorder != "little":
+            raise ValueError("другая версия или файл повреждён")
+
+        strings = []
+        position = 0
+        for _ in range(station_count + title_count):
+            (length,) = struct.unpack_from("<I", body, position)
+            position += 4
+            strings.append(sys.intern(str(body[position:position + length], "utf-8")))
+            position += length
+
+        table = cls()
+        table.stations = strings[:station_count]
+        table.station_ids = {code: index for index, code in enumerate(table.stations)}
+        table.titles = strings[station_count:]
+        for column in (table.departures, table.arrivals, table.from_ids, table.to_ids, table.title_ids):
+            size = column.itemsize * count
+            column.frombytes(body[position:position + size])
+            position += size
+        table.built_at = built_at
+        return table, bool(stale)
+
+    def _station_id(self, code: str) -> int:
+        station_id = self.station_ids.get(code)
+        if station_id is None:
+            station_id = self.station_ids[code] = len(self.stations)
+            self.stations.append(code)
+        return station_id
+
+    def __len__(self):
+        return len(self.departures)
+
+    def _leg(self, connection: int) -> Leg:
+        return Leg(self.stations[self.from_ids[connection]], self.stations[self.to_ids[connection]],
+                   self.departures[connection], self.arrivals[connection],
+                   self.titles[self.title_ids[connection]])
+
+    def search(self, origin: str, target: str, depart_after: float, max_transfers: int = MAX_TRANSFERS,
+               min_transfer: int = MIN_TRANSFER) -> list:
+        """Лучшие по прибытию маршруты с 0..max_transfers пересадками; каждый следующий приезжает раньше"""
+        origin_id = self.station_ids.get(origin)
+        target_id = self.station_ids.get(target)
+        if origin_id is None or target_id is None or origin_id == target_id:
+            return []
+
+        departures, arrivals, from_ids, to_ids = self.departures, self.arrivals, self.from_ids, self.to_ids
+        count = len(departures)
+        # Лучшее прибытие на станцию за все раунды и время, с которого там можно сесть в следующем
+        best = {origin_id: depart_after}
+        boarding = {origin_id: depart_after}
+        parents = []
+        best_target = float('inf')
+        journeys = []
+
+        for _ in range(max_transfers + 1):
+            improved = {}
+            start = bisect_left(departures, min(boarding.values()))
+            for c in range(start, count):
+                departure = departures[c]
+                if departure >= best_target:
+                    break
+                ready = boarding.get(from_ids[c])
+                if ready is None or departure < ready:
+                    continue
+                to_id = to_ids[c]
+                arrival = arrivals[c]
+                if arrival < best.get(to_id, best_target) and (to_id not in improved or arrival < arrivals[improved[to_id]]):
+                    improved[to_id] = c
+            improved.pop(origin_id, None)
+            if not improved:
+                break
+            parents.append(improved)
+            for station_id, c in improved.items():
+                best[station_id] = arrivals[c]
+            if target_id in improved:
+                best_target = arrivals[improved[target_id]]
+                journeys.append(self._journey(parents, target_id))
+            boarding = {station_id: arrivals[c] + min_transfer for station_id, c in improved.items()
+                        if station_id != target_id}
+            if not boarding:
+                break
+        return journeys
+
+    def _journey(self, parents: list, target_id: int) -> Journey:
+        legs = []
+        station_id = target_id
+        for improved in reversed(parents):
+            c = improved[station_id]
+            legs.append(self._leg(c))
+            station_id = self.from_ids[c]
+        legs.reverse()
+        return Journey(legs)
+
+
+def write_table(path: str, data: bytes):
+    """Записать таблицу атомарно: читатели видят либо старый файл, либо новый целиком"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def read_table(path: str) -> tuple:
+    """(таблица, устарела ли, mtime файла)"""
+    with open(path, "rb") as f:
+        mtime = os.fstat(f.fileno()).st_mtime
+        data = f.read()
+    table, stale = ConnectionTable.decode(data)
+    return table, stale, mtime
+
+
+class JourneyPlanner:
+    """Держит таблицу рейсов актуальной и отвечает на запросы по ней"""
+
+    def __init__(self, fetch_window, pairs, path: str = None, rate: float = JOURNEY_RATE,
+                 concurrency: int = JOURNEY_CONCURRENCY):
+        # fetch_window(from, to, start) -> (Timetable, устарело ли); pairs() -> [(откуда, куда)]
+        self.fetch_window = fetch_window
+        self.pairs = pairs
+        # Куда сохранять собранную таблицу и откуда её читать (None — только в памяти)
+        self.path = path
+        self.rate = rate
+        self.concurrency = concurrency
+        self.table = None
+        self.stale = False
+        self.builds = 0
+        self.loads = 0
+        self.failed_pairs = 0
+        self.last_build_seconds = 0.0
+        self._mtime = None
+
+    @property
+    def ready(self) -> bool:
+        return self.table is not None
+
+    def stations(self) -> set:
+        return set(self.table.station_ids) if self.table else set()
+
+    def seconds_until_stale(self) -> float:
+        """Через сколько секунд таблицу пора перестроить (0 — её нет или она старше JOURNEY_REFRESH)"""
+        if self.table is None:
+            return 0.0
+        return max(0.0, self.table.built_at + JOURNEY_REFRESH - time.time())
+
+    async def rebuild(self):
+        started = time.perf_counter()
+        now = datetime.now(MOSCOW_TZ)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        # Свой лимит: сборка идёт фоном и не должна выбирать общую квоту API
+        limiter = TokenBucket(self.rate, 1) if self.rate > 0 else None
+
+        async def fetch(from_station: str, to_station: str):
+            async with semaphore:
+                if limiter is not None:
+                    await limiter.acquire()
+                return await self.fetch_window(from_station, to_station, now)
+
+        pairs = self.pairs()
+        results = await asyncio.gather(*(fetch(*pair) for pair in pairs), return_exceptions=True)
+        timetables = []
+        stale = False
+        failed = 0
+        for (from_station, to_station), result in zip(pairs, results):
+            if isinstance(result, Exception):
+                failed += 1
+                continue
+            window, window_stale = result
+            stale = stale or window_stale
+            timetables.append((from_station, to_station, window))
+        if not timetables:
+            logger.error("Таблица пересадок не построена: нет ни одного расписания из %d пар", len(pairs))
+            return
+
+        self.table = table = ConnectionTable.build(timetables)
+        self.stale = stale
+        self.failed_pairs = failed
+        self.builds += 1
+        self.last_build_seconds = time.perf_counter() - started
+        logger.info("Таблица пересадок: %d рейсов, %d станций, пар без расписания: %d",
+                    len(table), len(table.stations), failed)
+        if self.path:
+            await asyncio.to_thread(write_table, self.path, table.encode(stale))
+            self._mtime = os.path.getmtime(self.path)
+
+    async def rebuild_job(self, context):
+        try:
+            await self.rebuild()
+        except Exception as e:
+            logger.error("Ошибка построения таблицы пересадок: %s", e)
+
+    async def load(self) -> bool:
+        """Прочитать таблицу из файла, если он изменился с прошлого раза; False — таблица прежняя"""
+        if not self.path or not os.path.exists(self.path) or os.path.getmtime(self.path) == self._mtime:
+            return False
+        try:
+            table, stale, mtime = await asyncio.to_thread(read_table, self.path)
+        except (OSError, ValueError, struct.error) as e:
+            logger.error("Таблица пересадок %s пропущена: %s", self.path, e)
+            return False
+        self.table = table
+        self.stale = stale
+        self._mtime = mtime
+        self.loads += 1
+        logger.info("Таблица пересадок загружена из файла: %d рейсов, %d станций", len(table), len(table.stations))
+        return True
+
+    async def reload_job(self, context):
+        try:
+            await self.load()
+        except Exception as e:
+            logger.error("Ошибка загрузки таблицы пересадок: %s", e)
+
+    def plan(self, origin: str, target: str, depart_after: float = None, max_transfers: int = MAX_TRANSFERS,
+             min_transfer: int = MIN_TRANSFER) -> list:
+        if self.table is None:
+            return []
+        return self.table.search(origin, target, time.time() if depart_after is None else depart_after,
+                                 max_transfers, min_transfer)
@@ -0,0 +1,214 @@
+"""Неблокирующее структурированное логирование.
+
+Логгеры на цикле событий только кладут запись в очередь (QueueHandler),
+а форматирует и пишет её поток QueueListener: медленный stdout (например,
+log driver Docker) не задерживает ответы. Сообщение из msg % args тоже
+собирается в потоке записи, поэтому вызов logger.info("... %s", x) на
+цикле стоит одного LogRecord, а при выключенном уровне — одной проверки.
+
+Записи получают поля текущего обработчика (FIELDS): user_id и handler
+кладёт metrics.timed, pair — bind() в обработчике. Поля хранятся в
+contextvar: PTB обрабатывает обновление в одной задаче, и они видны всем
+записям из неё. В JSON это отдельные ключи, в тексте — хвост [ключ=значение].
+
+Завершение обработчика (событие на каждое обновление) пишется выборочно:
+каждое HANDLER_SAMPLE-е, а медленные и упавшие — всегда.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import queue
+from collections import Counter
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+
+logger = logging.getLogger(__name__)
+events_logger = logging.getLogger("bot.handlers")
+
+LOG_JSON = True
+LOG_LEVEL = logging.INFO
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Если поток записи не успевает, новые записи отбрасываются, а не копятся в памяти
+LOG_QUEUE_SIZE = 10000
+# Каждое какое завершение обработчика писать; медленнее SLOW_HANDLER — всегда
+HANDLER_SAMPLE = 20
+SLOW_HANDLER = 1.0
+
+FIELDS = ("user_id", "handler", "pair", "duration_ms", "sample_rate")
+
+_context = contextvars.ContextVar("log_context", default={})
+_exc_formatter = logging.Formatter()
+
+
+def bind(**fields) -> contextvars.Token:
+    """Добавить поля ко всем следующим записям текущей задачи"""
+    return _context.set({**_context.get(), **fields})
+
+
+def reset(token: contextvars.Token):
+    _context.reset(token)
+
+
+def bind_handler(name: str, args: tuple) -> contextvars.Token:
+    """Поля обработчика name(self, update, context); пользователь — из update, если он есть"""
+    fields = {**_context.get(), "handler": name}
+    user = getattr(args[1], "effective_user", None) if len(args) > 1 else None
+    if user is not None:
+        fields["user_id"] = user.id
+    return _context.set(fields)
+
+
+class Sampler:
+    """Пропускает первое и далее каждое every-е событие каждого вида"""
+
+    def __init__(self, every: int):
+        self.every = every
+        self._seen = Counter()
+
+    def sample(self, kind: str) -> bool:
+        seen = self._seen[kind]
+        self._seen[kind] = seen + 1
+        return seen % self.every == 0
+
+
+HANDLER_SAMPLER = Sampler(HANDLER_SAMPLE)
+
+
+def handler_finished(name: str, seconds: float, failed: bool = False):
+    """Событие завершения обработчика (вызывается из metrics.timed)"""
+    if not events_logger.isEnabledFor(logging.INFO):
+        return
+    duration_ms = round(seconds * 1000, 1)
+    if failed:
+        events_logger.warning("%s завершился ошибкой за %.1f мс", name, duration_ms,
+                              extra={"duration_ms": duration_ms})
+    elif seconds >= SLOW_HANDLER:
+        events_logger.warning("%s выполнялся %.1f мс", name, duration_ms, extra={"duration_ms": duration_ms})
+    elif HANDLER_SAMPLER.sample(name):
+        events_logger.info("%s: %.1f мс", name, duration_ms,
+                           extra={"duration_ms": duration_ms, "sample_rate": HANDLER_SAMPLER.every})
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна строка JSON на запись"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in FIELDS:
+            value = record.__dict__.get(field)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Прежний текстовый формат с полями обработчика в конце строки"""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        text = super().formatMessage(record)
+        fields = " ".join(f"{field}={record.__dict__[field]}" for field in FIELDS
+                          if record.__dict__.get(field) is not None)
+        return f"{text} [{fields}]" if fields else text
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler, который не форматирует запись на цикле событий"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Стандартный prepare собирает сообщение здесь же; нам нужно только
+        # снять поля контекста, пока запись ещё в своей задаче. Аргументы
+        # читаются позже в другом потоке — в лог передаются строки и числа.
+        fields = _context.get()
+        if fields:
+            for key, value in fields.items():
+                record.__dict__.setdefault(key, value)
+        if record.exc_info:
+            # Трейсбек держит кадры стека живыми — его текст собирается сразу
+            record.exc_text = _exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        # SimpleQueue без блокировок Queue; предел проверяется приблизительно
+        if self.queue.qsize() >= LOG_QUEUE_SIZE:
+            self.dropped += 1
+        else:
+            self.queue.put_nowait(record)
+
+
+_listener = None
+_queue_handler = None
+
+
+def setup(json_format: bool = None, level: int = None, stream=None) -> DeferredQueueHandler:
+    """Направить корневой логгер в очередь и запустить поток записи (вместо logging.basicConfig)"""
+    global _listener, _queue_handler
+    shutdown()
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter() if (LOG_JSON if json_format is None else json_format) else TextFormatter())
+    log_queue = queue.SimpleQueue()
+    _queue_handler = DeferredQueueHandler(log_queue)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(_queue_handler)
+    root.setLevel(LOG_LEVEL if level is None else level)
+    # Поток и процесс в форматах не выводятся — не собирать их для каждой записи
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    _listener = QueueListener(log_queue, output)
+    _listener.start()
+    return _queue_handler
+
+
+def shutdown():
+    """Дописать очередь и остановить поток; дальше записи пишутся напрямую"""
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    listener, handler = _listener, _queue_handler
+    _listener = _queue_handler = None
+    listener.stop()
+    root = logging.getLogger()
+    root.removeHandler(handler)
+    for output in listener.handlers:
+        try:
+            output.flush()
+        except ValueError:
+            # Поток вывода уже закрыт (при выходе) — писать больше некуда
+            continue
+        root.addHandler(output)
+    if handler.dropped:
+        logger.warning("Отброшено записей лога при переполнении очереди: %d", handler.dropped)
+
+
+atexit.register(shutdown)
+
+
+def stats() -> dict:
+    handler = _queue_handler
+    return {
+        "queued": handler.queue.qsize() if handler else 0,
+        "dropped": handler.dropped if handler else 0,
+    }
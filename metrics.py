@@ -0,0 +1,341 @@
+"""Метрики бота в формате Prometheus и профилировщик по выборкам.
+
+Метрики собираются, только если вызван `enable()` (в bot.py — при заданном
+METRICS_PORT); иначе обёртки обработчиков только передают время в logs.
+Счётчики компонентов (кэш, хранилища) не дублируются: их читают коллекторы
+в момент запроса /metrics.
+
+Эндпоинты MetricsServer:
+    GET /metrics           — метрики в текстовом формате Prometheus
+    GET /profiler/start    — включить профилировщик
+    GET /profiler/stop     — выключить
+    GET /profiler          — накопленные стеки в формате collapsed (flamegraph.pl, speedscope)
+"""
+import asyncio
+import functools
+import logging
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as StackCounter
+
+import logs
+
+
+logger = logging.getLogger(__name__)
+
+METRICS_LISTEN = "127.0.0.1"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+LAG_INTERVAL = 0.5
+PROFILER_INTERVAL = 0.005
+PROFILER_MAX_DEPTH = 64
+
+ENABLED = False
+
+
+def enable():
+    global ENABLED
+    ENABLED = True
+
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label_values -> [счётчики по корзинам (последняя — +Inf), сумма, количество]
+        self._series = {}
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, label_values, le)} {cumulative}")
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """Набор метрик и коллекторов.
+
+    Коллектор — функция без аргументов, возвращающая список
+    (имя, тип, описание, значение) для значений, которые компоненты и так
+    считают сами.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                logger.error("Ошибка сбора метрик: %s", e)
+                continue
+            for name, kind, help, value in samples:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.histogram(
+    "bot_handler_seconds", "Время работы обработчиков и поиска станций", ("handler",)
+)
+HANDLER_ERRORS = REGISTRY.counter(
+    "bot_handler_errors_total", "Исключения, вылетевшие из обработчиков", ("handler",)
+)
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    "yandex_request_seconds", "Длительность одной попытки запроса к API Яндекс.Расписаний", ("endpoint",)
+)
+UPSTREAM_RESPONSES = REGISTRY.counter(
+    "yandex_responses_total", "Ответы API Яндекс.Расписаний по кодам (error — сетевая ошибка)", ("endpoint", "status")
+)
+STORE_FLUSH_SECONDS = REGISTRY.histogram(
+    "store_flush_seconds", "Длительность сброса отложенных изменений в SQLite", ("store",)
+)
+TELEGRAM_SEND_SECONDS = REGISTRY.histogram(
+    "telegram_send_seconds", "Время от постановки запроса к Bot API в очередь до ответа", ("priority",)
+)
+LOOP_LAG_SECONDS = REGISTRY.histogram(
+    "event_loop_lag_seconds", "Опоздание пробуждения таймера в цикле событий", buckets=LAG_BUCKETS
+)
+
+
+def timed(func):
+    """Записывать время работы корутины в bot_handler_seconds{handler=<имя функции>}.
+
+    Заодно обёртка даёт записям лога поля handler и user_id и сообщает
+    logs о завершении обработчика (в лог попадает выборка).
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = logs.bind_handler(name, args)
+        started = time.perf_counter()
+        failed = False
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            failed = True
+            if ENABLED:
+                HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            if ENABLED:
+                HANDLER_SECONDS.observe(elapsed, name)
+            logs.handler_finished(name, elapsed, failed)
+            logs.reset(token)
+
+    return wrapper
+
+
+class LoopLagMonitor:
+    """Периодически засыпает на interval и замеряет, насколько позже цикл событий его разбудил"""
+
+    def __init__(self, interval: float = LAG_INTERVAL):
+        self.interval = interval
+        self.last_lag = 0.0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, loop.time() - started - self.interval)
+            LOOP_LAG_SECONDS.observe(self.last_lag)
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class SamplingProfiler:
+    """Профилировщик по выборкам: фоновый поток раз в interval снимает стек
+    потока цикла событий. Выключенный ничего не стоит; включённый — один
+    обход стека на выборку."""
+
+    def __init__(self, interval: float = PROFILER_INTERVAL):
+        self.interval = interval
+        self.stacks = StackCounter()
+        self.samples = 0
+        self._thread_id = None
+        self._stop = None
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, thread_id: int = None):
+        if self.running:
+            return
+        self._thread_id = thread_id or threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self._thread.start()
+        logger.info("Профилировщик включён")
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        logger.info("Профилировщик выключен, выборок: %d", self.samples)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None and len(stack) < PROFILER_MAX_DEPTH:
+                code = frame.f_code
+                stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def reset(self):
+        self.stacks.clear()
+        self.samples = 0
+
+
+class MetricsServer:
+    """HTTP-эндпоинт с метриками и управлением профилировщиком"""
+
+    def __init__(self, registry: Registry = REGISTRY, profiler: SamplingProfiler = None):
+        self.registry = registry
+        self.profiler = profiler or SamplingProfiler()
+        self.lag_monitor = LoopLagMonitor()
+        self._server = None
+
+    async def start(self, port: int, host: str = METRICS_LISTEN):
+        enable()
+        self.registry.add_collector(self.collect)
+        self.lag_monitor.start()
+        self._server = await asyncio.start_server(self.handle_connection, host, port)
+        logger.info("Метрики доступны на http://%s:%d/metrics", host, port)
+
+    async def stop(self):
+        self.lag_monitor.stop()
+        self.profiler.stop()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def collect(self) -> list:
+        return [
+            ("event_loop_lag_last_seconds", "gauge", "Последнее измеренное опоздание цикла событий",
+             self.lag_monitor.last_lag),
+            ("profiler_running", "gauge", "Включён ли профилировщик", int(self.profiler.running)),
+            ("profiler_samples_total", "counter", "Выборки профилировщика", self.profiler.samples),
+        ]
+
+    def route(self, path: str) -> tuple:
+        if path == "/metrics":
+            return 200, "text/plain; version=0.0.4", self.registry.render()
+        if path == "/profiler/start":
+            # Выборки снимаются с потока, в котором работает цикл событий
+            self.profiler.reset()
+            self.profiler.start(threading.get_ident())
+            return 200, "text/plain", "profiler started\n"
+        if path == "/profiler/stop":
+            self.profiler.stop()
+            return 200, "text/plain", "profiler stopped\n"
+        if path == "/profiler":
+            return 200, "text/plain", self.profiler.collapsed()
+        return 404, "text/plain", "not found\n"
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) < 2 or parts[0] != "GET":
+                status, content_type, body = 405, "text/plain", "method not allowed\n"
+            else:
+                status, content_type, body = self.route(parts[1].split("?", 1)[0])
+            payload = body.encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                f"Content-Type: {content_type}; charset=utf-8\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + payload
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,212 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+CONVERSATIONS_DB = "conversations.db"
+# Версия python-telegram-bot, на закрытые поля которой опирается restore_conversations
+PTB_VERSION = "22.5"
+# Как часто Application передаёт изменённые user_data и состояния диалогов в persistence
+UPDATE_INTERVAL = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (name, key)
+);
+CREATE INDEX IF NOT EXISTS conversations_user ON conversations (user_id);
+"""
+
+
+def restore_conversations(handler: ConversationHandler, states: dict):
+    """Положить загруженные состояния диалогов в ConversationHandler.
+
+    Публичного способа нет: Application заполняет состояния только при старте,
+    из get_conversations. Это единственное место, где код трогает закрытый
+    handler._conversations (TrackingDict PTB); update_no_track не помечает ключи
+    изменёнными, и загруженное состояние не записывается обратно. Версия PTB
+    закреплена (PTB_VERSION, requirements.txt) и проверяется в tests/test_persistence.py.
+    """
+    handler._conversations.update_no_track(states)
+
+
+class SQLitePersistence(BasePersistence):
+    """user_data и состояния ConversationHandler в SQLite с ленивой загрузкой.
+
+    При старте ничего не читается: данные пользователя подгружаются
+    `load_user` перед обработкой его первого обновления, поэтому время
+    запуска не зависит от числа пользователей. Изменения копятся в памяти,
+    неизменившиеся user_data отбрасываются, а изменённые записываются одной
+    транзакцией в отдельном потоке.
+    """
+
+    def __init__(self, path: str = CONVERSATIONS_DB, update_interval: float = UPDATE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persistence")
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._loaded_users = set()
+        # Последнее сохранённое состояние user_data — чтобы не писать то, что не менялось
+        self._saved_user_data = {}
+        self._dirty_users = {}
+        self._dirty_conversations = {}
+        self._flush_task = None
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.last_flush_seconds = 0.0
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _load_user(self, user_id: int) -> tuple:
+        row = self._conn.execute("SELECT data FROM user_data WHERE user_id = ?", (user_id,)).fetchone()
+        conversations = self._conn.execute(
+            "SELECT name, key, state FROM conversations WHERE user_id = ?", (user_id,)
+        ).fetchall()
+        return (row[0] if row else None), conversations
+
+    async def load_user(self, user_id: int):
+        """user_data и состояния диалогов пользователя, если они ещё не загружены; иначе None"""
+        if user_id in self._loaded_users:
+            return None
+        # Пометка только после успешного чтения: при ошибке следующее обновление
+        # попробует снова. Одновременных загрузок одного пользователя не бывает —
+        # его обновления обрабатываются по очереди (PerUserUpdateProcessor)
+        data, rows = await self._run(self._load_user, user_id)
+        self._loaded_users.add(user_id)
+        # Пустые user_data нового пользователя записывать незачем
+        self._saved_user_data[user_id] = data if data is not None else "{}"
+        conversations = {}
+        for name, key, state in rows:
+            conversations.setdefault(name, {})[tuple(json.loads(key))] = json.loads(state)
+        return (json.loads(data) if data is not None else {}), conversations
+
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    def _schedule_flush(self):
+        # Application передаёт изменения пачкой за один проход цикла событий;
+        # запись запускается один раз после того, как пачка собрана
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_dirty())
+
+    async def update_conversation(self, name: str, key: tuple, new_state) -> None:
+        self._dirty_conversations[(name, json.dumps(key))] = (key[-1], new_state)
+        self._schedule_flush()
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        serialized = json.dumps(data, ensure_ascii=False, sort_keys=True)
+        if self._saved_user_data.get(user_id) == serialized:
+            return
+        self._saved_user_data[user_id] = serialized
+        self._dirty_users[user_id] = serialized
+        self._schedule_flush()
+
+    async def update_chat_data(self, chat_id: int, data) -> None:
+        pass
+
+    async def update_bot_data(self, data) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._saved_user_data.pop(user_id, None)
+        self._dirty_users[user_id] = None
+        self._schedule_flush()
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        pass
+
+    def _write(self, users: dict, conversations: dict):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO user_data VALUES (?, ?)",
+                [(user_id, data) for user_id, data in users.items() if data is not None]
+            )
+            self._conn.executemany(
+                "DELETE FROM user_data WHERE user_id = ?",
+                [(user_id,) for user_id, data in users.items() if data is None]
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO conversations VALUES (?, ?, ?, ?)",
+                [(name, key, user_id, json.dumps(state))
+                 for (name, key), (user_id, state) in conversations.items() if state is not None]
+            )
+            self._conn.executemany(
+                "DELETE FROM conversations WHERE name = ? AND key = ?",
+                [(name, key) for (name, key), (_, state) in conversations.items() if state is None]
+            )
+
+    async def _flush_dirty(self):
+        while self._dirty_users or self._dirty_conversations:
+            users, self._dirty_users = self._dirty_users, {}
+            conversations, self._dirty_conversations = self._dirty_conversations, {}
+            started = time.perf_counter()
+            try:
+                await self._run(self._write, users, conversations)
+            except Exception as e:
+                logger.error("Ошибка сохранения состояния диалогов: %s", e)
+                # Вернуть пачку, не затирая более новые изменения
+                users.update(self._dirty_users)
+                conversations.update(self._dirty_conversations)
+                self._dirty_users, self._dirty_conversations = users, conversations
+                return
+            self.flushes += 1
+            self.flushed_rows += len(users) + len(conversations)
+            self.last_flush_seconds = time.perf_counter() - started
+            if metrics.ENABLED:
+                metrics.STORE_FLUSH_SECONDS.observe(self.last_flush_seconds, "conversations")
+
+    async def flush(self) -> None:
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._flush_dirty()
+
+    def close(self):
+        self._executor.shutdown()
+        self._conn.close()
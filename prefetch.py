@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+from zoneinfo import ZoneInfo
+
+
+logger = logging.getLogger(__name__)
+
+MOSCOW_ZONE = ZoneInfo('Europe/Moscow')
+
+# Часы пик по Москве: (начало пика, конец пика); прогрев должен закончиться к началу
+PEAK_WINDOWS = [
+    (dt_time(6, 0), dt_time(10, 0)),
+    (dt_time(16, 0), dt_time(20, 0)),
+]
+# Сколько запросов к API в секунду может тратить прогрев и сколько пар он обходит
+PREFETCH_RATE = 2.0
+PREFETCH_MAX_PAIRS = 500
+PREFETCH_DAYS = 2
+# Запас к оценке длительности прогрева (ответы API, повторы)
+PREFETCH_MARGIN = 120
+
+
+class RoutePrefetcher:
+    """Прогрев кэша расписаний по сохранённым маршрутам перед часами пик.
+
+    Пары станций всех пользователей объединяются, самые популярные (по числу
+    пользователей) обновляются первыми; запросы к API идут не чаще `rate` в
+    секунду. Прогретые записи живут до конца окна пика.
+
+    Прогрев начинается заранее: за lead_time до пика, которое оценивается
+    по числу пар и лимиту rate. Ежедневная задача срабатывает за время
+    самого долгого прогрева (max_pairs пар) и откладывает сам прогрев
+    так, чтобы он закончился к началу пика.
+    """
+
+    def __init__(self, refresh, pair_counts, rate: float = PREFETCH_RATE,
+                 max_pairs: int = PREFETCH_MAX_PAIRS, days: int = PREFETCH_DAYS):
+        # refresh(from_station, to_station, date, ttl) — загрузить расписание в кэш
+        self.refresh = refresh
+        self.pair_counts = pair_counts
+        self.rate = rate
+        self.max_pairs = max_pairs
+        self.days = days
+        self.runs = 0
+        self.fetched = 0
+        self.failed = 0
+
+    def lead_time(self, pairs: int) -> float:
+        """За сколько секунд до пика начинать прогрев pairs пар"""
+        if self.rate <= 0:
+            return PREFETCH_MARGIN
+        return pairs * self.days / self.rate + PREFETCH_MARGIN
+
+    def schedule(self, job_queue):
+        longest = timedelta(seconds=self.lead_time(self.max_pairs))
+        for start, end in PEAK_WINDOWS:
+            planned_at = (datetime.combine(date.today(), start) - longest).time()
+            job_queue.run_daily(
+                self.plan_job,
+                time=planned_at.replace(tzinfo=MOSCOW_ZONE),
+                data=(start, end),
+                name=f"prefetch-{start:%H%M}",
+            )
+
+    async def plan_job(self, context):
+        """Отложить прогрев так, чтобы при текущем числе пар он закончился к началу пика"""
+        start, end = context.job.data
+        now = datetime.now(MOSCOW_ZONE)
+        peak_start = datetime.combine(now.date(), start, MOSCOW_ZONE)
+        if peak_start < now - timedelta(hours=12):
+            # Задача сработала до полуночи, а пик — уже завтра
+            peak_start += timedelta(days=1)
+        delay = (peak_start - now).total_seconds() - self.lead_time(len(self.plan()))
+        context.job_queue.run_once(self.prefetch_job, when=max(0.0, delay), data=(peak_start.date(), end),
+                                   name=f"prefetch-run-{start:%H%M}")
+
+    async def prefetch_job(self, context):
+        peak_date, end = context.job.data
+        peak_end = datetime.combine(peak_date, end, MOSCOW_ZONE)
+        await self.prefetch(ttl=max(60.0, (peak_end - datetime.now(MOSCOW_ZONE)).total_seconds()), today=peak_date)
+
+    def plan(self) -> list:
+        """Пары станций в порядке убывания числа пользователей"""
+        counts = self.pair_counts()
+        pairs = sorted(counts, key=lambda pair: counts[pair], reverse=True)
+        return pairs[:self.max_pairs]
+
+    async def prefetch(self, ttl: float, today: date = None) -> int:
+        today = today or datetime.now(MOSCOW_ZONE).date()
+        dates = [(today + timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(self.days)]
+        pairs = self.plan()
+        interval = 1.0 / self.rate if self.rate > 0 else 0.0
+        started = time.perf_counter()
+        fetched = 0
+
+        for from_station, to_station in pairs:
+            for day in dates:
+                request_started = time.monotonic()
+                try:
+                    await self.refresh(from_station, to_station, day, ttl)
+                    fetched += 1
+                except Exception as e:
+                    self.failed += 1
+                    logger.warning("Не удалось прогреть %s → %s на %s: %s", from_station, to_station, day, e)
+                delay = interval - (time.monotonic() - request_started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+        self.runs += 1
+        self.fetched += fetched
+        logger.info(
+            "Прогрев расписаний: %d пар, %d запросов за %.1f с",
+            len(pairs), fetched, time.perf_counter() - started
+        )
+        return fetched
@@ -0,0 +1,212 @@
+"""Готовые клавиатуры и шаблоны сообщений с расписанием.
+
+Клавиатуры неизменяемы (ReplyKeyboardMarkup в PTB заморожен), поэтому
+строятся один раз: общие — при запуске, пользовательские — при первом
+показе и сбрасываются при изменении маршрутов. Сообщения с расписанием
+собираются из заранее разобранных шаблонов за один проход, а готовый
+текст переиспользуется для всех, кто в ту же минуту смотрит ту же пару.
+
+Под сообщением с расписанием — inline-кнопки «обновить», «позже» и
+«обратно». В callback_data лежит всё нужное для перерисовки
+(«sch:откуда:куда:сдвиг»), так что нажатие обрабатывается без состояния
+диалога и правит то же сообщение.
+"""
+from collections import OrderedDict
+from datetime import datetime
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove
+
+
+# Сколько готовых сообщений держать (пары × минуты)
+MESSAGE_CACHE_SIZE = 4096
+NEXT_TRAINS = 8
+TOMORROW_TRAINS = 5
+
+BACK_BUTTON = "↩️ Назад"
+STALE_NOTE = "\n⚠️ _Сервис расписаний не отвечает, данные могут быть устаревшими_"
+
+NEXT_TRAINS_HEADER = (
+    "🚆 *Расписание электричек:*\n"
+    "📍 *{from_name}* → *{to_name}*\n"
+    "📅 *{date}*\n"
+    "🕐 *Текущее время: {time}*\n\n"
+).format
+TOMORROW_HEADER = (
+    "🚆 *Расписание на завтра:*\n"
+    "📍 *{from_name}* → *{to_name}*\n"
+    "📅 *{date}*\n\n"
+).format
+TRAIN_ROW = "🕐 *{}* - {}\n🚄 {}\n⏱ В пути: {} мин\n".format
+UNTIL_HOURS = "⏳ Через {}ч {}мин\n——\n".format
+UNTIL_MINUTES = "⏳ Через {}мин\n——\n".format
+ROW_END = "——\n"
+MORE_TRAINS = "\n... и еще {} рейсов".format
+JOURNEYS_HEADER = (
+    "🧭 *Маршруты с пересадками:*\n"
+    "📍 *{from_name}* → *{to_name}*\n"
+    "📅 *{date}*\n\n"
+).format
+JOURNEY_SUMMARY = "🕐 *{}* → *{}*, в пути {}, {}\n".format
+JOURNEY_LEG = "🚄 {} {} → {} {}\n      {}\n".format
+JOURNEY_TRANSFER = "🔄 Пересадка в {}: {} мин\n".format
+
+REMOVE_KEYBOARD = ReplyKeyboardRemove()
+
+SCHEDULE_CALLBACK = "sch"
+# Telegram ограничивает callback_data 64 байтами
+CALLBACK_DATA_LIMIT = 64
+
+
+def reply_keyboard(rows: list) -> ReplyKeyboardMarkup:
+    return ReplyKeyboardMarkup(rows, resize_keyboard=True)
+
+
+class Keyboards:
+    """Клавиатуры бота: общие строятся в конструкторе, пользовательские кэшируются в UserRoutes.keyboards"""
+
+    def __init__(self, popular_stations):
+        station_rows = [[station] for station in popular_stations]
+        self.stations = reply_keyboard(station_rows + [[BACK_BUTTON]])
+        self.save_route = reply_keyboard([["💾 Сохранить маршрут"], ["❌ Не сохранять"]])
+        self.no_routes = reply_keyboard([["📅 Найти расписание"], ["↩️ В главное меню"]])
+        self.main_menu_empty = reply_keyboard([["📅 Получить расписание"], ["⭐ Добавить маршрут"]])
+        self.remove = REMOVE_KEYBOARD
+
+    def main_menu(self, routes) -> ReplyKeyboardMarkup:
+        if not routes:
+            return self.main_menu_empty
+        keyboard = routes.keyboards.get("main")
+        if keyboard is None:
+            rows = [["📅 Получить расписание"], ["⭐ Мои маршруты"]]
+            rows.extend([route.label] for route in routes[:3])
+            keyboard = routes.keyboards["main"] = reply_keyboard(rows)
+        return keyboard
+
+    def manage_routes(self, routes) -> ReplyKeyboardMarkup:
+        keyboard = routes.keyboards.get("manage")
+        if keyboard is None:
+            rows = []
+            for route in routes:
+                rows.append([f"❌ Удалить {route.name}"])
+                rows.append([route.label])
+            rows.append(["📅 Найти расписание", "↩️ В главное меню"])
+            keyboard = routes.keyboards["manage"] = reply_keyboard(rows)
+        return keyboard
+
+
+def schedule_callback(from_station: str, to_station: str, offset: int = 0) -> str:
+    return f"{SCHEDULE_CALLBACK}:{from_station}:{to_station}:{offset}"
+
+
+def parse_schedule_callback(data: str):
+    """(откуда, куда, сдвиг) из callback_data кнопки расписания; None, если данные не наши"""
+    parts = data.split(":")
+    if len(parts) != 4 or parts[0] != SCHEDULE_CALLBACK or not parts[3].isdigit():
+        return None
+    return parts[1], parts[2], int(parts[3])
+
+
+def schedule_buttons(from_station: str, to_station: str, offset: int, has_more: bool):
+    """Кнопки под расписанием: обновить, следующие поезда, обратное направление"""
+    if len(schedule_callback(from_station, to_station, offset + NEXT_TRAINS)) > CALLBACK_DATA_LIMIT:
+        return None
+    row = [InlineKeyboardButton("🔄 Обновить", callback_data=schedule_callback(from_station, to_station, offset))]
+    if offset:
+        row.insert(0, InlineKeyboardButton("⏪ Ближайшие", callback_data=schedule_callback(from_station, to_station)))
+    if has_more:
+        row.append(InlineKeyboardButton("⏩ Позже", callback_data=schedule_callback(from_station, to_station,
+                                                                                  offset + NEXT_TRAINS)))
+    reverse = [InlineKeyboardButton("🔁 Обратно", callback_data=schedule_callback(to_station, from_station))]
+    return InlineKeyboardMarkup([row, reverse])
+
+
+def render_next_trains(window, first: int, count: int, from_name: str, to_name: str, now_moscow, stale: bool) -> str:
+    """Ближайшие поезда: индексы first..first+count-1 окна, время до отправления от now_moscow"""
+    now_timestamp = now_moscow.timestamp()
+    departures, arrival_text, departure_text = window.departures, window.arrival_text, window.departure_text
+    parts = [NEXT_TRAINS_HEADER(from_name=from_name, to_name=to_name,
+                                date=now_moscow.strftime('%d.%m.%Y'), time=now_moscow.strftime('%H:%M'))]
+    for i in range(first, first + min(NEXT_TRAINS, count)):
+        parts.append(TRAIN_ROW(departure_text[i], arrival_text[i], window.title(i), window.durations[i] // 60))
+        hours_until, minutes_until = divmod(int((departures[i] - now_timestamp) // 60), 60)
+        parts.append(UNTIL_HOURS(hours_until, minutes_until) if hours_until > 0 else UNTIL_MINUTES(minutes_until))
+    if count > NEXT_TRAINS:
+        parts.append(MORE_TRAINS(count - NEXT_TRAINS))
+    if stale:
+        parts.append(STALE_NOTE)
+    return "".join(parts)
+
+
+def render_tomorrow(window, first: int, last: int, from_name: str, to_name: str, tomorrow, stale: bool) -> str:
+    """Первые поезда завтрашнего дня: индексы first..last-1 окна"""
+    parts = [TOMORROW_HEADER(from_name=from_name, to_name=to_name, date=tomorrow.strftime('%d.%m.%Y'))]
+    for i in range(first, min(first + TOMORROW_TRAINS, last)):
+        parts.append(TRAIN_ROW(window.departure_text[i], window.arrival_text[i], window.title(i),
+                               window.durations[i] // 60))
+        parts.append(ROW_END)
+    if stale:
+        parts.append(STALE_NOTE)
+    return "".join(parts)
+
+
+def moscow_hhmm(timestamp: int, tz) -> str:
+    return datetime.fromtimestamp(timestamp, tz).strftime('%H:%M')
+
+
+def transfers_text(transfers: int) -> str:
+    if transfers == 0:
+        return "без пересадок"
+    if transfers == 1:
+        return "1 пересадка"
+    return f"{transfers} пересадки" if transfers < 5 else f"{transfers} пересадок"
+
+
+def duration_text(seconds: int) -> str:
+    hours, minutes = divmod(seconds // 60, 60)
+    return f"{hours}ч {minutes}мин" if hours else f"{minutes}мин"
+
+
+def render_journeys(journeys: list, from_name: str, to_name: str, station_name, tz, stale: bool) -> str:
+    """Варианты маршрута с пересадками; station_name(code) — название станции по коду"""
+    parts = [JOURNEYS_HEADER(from_name=from_name, to_name=to_name,
+                             date=datetime.fromtimestamp(journeys[0].departure, tz).strftime('%d.%m.%Y'))]
+    for journey in journeys:
+        parts.append(JOURNEY_SUMMARY(moscow_hhmm(journey.departure, tz), moscow_hhmm(journey.arrival, tz),
+                                     duration_text(journey.arrival - journey.departure),
+                                     transfers_text(journey.transfers)))
+        previous = None
+        for leg in journey.legs:
+            if previous is not None:
+                parts.append(JOURNEY_TRANSFER(station_name(leg.from_station),
+                                              (leg.departure - previous.arrival) // 60))
+            parts.append(JOURNEY_LEG(moscow_hhmm(leg.departure, tz), station_name(leg.from_station),
+                                     moscow_hhmm(leg.arrival, tz), station_name(leg.to_station), leg.title))
+            previous = leg
+        parts.append(ROW_END)
+    if stale:
+        parts.append(STALE_NOTE)
+    return "".join(parts)
+
+
+class MessageCache:
+    """LRU готовых текстов сообщений; ключ включает минуту, так что записи сами устаревают"""
+
+    def __init__(self, max_entries: int = MESSAGE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        text = self._entries.get(key)
+        if text is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return text
+
+    def put(self, key, text: str):
+        self._entries[key] = text
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,112 @@
+import asyncio
+import random
+import time
+
+
+# Параметры по умолчанию для вызовов внешнего API
+RETRY_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.2
+RETRY_MAX_DELAY = 2.0
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30.0
+
+
+class UpstreamUnavailable(Exception):
+    """Запрос не отправлен: API считается недоступным или исчерпана квота"""
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+class RateLimitExceeded(UpstreamUnavailable):
+    pass
+
+
+def backoff_delay(attempt: int, base: float = RETRY_BASE_DELAY, maximum: float = RETRY_MAX_DELAY) -> float:
+    """Пауза перед повтором номер attempt (с нуля): экспонента с полным джиттером"""
+    return random.uniform(0, min(maximum, base * (2 ** attempt)))
+
+
+class TokenBucket:
+    """Ограничитель частоты запросов: rate токенов в секунду, запас до capacity"""
+
+    def __init__(self, rate: float, capacity: float = None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self.throttled = 0
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self) -> float:
+        """Сколько секунд до появления токена (0 — есть сейчас); токен не забирается"""
+        self._refill()
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def try_acquire(self) -> float:
+        """Взять токен; 0 при успехе, иначе сколько секунд ждать следующего"""
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    async def acquire(self, max_wait: float = None):
+        """Дождаться токена; RateLimitExceeded, если ждать дольше max_wait"""
+        wait = self.try_acquire()
+        while wait:
+            if max_wait is not None and wait > max_wait:
+                self.throttled += 1
+                raise RateLimitExceeded(f"квота запросов исчерпана, ждать {wait:.1f} с")
+            await asyncio.sleep(wait)
+            if max_wait is not None:
+                max_wait -= wait
+            wait = self.try_acquire()
+
+
+class CircuitBreaker:
+    """Автомат-предохранитель: после failure_threshold ошибок подряд запросы
+    сразу отклоняются на reset_timeout секунд, затем пропускается один
+    пробный запрос — успех замыкает цепь, ошибка снова её размыкает."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT,
+                 clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self.rejected = 0
+
+    def check(self):
+        """CircuitOpenError, если запрос сейчас отправлять нельзя"""
+        if self.state == self.CLOSED:
+            return
+        # Пробный запрос, оставшийся без ответа (например, отменённый), не держит цепь вечно
+        if self._clock() - self._opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._opened_at = self._clock()
+            return
+        self.rejected += 1
+        raise CircuitOpenError("API временно недоступно")
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self._opened_at = self._clock()
@@ -0,0 +1,569 @@
+import asyncio
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+ROUTES_DB = "user_routes.db"
+ROUTES_JOURNAL = "user_routes.journal"
+
+# Отложенная запись: как часто и при каком числе изменённых пользователей сбрасывать журнал
+FLUSH_INTERVAL = 5.0
+FLUSH_BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS routes (
+    user_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    from_station TEXT NOT NULL,
+    from_name TEXT NOT NULL,
+    to_station TEXT NOT NULL,
+    to_name TEXT NOT NULL,
+    created_at TEXT,
+    PRIMARY KEY (user_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS routes_pair ON routes (from_station, to_station);
+"""
+
+COLUMNS = ('name', 'from_station', 'from_name', 'to_station', 'to_name', 'created_at')
+
+# Подпись кнопки избранного маршрута в клавиатуре
+ROUTE_LABEL_PREFIX = "🚆 "
+
+
+class Route:
+    """Избранный маршрут пользователя; created_at — секунды epoch"""
+    __slots__ = COLUMNS
+
+    def __init__(self, name: str, from_station: str, from_name: str, to_station: str, to_name: str,
+                 created_at: float = None):
+        self.name = name
+        self.from_station = from_station
+        self.from_name = from_name or ""
+        self.to_station = to_station
+        self.to_name = to_name or ""
+        self.created_at = created_at
+
+    @property
+    def pair(self) -> tuple:
+        return self.from_station, self.to_station
+
+    @property
+    def label(self) -> str:
+        return ROUTE_LABEL_PREFIX + self.name
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Route":
+        """Маршрут из словаря прежнего формата (pickle, журнал); created_at — datetime, строка ISO или число"""
+        created_at = data.get('created_at')
+        if isinstance(created_at, str):
+            created_at = datetime.fromisoformat(created_at)
+        if isinstance(created_at, datetime):
+            created_at = created_at.timestamp()
+        return cls(data['name'], data['from_station'], data.get('from_name'),
+                   data['to_station'], data.get('to_name'), created_at)
+
+
+class UserRoutes:
+    """Маршруты одного пользователя с индексами по подписи кнопки и по паре станций.
+
+    Порядок маршрутов сохраняется; при совпадающих названиях по подписи
+    находится первый, как и при прежнем переборе списка. В keyboards
+    кэшируются клавиатуры пользователя; при изменении маршрутов он очищается.
+    """
+    __slots__ = ('_routes', '_by_label', '_by_pair', 'keyboards')
+
+    def __init__(self, routes=()):
+        self._routes = list(routes)
+        self._reindex()
+
+    def _reindex(self):
+        self.keyboards = {}
+        self._by_label = {}
+        self._by_pair = {}
+        for route in self._routes:
+            self._by_label.setdefault(route.label, route)
+            self._by_pair.setdefault(route.pair, route)
+
+    def __len__(self):
+        return len(self._routes)
+
+    def __iter__(self):
+        return iter(self._routes)
+
+    def __getitem__(self, index):
+        return self._routes[index]
+
+    def by_label(self, label: str):
+        return self._by_label.get(label)
+
+    def by_name(self, name: str):
+        return self._by_label.get(ROUTE_LABEL_PREFIX + name)
+
+    def by_pair(self, from_station: str, to_station: str):
+        return self._by_pair.get((from_station, to_station))
+
+    def pairs(self) -> set:
+        return set(self._by_pair)
+
+    def add(self, route: Route) -> bool:
+        """Добавить маршрут; False, если маршрут с такой парой станций уже есть"""
+        if route.pair in self._by_pair:
+            return False
+        self._routes.append(route)
+        self._by_label.setdefault(route.label, route)
+        self._by_pair[route.pair] = route
+        self.keyboards = {}
+        return True
+
+    def remove(self, route: Route):
+        self._routes.remove(route)
+        self._reindex()
+
+
+class RouteIndex:
+    """Пары станций → пользователи, сохранившие маршрут по этой паре.
+
+    Читается только через counts: прогрев кэша и популярность станций
+    (в webhook-режиме популярность — из общей БД, RouteStore.pair_counts).
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+
+    def load(self, rows):
+        """Заполнить из строк (user_id, from_station, to_station)"""
+        for user_id, from_station, to_station in rows:
+            self.add(user_id, (from_station, to_station))
+
+    def add(self, user_id: int, pair: tuple):
+        users = self._subscribers.get(pair)
+        if users is None:
+            users = self._subscribers[pair] = set()
+        users.add(user_id)
+
+    def discard(self, user_id: int, pair: tuple):
+        users = self._subscribers.get(pair)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del self._subscribers[pair]
+
+    def counts(self, partition: tuple = None) -> dict:
+        """Число пользователей на каждую пару — как RouteStore.pair_counts.
+
+        partition=(номер, число) — только пользователи с user_id % число == номер.
+        """
+        if partition is None:
+            return {pair: len(users) for pair, users in self._subscribers.items()}
+        index, count = partition
+        counts = {}
+        for pair, users in self._subscribers.items():
+            own = sum(1 for user_id in users if user_id % count == index)
+            if own:
+                counts[pair] = own
+        return counts
+
+    def __len__(self):
+        return len(self._subscribers)
+
+
+def route_to_row(user_id: int, position: int, route: Route) -> tuple:
+    return (
+        user_id, position, route.name,
+        route.from_station, route.from_name,
+        route.to_station, route.to_name,
+        datetime.fromtimestamp(route.created_at, timezone.utc).isoformat() if route.created_at else None,
+    )
+
+
+def row_to_route(row: tuple) -> Route:
+    *fields, created_at = row
+    return Route(*fields, datetime.fromisoformat(created_at).timestamp() if created_at else None)
+
+
+def route_to_json(route: Route) -> dict:
+    return {column: getattr(route, column) for column in COLUMNS}
+
+
+def route_from_json(data: dict) -> Route:
+    return Route.from_dict(data)
+
+
+class RouteStore:
+    """Хранилище избранных маршрутов пользователей.
+
+    Маршруты читаются по одному пользователю, а сохраняются целиком для
+    пользователя — при правке маршрута остальные пользователи не затрагиваются.
+    """
+
+    def load_user(self, user_id: int) -> list:
+        raise NotImplementedError
+
+    async def save_user(self, user_id: int, routes: list):
+        raise NotImplementedError
+
+    async def save_users(self, users: dict):
+        """Сохранить маршруты нескольких пользователей {user_id: routes}"""
+        for user_id, routes in users.items():
+            await self.save_user(user_id, routes)
+
+    def pair_counts(self) -> dict:
+        """Число пользователей на каждую пару станций (from_station, to_station)"""
+        raise NotImplementedError
+
+    def user_pairs(self):
+        """Строки (user_id, from_station, to_station) по всем маршрутам — для RouteIndex"""
+        raise NotImplementedError
+
+    def start(self):
+        pass
+
+    async def flush(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class MemoryRouteStore(RouteStore):
+    """Хранилище в памяти, без сохранения на диск"""
+
+    def __init__(self):
+        self._routes = {}
+
+    def load_user(self, user_id: int) -> list:
+        return list(self._routes.get(user_id, []))
+
+    async def save_user(self, user_id: int, routes: list):
+        if routes:
+            self._routes[user_id] = list(routes)
+        else:
+            self._routes.pop(user_id, None)
+
+    def pair_counts(self) -> dict:
+        counts = {}
+        for routes in self._routes.values():
+            for pair in {route.pair for route in routes}:
+                counts[pair] = counts.get(pair, 0) + 1
+        return counts
+
+    def user_pairs(self):
+        for user_id, routes in self._routes.items():
+            for route in routes:
+                yield (user_id, *route.pair)
+
+
+class SQLiteRouteStore(RouteStore):
+    """Хранилище в SQLite.
+
+    Запись идёт в отдельном потоке (по одной транзакции на пользователя),
+    поэтому не блокирует цикл событий и не оставляет файл в промежуточном
+    состоянии. Чтение — точечные запросы по user_id из основного потока.
+    """
+
+    def __init__(self, path: str = ROUTES_DB):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="route-store")
+        self._local = threading.local()
+        self._reader = self._connect()
+        self._reader.executescript(SCHEMA)
+
+    def _connect(self, synchronous: str = "NORMAL") -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={synchronous}")
+        return conn
+
+    def _writer(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # FULL: в WAL с NORMAL последняя транзакция может откатиться при отключении питания,
+            # а WriteBehindRouteStore после записи пачки уже удаляет её из журнала
+            conn = self._local.conn = self._connect("FULL")
+        return conn
+
+    def load_user(self, user_id: int) -> list:
+        rows = self._reader.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM routes WHERE user_id = ? ORDER BY position",
+            (user_id,)
+        )
+        return [row_to_route(row) for row in rows]
+
+    def write_users(self, users: dict):
+        """Синхронно заменить маршруты нескольких пользователей одной транзакцией"""
+        conn = self._writer()
+        with conn:
+            for user_id, routes in users.items():
+                conn.execute("DELETE FROM routes WHERE user_id = ?", (user_id,))
+                conn.executemany(
+                    "INSERT INTO routes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [route_to_row(user_id, position, route) for position, route in enumerate(routes)]
+                )
+
+    async def save_user(self, user_id: int, routes: list):
+        await self.save_users({user_id: routes})
+
+    async def save_users(self, users: dict):
+        snapshot = {user_id: list(routes) for user_id, routes in users.items()}
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.write_users, snapshot)
+
+    def pair_counts(self) -> dict:
+        rows = self._reader.execute(
+            "SELECT from_station, to_station, COUNT(DISTINCT user_id) FROM routes GROUP BY from_station, to_station"
+        )
+        return {(from_station, to_station): count for from_station, to_station, count in rows}
+
+    def user_pairs(self):
+        return self._reader.execute("SELECT user_id, from_station, to_station FROM routes")
+
+    def migrate_pickle(self, pickle_path: str) -> int:
+        """Разовый перенос маршрутов из старого pickle-файла; файл переименовывается в *.migrated"""
+        if not os.path.exists(pickle_path):
+            return 0
+        with open(pickle_path, 'rb') as f:
+            user_routes = pickle.load(f)
+        user_routes = {user_id: [Route.from_dict(route) for route in routes] for user_id, routes in user_routes.items()}
+        self._executor.submit(self.write_users, user_routes).result()
+        os.replace(pickle_path, f"{pickle_path}.migrated")
+        logger.info("Перенесены маршруты %d пользователей из %s", len(user_routes), pickle_path)
+        return len(user_routes)
+
+    async def close(self):
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close_writer)
+        self._executor.shutdown()
+        self._reader.close()
+
+    def _close_writer(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def _journal_line(user_id: int, routes: list) -> str:
+    entry = {'user_id': user_id, 'routes': [route_to_json(route) for route in routes]}
+    return json.dumps(entry, ensure_ascii=False) + "\n"
+
+
+def _fsync_directory(path: str):
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class WriteBehindRouteStore(RouteStore):
+    """Отложенная запись поверх другого хранилища.
+
+    Каждое изменение сразу дописывается строкой в журнал и подтверждается, а в
+    основное хранилище изменения уходят пачками — по таймеру или при
+    накоплении FLUSH_BATCH_SIZE пользователей. После успешного сброса журнал
+    сжимается до ещё не сохранённых изменений. При запуске журнал
+    проигрывается заново, так что изменения переживают падение процесса.
+
+    С fsync=True (по умолчанию) save_user возвращается только после fsync
+    журнала, и изменения переживают и отключение питания. fsync общий на
+    группу: сохранения, пришедшие, пока идёт предыдущий, подтверждаются
+    следующим одним вызовом в потоке. Сжатый журнал перед заменой тоже
+    проходит fsync (вместе с каталогом), а основное хранилище должно
+    подтверждать запись только после fsync (SQLiteRouteStore пишет с
+    synchronous=FULL). С fsync=False журнал защищает только от падения
+    процесса — строки могут остаться в кэше ОС.
+
+    Сжатие журнала идёт в потоке; на это время новые строки ждут его
+    окончания, чтобы не попасть в заменяемый файл.
+    """
+
+    def __init__(self, backend: RouteStore, journal_path: str = ROUTES_JOURNAL,
+                 flush_interval: float = FLUSH_INTERVAL, batch_size: int = FLUSH_BATCH_SIZE, fsync: bool = True):
+        self.backend = backend
+        self.journal_path = journal_path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self._pending = self._replay_journal()
+        self._journal = open(journal_path, 'a', encoding='utf-8')
+        self._flush_lock = asyncio.Lock()
+        # Запись строки в журнал и его сжатие не пересекаются
+        self._journal_lock = asyncio.Lock()
+        # Групповой fsync: сколько строк дописано и сколько из них уже на диске
+        self._written = 0
+        self._synced = 0
+        self._sync_task = None
+        self.syncs = 0
+        self._flush_task = None
+        self._timer_task = None
+        self.flushes = 0
+        self.flushed_users = 0
+        self.max_batch_size = 0
+        self.last_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+    def _replay_journal(self) -> dict:
+        pending = {}
+        if not os.path.exists(self.journal_path):
+            return pending
+        with open(self.journal_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Недописанная строка при падении процесса
+                    continue
+                pending[entry['user_id']] = [route_from_json(route) for route in entry['routes']]
+        if pending:
+            logger.info("Из журнала восстановлены несохранённые маршруты %d пользователей", len(pending))
+        return pending
+
+    def start(self):
+        """Запустить периодический сброс (нужен работающий цикл событий)"""
+        if self._timer_task is None:
+            self._timer_task = asyncio.get_running_loop().create_task(self._flush_periodically())
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Ошибка отложенной записи маршрутов: %s", e)
+
+    def load_user(self, user_id: int) -> list:
+        if user_id in self._pending:
+            return list(self._pending[user_id])
+        return self.backend.load_user(user_id)
+
+    async def save_user(self, user_id: int, routes: list):
+        snapshot = list(routes)
+        line = _journal_line(user_id, snapshot)
+        async with self._journal_lock:
+            self._journal.write(line)
+            self._journal.flush()
+            self._written += 1
+            self._pending[user_id] = snapshot
+        if self.fsync:
+            await self._sync_journal(self._written)
+
+        if len(self._pending) >= self.batch_size and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+
+    async def _sync_journal(self, line: int):
+        """Дождаться fsync, который покрывает строку журнала номер line"""
+        while self._synced < line:
+            if self._sync_task is None:
+                self._sync_task = asyncio.get_running_loop().create_task(self._fsync())
+            await asyncio.shield(self._sync_task)
+
+    async def _fsync(self):
+        # Копия дескриптора: сжатие журнала может закрыть файл, пока fsync идёт в потоке.
+        # Строки до сжатия либо уже в основном хранилище, либо в новом файле, прошедшем fsync
+        async with self._journal_lock:
+            covered = self._written
+            fd = os.dup(self._journal.fileno())
+        try:
+            await asyncio.to_thread(os.fsync, fd)
+            self._synced = max(self._synced, covered)
+            self.syncs += 1
+        finally:
+            os.close(fd)
+            self._sync_task = None
+
+    def pair_counts(self) -> dict:
+        counts = self.backend.pair_counts()
+        for user_id, routes in self._pending.items():
+            for pair in {route.pair for route in self.backend.load_user(user_id)}:
+                counts[pair] = counts.get(pair, 0) - 1
+                if counts[pair] <= 0:
+                    del counts[pair]
+            for pair in {route.pair for route in routes}:
+                counts[pair] = counts.get(pair, 0) + 1
+        return counts
+
+    def user_pairs(self):
+        for user_id, from_station, to_station in self.backend.user_pairs():
+            if user_id not in self._pending:
+                yield user_id, from_station, to_station
+        for user_id, routes in list(self._pending.items()):
+            for route in routes:
+                yield (user_id, *route.pair)
+
+    async def flush(self):
+        """Сбросить накопленные изменения в основное хранилище и сжать журнал"""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch = self._pending
+            self._pending = {}
+            started = time.perf_counter()
+            try:
+                await self.backend.save_users(batch)
+            except Exception:
+                # Более новые изменения за время записи важнее пачки
+                batch.update(self._pending)
+                self._pending = batch
+                raise
+            await self._compact_journal()
+
+            elapsed = time.perf_counter() - started
+            self.flushes += 1
+            self.flushed_users += len(batch)
+            self.max_batch_size = max(self.max_batch_size, len(batch))
+            self.last_flush_seconds = elapsed
+            self.total_flush_seconds += elapsed
+            if metrics.ENABLED:
+                metrics.STORE_FLUSH_SECONDS.observe(elapsed, "routes")
+
+    async def _compact_journal(self):
+        # В журнале остаются только изменения, пришедшие во время записи пачки
+        async with self._journal_lock:
+            pending = list(self._pending.items())
+            self._journal = await asyncio.to_thread(self._rewrite_journal, pending)
+
+    def _rewrite_journal(self, pending: list):
+        tmp_path = f"{self.journal_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for user_id, routes in pending:
+                f.write(_journal_line(user_id, routes))
+            if self.fsync:
+                # Иначе после отключения питания на месте журнала может оказаться пустой файл
+                f.flush()
+                os.fsync(f.fileno())
+        self._journal.close()
+        os.replace(tmp_path, self.journal_path)
+        if self.fsync:
+            # Переименование попадает на диск вместе с каталогом
+            _fsync_directory(self.journal_path)
+        return open(self.journal_path, 'a', encoding='utf-8')
+
+    def stats(self) -> dict:
+        return {
+            "pending_users": len(self._pending),
+            "journal_syncs": self.syncs,
+            "flushes": self.flushes,
+            "flushed_users": self.flushed_users,
+            "max_batch_size": self.max_batch_size,
+            "avg_batch_size": self.flushed_users / self.flushes if self.flushes else 0.0,
+            "last_flush_seconds": self.last_flush_seconds,
+            "avg_flush_seconds": self.total_flush_seconds / self.flushes if self.flushes else 0.0,
+        }
+
+    async def close(self):
+        if self._timer_task is not None:
+            self._timer_task.cancel()
+            self._timer_task = None
+        await self.flush()
+        self._journal.close()
+        await self.backend.close()
@@ -0,0 +1,146 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+# Время жизни записи и размер кэша по умолчанию
+SCHEDULE_TTL = 600
+MAX_ENTRIES = 2048
+# Сколько истёкшая запись ещё годится как запасной ответ при недоступности API
+STALE_TTL = 6 * 3600
+
+# Результат ожидания чужой загрузки, которую отменили
+_CANCELLED = object()
+
+
+class ScheduleCache:
+    """Кэш расписаний с TTL и вытеснением LRU.
+
+    Ключ — (станция отправления, станция назначения, дата). Одновременные
+    промахи по одному ключу объединяются: загрузчик вызывается один раз,
+    остальные запросы ждут его результат. Если того, кто начал загрузку,
+    отменили, ожидающие не получают его отмену, а загружают заново (снова
+    одной загрузкой на всех). Истёкшие записи ещё stale_ttl
+    секунд доступны через `stale` — на случай, если API не отвечает.
+    """
+
+    def __init__(self, ttl: float = SCHEDULE_TTL, max_entries: int = MAX_ENTRIES, clock=time.monotonic,
+                 stale_ttl: float = STALE_TTL):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stale_hits = 0
+
+    def peek(self, key):
+        """Значение из кэша без загрузки (None, если нет или устарело)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        now = self._clock()
+        if expires_at <= now:
+            if expires_at + self.stale_ttl <= now:
+                del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def stale(self, key):
+        """Последнее загруженное значение, даже истёкшее (None, если его нет)"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] + self.stale_ttl <= self._clock():
+            return None
+        self.stale_hits += 1
+        return entry[1]
+
+    def put(self, key, value, ttl: float = None):
+        self._entries[key] = (self._clock() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def entries(self):
+        """(ключ, значение, через сколько секунд истекает) для записей, ещё годных хотя бы как устаревшие"""
+        now = self._clock()
+        for key, (expires_at, value) in list(self._entries.items()):
+            if expires_at + self.stale_ttl > now:
+                yield key, value, expires_at - now
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    async def get(self, key, loader):
+        """Значение по ключу; при промахе вызывает `await loader()`"""
+        value = self.peek(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        while True:
+            future = self._in_flight.get(key)
+            if future is None:
+                self.misses += 1
+                return await self._load(key, loader)
+            self.coalesced += 1
+            value = await self._join(future)
+            if value is not _CANCELLED:
+                return value
+
+    async def refresh(self, key, loader, ttl: float = None):
+        """Перезагрузить значение независимо от того, есть ли оно в кэше"""
+        while True:
+            future = self._in_flight.get(key)
+            if future is None:
+                return await self._load(key, loader, ttl)
+            value = await self._join(future)
+            if value is not _CANCELLED:
+                return value
+
+    @staticmethod
+    async def _join(future):
+        """Результат чужой загрузки; _CANCELLED, если её отменили вместе с начавшим её запросом"""
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Отмену самого ожидающего запроса пробрасываем
+            if future.cancelled() and not asyncio.current_task().cancelling():
+                return _CANCELLED
+            raise
+
+    async def _load(self, key, loader, ttl: float = None):
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже получил вызывающий; без этого asyncio ругается
+            # на необработанное исключение, если ожидающих не было
+            future.exception()
+            raise
+        else:
+            self.put(key, value, ttl)
+            future.set_result(value)
+            return value
+        finally:
+            del self._in_flight[key]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "stale_hits": self.stale_hits,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,278 @@
+"""Очередь исходящих запросов к Bot API.
+
+SendQueue подключается к Application как rate_limiter, поэтому через неё
+идут все reply_text, send_message и edit_message_text без изменений в
+обработчиках. Запросы к чату (chat_id или inline_message_id) выстраиваются
+в очередь этого чата и отправляются с учётом общего лимита бота и лимита
+чата; остальные методы (answerInlineQuery, answerCallbackQuery, getMe)
+уходят сразу.
+
+Приоритет задаётся через `rate_limit_args` (по умолчанию — ответ
+пользователю): из готовых к отправке чатов первым обслуживается тот, у
+кого в голове очереди запрос важнее. Если в чате скопилось несколько
+текстов подряд, они склеиваются в одно сообщение. На 429 запрос
+возвращается в голову очереди чата и ждёт retry_after, который прислал
+сервер.
+"""
+import asyncio
+import contextlib
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import metrics
+from resilience import TokenBucket
+
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Bot API: около 30 сообщений в секунду на бота, 1 в секунду в личный чат, 20 в минуту в группу
+GLOBAL_RATE = 30.0
+CHAT_RATE = 1.0
+GROUP_RATE = 20 / 60
+# Короткая пачка (ответ и сразу следующий вопрос) уходит без задержки
+CHAT_BURST = 3
+MAX_RETRIES = 3
+MESSAGE_LIMIT = 4096
+# Через сколько секунд без сообщений состояние чата можно забыть: его ведро уже полное
+CHAT_IDLE = 60
+# Сколько ждать отправки оставшихся сообщений при остановке
+SHUTDOWN_TIMEOUT = 5
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_ALERT = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_ALERT: "alert", PRIORITY_BULK: "bulk"}
+
+
+class _Request:
+    __slots__ = ('callback', 'args', 'kwargs', 'endpoint', 'data', 'priority', 'waiters', 'attempts')
+
+    def __init__(self, callback, args, kwargs, endpoint: str, data: dict, priority: int):
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.endpoint = endpoint
+        self.data = data
+        self.priority = priority
+        # (future, время постановки) всех, кто ждёт этот запрос, — несколько после склейки
+        self.waiters = [(asyncio.get_running_loop().create_future(), time.monotonic())]
+        self.attempts = 0
+
+    def merge(self, other: "_Request") -> bool:
+        """Дописать текст other к этому запросу, если получится одно корректное сообщение"""
+        if self.endpoint != "sendMessage" or other.endpoint != "sendMessage" or self.data.get("reply_markup"):
+            return False
+        if _without_text(self.data) != _without_text(other.data):
+            return False
+        text = f"{self.data['text']}\n\n{other.data['text']}"
+        if len(text) > MESSAGE_LIMIT:
+            return False
+        # Клавиатура — от последнего сообщения, как если бы они ушли по отдельности
+        self.data = dict(other.data, text=text)
+        self.args = (self.endpoint, self.data)
+        self.priority = min(self.priority, other.priority)
+        self.waiters.extend(other.waiters)
+        return True
+
+
+def _without_text(data: dict) -> dict:
+    return {key: value for key, value in data.items() if key not in ("text", "reply_markup")}
+
+
+class _Chat:
+    __slots__ = ('bucket', 'pending', 'busy', 'blocked_until', 'last_sent')
+
+    def __init__(self, rate: float):
+        self.bucket = TokenBucket(rate, CHAT_BURST)
+        self.pending = deque()
+        self.busy = False
+        self.blocked_until = 0.0
+        self.last_sent = 0.0
+
+
+class SendQueue(BaseRateLimiter):
+    """Планировщик исходящих сообщений: лимиты бота и чатов, приоритеты, склейка, повтор после 429"""
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE,
+                 group_rate: float = GROUP_RATE, max_retries: int = MAX_RETRIES):
+        # Без запаса: иначе за первую секунду уйдёт вдвое больше лимита
+        self.bucket = TokenBucket(global_rate, 1)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._chats = {}
+        # Чаты, которым можно отправлять: (приоритет головы очереди, порядок, ключ)
+        self._ready = []
+        # Чаты, ждущие своего лимита или retry_after: (когда, порядок, ключ)
+        self._waiting = []
+        self._order = itertools.count()
+        self._wakeup = None
+        self._task = None
+        self._in_flight = set()
+        self._pruned_at = 0.0
+        self.sent = 0
+        self.merged = 0
+        self.retried = 0
+        self.failed = 0
+
+    @property
+    def depth(self) -> int:
+        return sum(len(chat.pending) for chat in self._chats.values())
+
+    async def initialize(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def shutdown(self) -> None:
+        if self._task is None:
+            return
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        while (self.depth or self._in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        task, self._task = self._task, None
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+        for chat in self._chats.values():
+            for request in chat.pending:
+                for future, _ in request.waiters:
+                    if not future.done():
+                        future.set_exception(RuntimeError("очередь отправки остановлена"))
+        if self.depth:
+            logger.error("Не отправлено сообщений при остановке: %d", self.depth)
+        self._chats.clear()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        key = data.get("chat_id") or data.get("inline_message_id")
+        if key is None or self._task is None:
+            return await callback(*args, **kwargs)
+
+        priority = PRIORITY_INTERACTIVE if rate_limit_args is None else rate_limit_args
+        request = _Request(callback, args, kwargs, endpoint, data, priority)
+        chat = self._chats.get(key)
+        if chat is None:
+            # Строковый chat_id (@канал) и отрицательный — группы и каналы с более строгим лимитом
+            chat_id = data.get("chat_id")
+            group = isinstance(chat_id, str) or isinstance(chat_id, int) and chat_id < 0
+            chat = self._chats[key] = _Chat(self.group_rate if group else self.chat_rate)
+        chat.pending.append(request)
+        if not chat.busy and len(chat.pending) == 1:
+            self._schedule(key, chat)
+        return await request.waiters[0][0]
+
+    def _schedule(self, key, chat: _Chat):
+        """Поставить чат с непустой очередью в готовые или в ожидающие"""
+        ready_at = max(chat.blocked_until, time.monotonic() + chat.bucket.wait_time())
+        if ready_at <= time.monotonic():
+            heapq.heappush(self._ready, (chat.pending[0].priority, next(self._order), key))
+        else:
+            heapq.heappush(self._waiting, (ready_at, next(self._order), key))
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            while self._waiting and self._waiting[0][0] <= now:
+                _, _, key = heapq.heappop(self._waiting)
+                chat = self._chats.get(key)
+                if chat is not None and chat.pending and not chat.busy:
+                    self._schedule(key, chat)
+            if now - self._pruned_at > CHAT_IDLE:
+                self._prune(now)
+
+            if not self._ready:
+                self._wakeup.clear()
+                timeout = self._waiting[0][0] - now if self._waiting else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            wait = self.bucket.try_acquire()
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+
+            _, _, key = heapq.heappop(self._ready)
+            chat = self._chats.get(key)
+            request = self._take(chat) if chat is not None and not chat.busy else None
+            if request is None:
+                continue
+            chat.bucket.try_acquire()
+            chat.busy = True
+            task = asyncio.get_running_loop().create_task(self._send(key, chat, request))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    def _take(self, chat: _Chat):
+        """Запрос из головы очереди чата вместе с текстами, которые можно к нему приклеить"""
+        while chat.pending and all(future.cancelled() for future, _ in chat.pending[0].waiters):
+            chat.pending.popleft()
+        if not chat.pending:
+            return None
+        request = chat.pending.popleft()
+        while chat.pending and request.merge(chat.pending[0]):
+            chat.pending.popleft()
+            self.merged += 1
+        return request
+
+    async def _send(self, key, chat: _Chat, request: _Request):
+        try:
+            result = await request.callback(*request.args, **request.kwargs)
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+            request.attempts += 1
+            if request.attempts > self.max_retries:
+                self._fail(request, e)
+            else:
+                self.retried += 1
+                logger.info("Bot API просит подождать %s с перед отправкой в чат %s", retry_after, key)
+                chat.blocked_until = time.monotonic() + retry_after
+                chat.pending.appendleft(request)
+        except Exception as e:
+            self._fail(request, e)
+        else:
+            self.sent += 1
+            finished = time.monotonic()
+            for future, enqueued_at in request.waiters:
+                if not future.done():
+                    future.set_result(result)
+                if metrics.ENABLED:
+                    metrics.TELEGRAM_SEND_SECONDS.observe(finished - enqueued_at, PRIORITY_NAMES.get(
+                        request.priority, str(request.priority)))
+        finally:
+            chat.busy = False
+            chat.last_sent = time.monotonic()
+            if chat.pending:
+                self._schedule(key, chat)
+
+    def _fail(self, request: _Request, error: Exception):
+        self.failed += 1
+        for future, _ in request.waiters:
+            if not future.done():
+                future.set_exception(error)
+
+    def _prune(self, now: float):
+        self._pruned_at = now
+        idle = [key for key, chat in self._chats.items()
+                if not chat.pending and not chat.busy and now - chat.last_sent > CHAT_IDLE]
+        for key in idle:
+            del self._chats[key]
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "chats": len(self._chats),
+            "sent": self.sent,
+            "merged": self.merged,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
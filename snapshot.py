@@ -0,0 +1,227 @@
+"""Снимок расписаний из кэша в компактном двоичном файле.
+
+Главный воркер периодически сохраняет содержимое ScheduleCache, а при
+запуске каждый процесс отображает файл в память (mmap) и кладёт расписания
+обратно в кэш. Массивы времён не копируются: колонки Timetable — это
+memoryview прямо на страницы файла, так что процессы на одной машине
+делят одну копию, а запуск не разбирает ни JSON, ни даты.
+
+Формат (все числа little-endian, колонки выровнены на 8 байт):
+
+    заголовок   HEADER: магия, версия, crc32 тела, число записей и строк,
+                время создания, длина тела
+    строки      u32 длина + UTF-8: коды станций, даты, названия ниток
+    записи      ENTRY на каждое расписание: индексы строк (откуда, куда,
+                дата), число рейсов и ниток, срок годности (epoch), смещение колонок
+    колонки     departures q[n], arrivals q[n], durations i[n],
+                title_ids I[n], titles I[t], departure_text 5×n, arrival_text 5×n
+
+Файл с другой версией, порядком байт или неверной контрольной суммой
+пропускается — бот просто стартует с пустым кэшем. Расписания на
+прошедшие даты в снимок не попадают.
+"""
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from datetime import datetime
+
+import pytz
+
+from timetable import Timetable
+
+
+logger = logging.getLogger(__name__)
+
+MOSCOW_TZ = pytz.timezone('Europe/Moscow')
+
+SNAPSHOT_FILE = "timetables.snap"
+SNAPSHOT_MAGIC = b"TTSNAP\0\0"
+SNAPSHOT_VERSION = 1
+# Как часто главный воркер сохраняет снимок
+SNAPSHOT_INTERVAL = 300
+
+HEADER = struct.Struct("<8sHHIIIdQ")
+ENTRY = struct.Struct("<IIIIIIdQ")
+# Подпись «ЧЧ:ММ» в ASCII
+TEXT_WIDTH = 5
+
+
+def _pad(buffer: bytearray):
+    buffer.extend(b"\0" * (-len(buffer) % 8))
+
+
+class TextColumn:
+    """Подписи «ЧЧ:ММ» из снимка: строка создаётся только при обращении"""
+    __slots__ = ('raw',)
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def __len__(self):
+        return len(self.raw) // TEXT_WIDTH
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += len(self)
+        start = index * TEXT_WIDTH
+        if not 0 <= start < len(self.raw):
+            raise IndexError(index)
+        return str(self.raw[start:start + TEXT_WIDTH], "ascii")
+
+
+def _column_bytes(column) -> bytes:
+    return memoryview(column).cast('B').tobytes()
+
+
+def _text_bytes(column) -> bytes:
+    if isinstance(column, TextColumn):
+        return column.raw.tobytes()
+    return "".join(column).encode("ascii")
+
+
+def encode_snapshot(entries) -> bytes:
+    """Снимок из (ключ (откуда, куда, дата), Timetable, срок годности epoch)"""
+    strings = {}
+
+    def string_id(value: str) -> int:
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings)
+        return index
+
+    records = []
+    columns = bytearray()
+    for (from_station, to_station, date), timetable, expires_at in entries:
+        rows = len(timetable)
+        title_refs = [string_id(title) for title in timetable.titles]
+        offset = len(columns)
+        for column in (timetable.departures, timetable.arrivals, timetable.durations, timetable.title_ids):
+            columns += _column_bytes(column)
+        columns += struct.pack(f"<{len(title_refs)}I", *title_refs)
+        columns += _text_bytes(timetable.departure_text)
+        columns += _text_bytes(timetable.arrival_text)
+        _pad(columns)
+        records.append((string_id(from_station), string_id(to_station), string_id(date), rows, len(title_refs), 0,
+                        expires_at, offset))
+
+    body = bytearray()
+    for value in strings:
+        encoded = value.encode("utf-8")
+        body += struct.pack("<I", len(encoded)) + encoded
+    _pad(body)
+    # Смещения колонок — от начала файла
+    columns_start = HEADER.size + len(body) + ENTRY.size * len(records)
+    for record in records:
+        body += ENTRY.pack(*record[:-1], columns_start + record[-1])
+    body += columns
+
+    header = HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, zlib.crc32(body), len(records), len(strings),
+                         time.time(), len(body))
+    return header + bytes(body)
+
+
+def write_snapshot(path: str, entries) -> int:
+    """Записать снимок атомарно; возвращает размер файла"""
+    data = encode_snapshot(entries)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return len(data)
+
+
+class Snapshot:
+    """Снимок, отображённый в память; расписания ссылаются на его страницы"""
+
+    def __init__(self, path: str = SNAPSHOT_FILE):
+        self.path = path
+        self._mmap = None
+        self.created_at = 0.0
+        self.entries = []
+
+    def load(self) -> bool:
+        """Открыть файл и разобрать записи; False, если файла нет или он не подходит"""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < HEADER.size:
+            return False
+        if sys.byteorder != "little":
+            logger.error("Снимок расписаний пропущен: формат рассчитан на little-endian")
+            return False
+
+        with open(self.path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        magic, version, _, checksum, entry_count, string_count, created_at, body_length = HEADER.unpack_from(view)
+        body = view[HEADER.size:HEADER.size + body_length]
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or len(body) != body_length \
+                or zlib.crc32(body) != checksum:
+            logger.error("Снимок расписаний %s пропущен: другая версия или файл повреждён", self.path)
+            body.release()
+            view.release()
+            mapped.close()
+            return False
+
+        strings = []
+        position = HEADER.size
+        for _ in range(string_count):
+            (length,) = struct.unpack_from("<I", view, position)
+            position += 4
+            strings.append(sys.intern(str(view[position:position + length], "utf-8")))
+            position += length
+        position += -position % 8
+
+        entries = []
+        for index in range(entry_count):
+            from_id, to_id, date_id, rows, title_count, _, expires_at, offset = ENTRY.unpack_from(
+                view, position + index * ENTRY.size
+            )
+            timetable = Timetable(strings[date_id])
+            timetable.departures = view[offset:offset + 8 * rows].cast('q')
+            offset += 8 * rows
+            timetable.arrivals = view[offset:offset + 8 * rows].cast('q')
+            offset += 8 * rows
+            timetable.durations = view[offset:offset + 4 * rows].cast('i')
+            offset += 4 * rows
+            timetable.title_ids = view[offset:offset + 4 * rows].cast('I')
+            offset += 4 * rows
+            timetable.titles = [strings[i] for i in view[offset:offset + 4 * title_count].cast('I')]
+            offset += 4 * title_count
+            timetable.departure_text = TextColumn(view[offset:offset + TEXT_WIDTH * rows])
+            offset += TEXT_WIDTH * rows
+            timetable.arrival_text = TextColumn(view[offset:offset + TEXT_WIDTH * rows])
+            entries.append(((strings[from_id], strings[to_id], strings[date_id]), timetable, expires_at))
+
+        # Прежнее отображение закроется само, когда на него не останется ссылок из кэша
+        self._mmap = mapped
+        self.created_at = created_at
+        self.entries = entries
+        return True
+
+
+def current_entries(cache, now: float = None) -> list:
+    """Записи кэша для снимка: без прошедших дат"""
+    now = time.time() if now is None else now
+    today = datetime.fromtimestamp(now, MOSCOW_TZ).strftime("%Y-%m-%d")
+    return [
+        (key, timetable, now + expires_in)
+        for key, timetable, expires_in in cache.entries()
+        if isinstance(timetable, Timetable) and key[2] >= today
+    ]
+
+
+def restore(cache, snapshot: Snapshot, now: float = None) -> int:
+    """Положить расписания из снимка в кэш с оставшимся сроком годности; прошедшие даты пропускаются"""
+    now = time.time() if now is None else now
+    today = datetime.fromtimestamp(now, MOSCOW_TZ).strftime("%Y-%m-%d")
+    restored = 0
+    for key, timetable, expires_at in snapshot.entries:
+        if key[2] < today:
+            continue
+        # Истёкшие записи тоже пригодятся: кэш отдаёт их как устаревшие, если API недоступно
+        if expires_at - now + cache.stale_ttl > 0:
+            cache.put(key, timetable, expires_at - now)
+            restored += 1
+    return restored
@@ -0,0 +1,440 @@
+import asyncio
+import heapq
+import json
+import logging
+import math
+import multiprocessing
+import os
+import re
+import sqlite3
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+STATIONS_DB = "stations.db"
+# Как часто перекачивать справочник станций
+STATIONS_MAX_AGE = 7 * 24 * 3600
+# Версия формата индекса: при изменении схемы или нормализации файл перестраивается
+INDEX_VERSION = "3"
+
+# Баллы за качество совпадения; бонусы популярности заведомо меньше шага между ними
+SCORE_EXACT = 1000
+SCORE_PREFIX = 800
+SCORE_WORD_PREFIX = 600
+SCORE_SUBSTRING = 400
+SCORE_FUZZY = 300
+MAX_POPULARITY_BONUS = 40
+TRAIN_BONUS = 10
+
+# Ограничения перебора: на 100 тыс. станций p99 поиска около 1 мс (tools/bench_stations.py)
+SUBSTRING_SCAN = 100
+INTERSECT_THRESHOLD = 64
+# Пересечение списков триграмм: сколько самых коротких списков учитывать, какими порциями
+# идут кандидаты и сколько вхождений самого короткого списка просматривать при поиске
+INTERSECT_LISTS = 3
+MERGE_CHUNK = 128
+MERGE_PROBE_RATIO = 8
+SUBSTRING_CHECKS = 1000
+BLOB_SCAN_THRESHOLD = 2000
+PREFIX_SCAN = 50
+FUZZY_TRIGRAMS = 3
+FUZZY_MAX_POSTINGS = 1000
+# Сколько вхождений триграмм всего подсчитывать для нечёткого поиска
+FUZZY_POSTINGS_BUDGET = 1500
+FUZZY_CANDIDATES = 20
+FUZZY_THRESHOLD = 0.35
+
+WORD_SEPARATORS = ' (-".'
+
+StationMatch = namedtuple('StationMatch', 'code title settlement score')
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE stations (
+    ord INTEGER PRIMARY KEY,
+    code TEXT NOT NULL,
+    title TEXT NOT NULL,
+    norm TEXT NOT NULL,
+    settlement TEXT NOT NULL,
+    transport_type TEXT NOT NULL
+);
+CREATE INDEX stations_norm ON stations (norm);
+CREATE INDEX stations_code ON stations (code);
+"""
+
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(name: str) -> str:
+    """Нормализованное название станции: без учёта регистра, ё/е и лишних пробелов"""
+    return _SPACES.sub(" ", name.lower().replace("ё", "е")).strip()
+
+
+def trigrams(norm: str) -> set:
+    padded = f" {norm} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _contains(postings, ordinal: int, low: int, high: int) -> bool:
+    position = bisect_left(postings, ordinal, low, high)
+    return position < high and postings[position] == ordinal
+
+
+def iter_stations(data: dict):
+    """Обход дерева stations_list (страна → регион → населённый пункт → станция) в исходном порядке"""
+    for country in data.get('countries', []):
+        for region in country.get('regions', []):
+            for settlement in region.get('settlements', []):
+                for station in settlement.get('stations', []):
+                    code = station.get('codes', {}).get('yandex_code')
+                    if code and station.get('title'):
+                        yield (
+                            code,
+                            station['title'],
+                            settlement.get('title', ''),
+                            station.get('transport_type', ''),
+                        )
+
+
+def build_index(data, path: str = STATIONS_DB) -> int:
+    """Построить файл индекса из ответа stations_list; файл заменяется атомарно.
+
+    data — разобранный ответ или сырые байты JSON: полный справочник весит
+    больше 10 МБ, и его разбор должен идти там же, где сборка, — не на цикле событий.
+    """
+    if isinstance(data, (bytes, str)):
+        data = json.loads(data)
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(SCHEMA)
+        rows = (
+            (code, title, normalize(title), settlement, transport_type)
+            for code, title, settlement, transport_type in iter_stations(data)
+        )
+        conn.executemany(
+            "INSERT INTO stations (code, title, norm, settlement, transport_type) VALUES (?, ?, ?, ?, ?)",
+            rows
+        )
+        conn.execute("INSERT INTO meta VALUES ('built_at', ?)", (str(time.time()),))
+        conn.execute("INSERT INTO meta VALUES ('version', ?)", (INDEX_VERSION,))
+        count = conn.execute("SELECT COUNT(*) FROM stations").fetchone()[0]
+        conn.commit()
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, path)
+    return count
+
+
+class StationIndex:
+    """Локальный справочник станций.
+
+    Хранится в SQLite на диске; в памяти держится только компактная строка из
+    нормализованных названий в исходном порядке, массив смещений и
+    триграммный индекс. Поиск по подстроке — один `bytes.find` и бинарный
+    поиск, без обращений к сети; `search` ранжирует несколько кандидатов с
+    учётом опечаток и популярности станций.
+    """
+
+    def __init__(self, path: str = STATIONS_DB):
+        self.path = path
+        self._conn = None
+        self._names = b""
+        self._offsets = array('I')
+        self._trains = array('B')
+        self._trigrams = {}
+        self._popularity = {}
+        self._popular_codes = {}
+        self.built_at = 0.0
+        self._mtime = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._conn is not None
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def seconds_until_stale(self, max_age: float = STATIONS_MAX_AGE) -> float:
+        if not self.loaded:
+            return 0.0
+        return self.built_at + max_age - time.time()
+
+    async def reload_if_changed(self) -> bool:
+        """Перечитать индекс (в потоке), если файл перестроил другой процесс"""
+        if not os.path.exists(self.path) or os.path.getmtime(self.path) == self._mtime:
+            return False
+        return await self.load_async()
+
+    def load(self) -> bool:
+        """Открыть индекс с диска; False, если файла ещё нет"""
+        loaded = self._read()
+        if loaded is None:
+            return False
+        self._install(loaded)
+        return True
+
+    async def load_async(self) -> bool:
+        """load, но чтение файла и сборка триграмм — в потоке: цикл событий не ждёт перестройки"""
+        loaded = await asyncio.to_thread(self._read)
+        if loaded is None:
+            return False
+        self._install(loaded)
+        return True
+
+    def _read(self):
+        """Прочитать индекс в новые структуры, не трогая текущие; None, если файла нет или он другой версии"""
+        if not os.path.exists(self.path):
+            return None
+        mtime = os.path.getmtime(self.path)
+
+        # Соединение открывается в потоке чтения, а используется потом на цикле событий
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+        if meta.get('version') != INDEX_VERSION:
+            conn.close()
+            return None
+
+        names = []
+        offsets = array('I')
+        trains = array('B')
+        postings = {}
+        position = 0
+        rows = conn.execute("SELECT norm, transport_type FROM stations ORDER BY ord")
+        for ordinal, (norm, transport_type) in enumerate(rows):
+            encoded = norm.encode('utf-8')
+            offsets.append(position)
+            names.append(encoded)
+            trains.append(transport_type == 'train')
+            position += len(encoded) + 1
+            for gram in trigrams(norm):
+                postings.setdefault(gram, []).append(ordinal)
+        postings = {gram: array('I', ordinals) for gram, ordinals in postings.items()}
+        return conn, b"\n".join(names), offsets, trains, postings, float(meta.get('built_at', 0.0)), mtime
+
+    def _install(self, loaded: tuple):
+        """Подменить структуры индекса готовыми (на цикле событий, без ожиданий)"""
+        if self._conn is not None:
+            self._conn.close()
+        self._conn, self._names, self._offsets, self._trains, self._trigrams, self.built_at, self._mtime = loaded
+        self.set_popularity(self._popular_codes)
+
+    async def refresh(self, yandex) -> int:
+        """Скачать полный список станций и перестроить индекс"""
+        raw = await yandex.stations_list(raw=True)
+        # json.loads не отпускает GIL (около секунды на полном справочнике), поэтому разбор
+        # и сборка идут в отдельном процессе, а не в потоке: поток остановил бы и цикл событий
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            count = await asyncio.get_running_loop().run_in_executor(pool, build_index, raw, self.path)
+        await self.load_async()
+        logger.info("Справочник станций обновлён: %d станций", count)
+        return count
+
+    def _row(self, ordinal: int) -> tuple:
+        return self._conn.execute(
+            "SELECT code, title FROM stations WHERE ord = ?", (ordinal + 1,)
+        ).fetchone()
+
+    def find(self, query: str) -> tuple:
+        """Первая по порядку справочника станция, в названии которой есть query"""
+        if not self.loaded:
+            return None, None
+        needle = normalize(query)
+        if not needle:
+            return None, None
+
+        if len(needle) >= 3:
+            # Списки триграмм упорядочены как справочник: первая проверенная станция и есть ответ
+            for ordinal in self._candidates(self._trigram_lists(needle)):
+                if needle in self._norm_at(ordinal):
+                    row = self._row(ordinal)
+                    return (row[0], row[1]) if row else (None, None)
+            return None, None
+
+        position = self._names.find(needle.encode('utf-8'))
+        if position < 0:
+            return None, None
+        row = self._row(bisect_right(self._offsets, position) - 1)
+        return (row[0], row[1]) if row else (None, None)
+
+    def title(self, code: str):
+        """Название станции по коду (None, если её нет в справочнике)"""
+        if not self.loaded:
+            return None
+        row = self._conn.execute("SELECT title FROM stations WHERE code = ? LIMIT 1", (code,)).fetchone()
+        return row[0] if row else None
+
+    def set_popularity(self, weights: dict):
+        """Веса популярности станций по коду (например, число сохранённых маршрутов)"""
+        self._popular_codes = dict(weights)
+        self._popularity = {}
+        if not self.loaded or not weights:
+            return
+        codes = list(weights)
+        for start in range(0, len(codes), 500):
+            chunk = codes[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for ordinal, code in self._conn.execute(
+                f"SELECT ord, code FROM stations WHERE code IN ({placeholders})", chunk
+            ):
+                bonus = min(MAX_POPULARITY_BONUS, 10 * math.log2(1 + weights[code]))
+                self._popularity[ordinal - 1] = bonus
+
+    def _norm_at(self, ordinal: int) -> str:
+        start = self._offsets[ordinal]
+        end = self._offsets[ordinal + 1] - 1 if ordinal + 1 < len(self._offsets) else len(self._names)
+        return self._names[start:end].decode('utf-8')
+
+    def _trigram_lists(self, needle: str) -> list:
+        """Списки станций по триграммам needle, от самого короткого"""
+        return sorted((self._trigrams.get(needle[i:i + 3], ()) for i in range(len(needle) - 2)), key=len)
+
+    @staticmethod
+    def _candidates(lists: list, limit: int = None):
+        """Станции, которые могут содержать подстроку, в порядке справочника.
+
+        limit ограничивает, сколько вхождений самого короткого списка просматривается
+        """
+        candidates = lists[0][:limit]
+        if len(candidates) <= INTERSECT_THRESHOLD or len(lists) == 1:
+            return candidates
+        return StationIndex._merge(candidates, lists[1:INTERSECT_LISTS])
+
+    @staticmethod
+    def _merge(candidates, others: list):
+        # Кандидаты идут порциями: каждая пересекается только с участком длинного списка
+        # в своём диапазоне номеров, и перебор останавливается, как только набрано достаточно
+        for start in range(0, len(candidates), MERGE_CHUNK):
+            chunk = candidates[start:start + MERGE_CHUNK]
+            narrowed = set(chunk)
+            for postings in others:
+                low = bisect_left(postings, chunk[0])
+                high = bisect_right(postings, chunk[-1], low)
+                if len(narrowed) * MERGE_PROBE_RATIO < high - low:
+                    # Кандидатов осталось мало: бинарный поиск дешевле обхода участка
+                    narrowed = {ordinal for ordinal in narrowed if _contains(postings, ordinal, low, high)}
+                else:
+                    narrowed.intersection_update(postings[low:high])
+                if not narrowed:
+                    break
+            yield from sorted(narrowed)
+
+    @staticmethod
+    def _match_score(norm: str, needle: str, position: int) -> int:
+        if position == 0:
+            return SCORE_EXACT if len(norm) == len(needle) else SCORE_PREFIX
+        if norm[position - 1] in WORD_SEPARATORS:
+            return SCORE_WORD_PREFIX
+        return SCORE_SUBSTRING
+
+    def _substring_scores(self, needle: str, scores: dict):
+        lists = self._trigram_lists(needle) if len(needle) >= 3 else None
+        if lists is not None and not lists[0]:
+            # Триграммы нет ни в одном названии — нет и подстроки
+            return
+        if lists and (len(lists) > 1 or len(lists[0]) <= BLOB_SCAN_THRESHOLD):
+            found = 0
+            for ordinal in self._candidates(lists, SUBSTRING_CHECKS):
+                norm = self._norm_at(ordinal)
+                position = norm.find(needle)
+                if position >= 0:
+                    scores[ordinal] = self._match_score(norm, needle, position)
+                    found += 1
+                    if found >= SUBSTRING_SCAN:
+                        break
+            return
+
+        # Для коротких и очень частых подстрок быстрее просмотреть строку названий:
+        # совпадения идут плотно, и лимит набирается в её начале. Несколько триграмм
+        # сюда не попадают: если подстроки нет, просмотр дошёл бы до конца строки
+        encoded = needle.encode('utf-8')
+        position = self._names.find(encoded)
+        found = 0
+        while position >= 0 and found < SUBSTRING_SCAN:
+            ordinal = bisect_right(self._offsets, position) - 1
+            norm = self._norm_at(ordinal)
+            scores[ordinal] = self._match_score(norm, needle, norm.find(needle))
+            found += 1
+            next_ordinal = ordinal + 1
+            if next_ordinal >= len(self._offsets):
+                break
+            position = self._names.find(encoded, self._offsets[next_ordinal])
+
+    def _prefix_scores(self, needle: str, scores: dict):
+        # Точные и префиксные совпадения могут быть далеко в порядке справочника,
+        # поэтому дополнительно берём их из отсортированного индекса SQLite
+        rows = self._conn.execute(
+            "SELECT ord, norm FROM stations WHERE norm >= ? AND norm < ? ORDER BY norm LIMIT ?",
+            (needle, needle + "\U0010ffff", PREFIX_SCAN)
+        )
+        for ordinal, norm in rows:
+            score = SCORE_EXACT if norm == needle else SCORE_PREFIX
+            if score > scores.get(ordinal - 1, 0):
+                scores[ordinal - 1] = score
+
+    def _fuzzy_scores(self, needle: str, scores: dict):
+        grams = trigrams(needle)
+        lists = sorted((self._trigrams.get(gram, ()) for gram in grams), key=len)
+        counts = Counter()
+        budget = FUZZY_POSTINGS_BUDGET
+        for postings in lists[:FUZZY_TRIGRAMS]:
+            if len(postings) > min(FUZZY_MAX_POSTINGS, budget):
+                break
+            counts.update(postings)
+            budget -= len(postings)
+
+        for ordinal, _ in counts.most_common(FUZZY_CANDIDATES):
+            if ordinal in scores:
+                continue
+            candidate = trigrams(self._norm_at(ordinal))
+            similarity = len(grams & candidate) / len(grams | candidate)
+            if similarity >= FUZZY_THRESHOLD:
+                scores[ordinal] = SCORE_FUZZY * similarity
+
+    def search(self, query: str, limit: int = 5) -> list:
+        """До limit станций, упорядоченных по качеству совпадения и популярности"""
+        if not self.loaded:
+            return []
+        needle = normalize(query)
+        if not needle:
+            return []
+
+        scores = {}
+        self._substring_scores(needle, scores)
+        self._prefix_scores(needle, scores)
+        if len(scores) < limit and len(needle) >= 3:
+            self._fuzzy_scores(needle, scores)
+        if not scores:
+            return []
+
+        popularity = self._popularity
+        trains = self._trains
+        ranked = heapq.nlargest(
+            limit,
+            ((score + popularity.get(ordinal, 0) + TRAIN_BONUS * trains[ordinal], -ordinal)
+             for ordinal, score in scores.items())
+        )
+        placeholders = ",".join("?" * len(ranked))
+        rows = {
+            row[0]: row[1:]
+            for row in self._conn.execute(
+                f"SELECT ord, code, title, settlement FROM stations WHERE ord IN ({placeholders})",
+                [1 - ordinal for _, ordinal in ranked]
+            )
+        }
+        return [StationMatch(*rows[1 - ordinal], score) for score, ordinal in ranked]
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
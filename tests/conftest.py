@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Бот создаёт базы рядом с собой (пути в bot.py относительные) — во временном каталоге"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
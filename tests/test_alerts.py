@@ -0,0 +1,87 @@
+"""Планировщик уведомлений: пачка сработавших подписок и отписка во время отправки."""
+import asyncio
+import time
+
+from alerts import KIND_BEFORE, Alert, AlertScheduler, AlertStore
+
+
+SEND_SECONDS = 0.1
+
+
+def make_alert(user_id: int, fire_at: float) -> Alert:
+    return Alert(user_id=user_id, chat_id=user_id, kind=KIND_BEFORE, route_name="Домой",
+                 from_station="s9602944", from_name="Клин", to_station="s2006004", to_name="Москва",
+                 minutes=10, fire_at=fire_at, departure=fire_at + 600)
+
+
+async def insert(store: AlertStore, alerts: list):
+    for alert in alerts:
+        alert.id = await store.insert(alert)
+
+
+def test_batch_is_sent_concurrently_and_does_not_block_later_alerts(tmp_path):
+    store = AlertStore(str(tmp_path / "alerts.db"))
+    delivered = {}
+
+    async def send(chat_id: int, text: str):
+        await asyncio.sleep(SEND_SECONDS)
+        delivered[chat_id] = time.monotonic()
+
+    async def fetch(*args):
+        raise AssertionError("напоминания «до отправления» не запрашивают расписание")
+
+    async def scenario():
+        now = time.time()
+        await insert(store, [make_alert(user_id, now) for user_id in range(1, 301)])
+        scheduler = AlertScheduler(store, fetch, send)
+        started = time.monotonic()
+        scheduler.start()
+        # Подписка, сработавшая, пока уходит первая пачка
+        later = make_alert(1000, time.time() + 0.05)
+        later.id = await store.insert(later)
+        scheduler._push(later)
+        while len(delivered) < 301:
+            await asyncio.sleep(0.01)
+            assert time.monotonic() - started < 5
+        await scheduler.stop()
+        return scheduler, started
+
+    try:
+        scheduler, started = asyncio.run(scenario())
+    finally:
+        store.close()
+
+    # Последовательно 301 отправка заняла бы 30 с
+    assert max(delivered.values()) - started < 2
+    assert delivered[1000] - started < 0.5
+    assert scheduler.fired == 301
+    assert len(scheduler) == 0
+
+
+def test_unsubscribe_during_send_is_not_resurrected(tmp_path):
+    path = str(tmp_path / "alerts.db")
+    store = AlertStore(path)
+
+    async def scenario():
+        started = asyncio.Event()
+
+        async def send(chat_id: int, text: str):
+            started.set()
+            await asyncio.sleep(SEND_SECONDS)
+
+        alert = make_alert(7, time.time())
+        await insert(store, [alert])
+        scheduler = AlertScheduler(store, None, send)
+        scheduler.start()
+        await started.wait()
+        assert await scheduler.unsubscribe(7, alert.id)
+        await asyncio.sleep(SEND_SECONDS * 2)
+        await scheduler.stop()
+        return scheduler
+
+    try:
+        scheduler = asyncio.run(scenario())
+        assert scheduler.user_alerts(7) == []
+        assert store.load_all() == []
+    finally:
+        store.close()
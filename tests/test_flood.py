@@ -0,0 +1,35 @@
+"""Ограничение частоты: inline-запросы расходуют тот же лимит, что и сообщения."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram.ext import ApplicationHandlerStop
+
+from flood import DUPLICATE, RATE_LIMITED, FloodControl
+
+
+def inline_update(user_id: int, query: str):
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id), message=None, callback_query=None,
+                           inline_query=SimpleNamespace(query=query))
+
+
+def test_inline_queries_count_against_rate_limit():
+    flood = FloodControl(rate_limit=5, clock=lambda: 100.0)
+
+    async def scenario():
+        # Каждая буква — новый запрос, и каждый может загрузить расписание
+        for query in ["К", "Кл", "Кли", "Клин", "Клин М"]:
+            await flood.check(inline_update(1, query), None)
+        with pytest.raises(ApplicationHandlerStop):
+            await flood.check(inline_update(1, "Клин Мо"), None)
+        # Лимит у каждого пользователя свой
+        await flood.check(inline_update(2, "Клин Мо"), None)
+
+    asyncio.run(scenario())
+    assert flood.dropped[RATE_LIMITED] == 1
+
+
+def test_repeated_inline_query_is_dropped_as_duplicate():
+    flood = FloodControl(rate_limit=5, clock=lambda: 100.0)
+    assert flood.verdict(1, ("inline", "Клин Москва")) is None
+    assert flood.verdict(1, ("inline", "Клин Москва")) == DUPLICATE
@@ -0,0 +1,74 @@
+"""Таблица пересадок: сборка на главном воркере и загрузка из файла на остальных."""
+import asyncio
+import os
+import time
+from datetime import datetime
+
+from journeys import JourneyPlanner
+from timetable import Timetable
+from tools.fake_yandex import MOSCOW_TZ, make_segments
+
+
+DATE = datetime.now(MOSCOW_TZ).strftime("%Y-%m-%d")
+CORRIDOR = ["s9603093", "s9602944", "s2006004"]
+PAIRS = [(a, b) for a in CORRIDOR for b in CORRIDOR if a != b]
+
+
+def make_planner(path, calls: list, **kwargs) -> JourneyPlanner:
+    async def fetch_window(from_station: str, to_station: str, start: datetime):
+        calls.append((time.monotonic(), from_station, to_station))
+        return Timetable.from_response({"segments": make_segments(from_station, to_station, DATE, 20)}, DATE), False
+
+    return JourneyPlanner(fetch_window, lambda: PAIRS, path=str(path), **kwargs)
+
+
+def test_other_workers_load_the_built_table(tmp_path):
+    path = tmp_path / "journeys.bin"
+    builder_calls, reader_calls = [], []
+    builder = make_planner(path, builder_calls, rate=0)
+    reader = make_planner(path, reader_calls)
+    depart_after = MOSCOW_TZ.localize(datetime.strptime(DATE, "%Y-%m-%d").replace(hour=4)).timestamp()
+
+    async def scenario():
+        assert not await reader.load()
+        await builder.rebuild()
+        assert await reader.load()
+        # Файл не менялся — повторно не читается
+        assert not await reader.load()
+
+    asyncio.run(scenario())
+    assert len(builder_calls) == len(PAIRS)
+    assert reader_calls == []
+    assert reader.loads == 1 and reader.builds == 0
+    assert len(reader.table) == len(builder.table)
+    assert reader.stations() == builder.stations()
+    expected = builder.plan(CORRIDOR[0], CORRIDOR[-1], depart_after)
+    assert expected
+    loaded = reader.plan(CORRIDOR[0], CORRIDOR[-1], depart_after)
+    assert [(leg.from_station, leg.to_station, leg.departure, leg.arrival, leg.title)
+            for journey in expected for leg in journey.legs] == \
+           [(leg.from_station, leg.to_station, leg.departure, leg.arrival, leg.title)
+            for journey in loaded for leg in journey.legs]
+    assert reader.seconds_until_stale() > 0
+
+
+def test_damaged_file_is_skipped(tmp_path):
+    path = tmp_path / "journeys.bin"
+    planner = make_planner(path, [], rate=0)
+    asyncio.run(planner.rebuild())
+    data = bytearray(path.read_bytes())
+    data[-1] ^= 0xFF
+    path.write_bytes(bytes(data))
+    os.utime(path, (time.time() + 1, time.time() + 1))
+
+    reader = make_planner(path, [])
+    assert not asyncio.run(reader.load())
+    assert reader.table is None
+
+
+def test_rebuild_is_paced_by_its_own_rate(tmp_path):
+    calls = []
+    planner = make_planner(tmp_path / "journeys.bin", calls, rate=20)
+    asyncio.run(planner.rebuild())
+    # Первый запрос — сразу, остальные — не чаще rate в секунду
+    assert calls[-1][0] - calls[0][0] >= (len(PAIRS) - 1) / 20 * 0.9
@@ -0,0 +1,61 @@
+"""Ленивая загрузка user_data и состояний диалогов, привязка к версии PTB."""
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pytest
+import telegram
+from telegram.ext import CommandHandler, ConversationHandler
+
+from persistence import PTB_VERSION, SQLitePersistence, restore_conversations
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_ptb_version_is_pinned():
+    # restore_conversations опирается на закрытые поля PTB: при обновлении
+    # библиотеки их нужно перепроверить и поднять PTB_VERSION
+    with open(os.path.join(ROOT, "requirements.txt"), encoding="utf-8") as f:
+        pinned = [line.strip() for line in f if line.startswith("python-telegram-bot")]
+    assert pinned == [f"python-telegram-bot[job-queue]=={PTB_VERSION}"]
+    assert telegram.__version__ == PTB_VERSION
+
+
+def test_restored_states_are_not_written_back(tmp_path):
+    persistence = SQLitePersistence(str(tmp_path / "conversations.db"))
+    handler = ConversationHandler(entry_points=[CommandHandler("start", lambda u, c: None)], states={},
+                                  fallbacks=[], name="main", persistent=True)
+    try:
+        # Так же, как Application.initialize готовит обработчик к работе с persistence
+        asyncio.run(handler._initialize_persistence(SimpleNamespace(persistence=persistence)))
+        restore_conversations(handler, {(1, 1): 2})
+    finally:
+        persistence.close()
+    assert handler._conversations[(1, 1)] == 2
+    assert handler._conversations.pop_accessed_write_items() == []
+
+
+def test_failed_load_is_retried(tmp_path):
+    persistence = SQLitePersistence(str(tmp_path / "conversations.db"))
+    persistence._conn.execute("INSERT INTO user_data VALUES (1, ?)", ('{"routes": 1}',))
+    persistence._conn.execute("INSERT INTO conversations VALUES ('main', '[1, 1]', 1, '2')")
+    persistence._conn.commit()
+    load = persistence._load_user
+
+    def broken(user_id: int):
+        raise OSError("disk I/O error")
+
+    async def scenario():
+        persistence._load_user = broken
+        with pytest.raises(OSError):
+            await persistence.load_user(1)
+        persistence._load_user = load
+        assert await persistence.load_user(1) == ({"routes": 1}, {"main": {(1, 1): 2}})
+        # Второй раз не читается
+        assert await persistence.load_user(1) is None
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        persistence.close()
@@ -0,0 +1,56 @@
+"""Прогрев кэша: в webhook-режиме каждый воркер прогревает пары своих пользователей."""
+import asyncio
+
+import prefetch
+
+
+TOKEN = "123456:TEST"
+
+
+def make_bot(worker: tuple):
+    import bot
+
+    async def create():
+        return bot.YandexScheduleBot(TOKEN, worker=worker)
+
+    return asyncio.run(create())
+
+
+def close_bot(scheduler):
+    async def close():
+        await scheduler.yandex.aclose()
+        await scheduler.route_store.close()
+
+    asyncio.run(close())
+    scheduler.alerts.store.close()
+    scheduler.persistence.close()
+    scheduler.station_index.close()
+
+
+def test_each_worker_prefetches_its_own_users(workdir):
+    workers = [make_bot((index, 2)) for index in range(2)]
+    try:
+        for scheduler in workers:
+            # Индекс маршрутов после запуска: пары всех пользователей из общей базы
+            scheduler.route_index.load([
+                (1, "s1", "s2"), (3, "s1", "s2"), (2, "s1", "s2"),
+                (2, "s3", "s4"), (4, "s3", "s4"), (5, "s5", "s6"),
+            ])
+        even, odd = workers
+        assert even.prefetcher.plan() == [("s3", "s4"), ("s1", "s2")]
+        assert odd.prefetcher.plan() == [("s1", "s2"), ("s5", "s6")]
+        # Общая квота прогрева делится между воркерами
+        assert even.prefetcher.rate == odd.prefetcher.rate == prefetch.PREFETCH_RATE / 2
+    finally:
+        for scheduler in workers:
+            close_bot(scheduler)
+
+
+def test_single_worker_prefetches_everyone(workdir):
+    scheduler = make_bot((0, 1))
+    try:
+        scheduler.route_index.load([(1, "s1", "s2"), (2, "s1", "s2"), (3, "s3", "s4")])
+        assert scheduler.prefetcher.plan() == [("s1", "s2"), ("s3", "s4")]
+        assert scheduler.prefetcher.rate == prefetch.PREFETCH_RATE
+    finally:
+        close_bot(scheduler)
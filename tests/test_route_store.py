@@ -0,0 +1,101 @@
+"""Отложенная запись маршрутов: журнал проигрывается после падения процесса."""
+import asyncio
+import os
+import sqlite3
+import time
+
+from route_store import Route, SQLiteRouteStore, WriteBehindRouteStore
+
+
+def route(name: str) -> Route:
+    return Route(name, "s9602944", "Клин", "s2006004", "Москва", 1700000000.0)
+
+
+def open_store(tmp_path, **kwargs) -> WriteBehindRouteStore:
+    return WriteBehindRouteStore(SQLiteRouteStore(str(tmp_path / "routes.db")), str(tmp_path / "routes.journal"),
+                                 flush_interval=3600, **kwargs)
+
+
+def crash(store: WriteBehindRouteStore):
+    """Процесс умер: никакого flush/close, только закрыть дескрипторы"""
+    store._journal.close()
+    store.backend._executor.shutdown()
+    store.backend._reader.close()
+
+
+def names(store, user_id: int) -> list:
+    return [r.name for r in store.load_user(user_id)]
+
+
+def test_unflushed_changes_are_replayed_after_crash(tmp_path):
+    async def before_crash():
+        store = open_store(tmp_path)
+        await store.save_user(1, [route("Домой"), route("На работу")])
+        await store.save_user(2, [route("Дача")])
+        await store.save_user(1, [route("Домой")])
+        crash(store)
+
+    asyncio.run(before_crash())
+    # Обрыв на середине строки при падении
+    with open(tmp_path / "routes.journal", "a", encoding="utf-8") as f:
+        f.write('{"user_id": 3, "routes": [')
+
+    async def after_restart():
+        store = open_store(tmp_path)
+        assert names(store, 1) == ["Домой"]
+        assert names(store, 2) == ["Дача"]
+        assert store.load_user(3) == []
+        await store.flush()
+        await store.close()
+
+    asyncio.run(after_restart())
+    assert os.path.getsize(tmp_path / "routes.journal") == 0
+    with sqlite3.connect(tmp_path / "routes.db") as conn:
+        rows = conn.execute("SELECT user_id, name FROM routes ORDER BY user_id, position").fetchall()
+    assert rows == [(1, "Домой"), (2, "Дача")]
+
+
+def test_saves_during_compaction_survive_crash(tmp_path):
+    async def before_crash():
+        store = open_store(tmp_path)
+        loop = asyncio.get_running_loop()
+        compacting = asyncio.Event()
+        rewrite = store._rewrite_journal
+
+        def slow_rewrite(pending):
+            loop.call_soon_threadsafe(compacting.set)
+            time.sleep(0.1)
+            return rewrite(pending)
+
+        store._rewrite_journal = slow_rewrite
+        for user_id in range(50):
+            await store.save_user(user_id, [route(f"Маршрут {user_id}")])
+        flush = asyncio.create_task(store.flush())
+        # Сохранения, пришедшие, пока журнал сжимается в потоке
+        await compacting.wait()
+        await asyncio.gather(*(store.save_user(user_id, [route("Новый")]) for user_id in range(100, 110)),
+                             store.save_user(0, [route("Изменён")]))
+        await flush
+        crash(store)
+
+    asyncio.run(before_crash())
+
+    async def after_restart():
+        store = open_store(tmp_path)
+        try:
+            assert all(names(store, user_id) == ["Новый"] for user_id in range(100, 110))
+            assert names(store, 0) == ["Изменён"]
+            assert names(store, 49) == ["Маршрут 49"]
+        finally:
+            await store.close()
+
+    asyncio.run(after_restart())
+
+
+def test_writer_commits_with_full_sync(tmp_path):
+    store = SQLiteRouteStore(str(tmp_path / "routes.db"))
+    try:
+        # 2 — FULL: транзакция подтверждается только после fsync WAL
+        assert store._writer().execute("PRAGMA synchronous").fetchone() == (2,)
+    finally:
+        asyncio.run(store.close())
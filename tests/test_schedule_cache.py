@@ -0,0 +1,100 @@
+"""Кэш расписаний: срок жизни, вытеснение LRU и объединение одновременных загрузок."""
+import asyncio
+
+import pytest
+
+from schedule_cache import ScheduleCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_entries_expire_and_stay_available_as_stale():
+    clock = Clock()
+    cache = ScheduleCache(ttl=60, stale_ttl=600, clock=clock)
+    cache.put("key", "value")
+    clock.now += 59
+    assert cache.peek("key") == "value"
+    clock.now += 1
+    assert cache.peek("key") is None
+    assert cache.stale("key") == "value"
+    clock.now += 600
+    assert cache.stale("key") is None
+    assert list(cache.entries()) == []
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ScheduleCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.peek("a") == 1
+    cache.put("c", 3)
+    assert [key for key, _, _ in cache.entries()] == ["a", "c"]
+
+
+def test_concurrent_misses_share_one_load():
+    cache = ScheduleCache()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get("key", loader) for _ in range(10)))
+
+    assert asyncio.run(scenario()) == ["value"] * 10
+    assert len(calls) == 1
+    assert (cache.misses, cache.coalesced) == (1, 9)
+    assert asyncio.run(cache.get("key", loader)) == "value"
+    assert len(calls) == 1
+
+
+def test_waiters_reload_when_first_caller_is_cancelled():
+    cache = ScheduleCache()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def scenario():
+        first = asyncio.create_task(cache.get("key", loader))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(cache.get("key", loader)) for _ in range(5)]
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await asyncio.gather(*waiters)
+
+    # Ожидающие не получают чужую отмену, а загружают заново — одной загрузкой на всех
+    assert asyncio.run(scenario()) == [2] * 5
+    assert len(calls) == 2
+
+
+def test_cancelled_waiter_does_not_cancel_the_load():
+    cache = ScheduleCache()
+
+    async def loader():
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def scenario():
+        first = asyncio.create_task(cache.get("key", loader))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get("key", loader))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await first
+
+    assert asyncio.run(scenario()) == "value"
@@ -0,0 +1,109 @@
+"""Очередь отправки против фейкового Bot API с flood control (tools.fake_telegram)."""
+import asyncio
+import logging
+import time
+
+from telegram.ext import ExtBot
+
+import send_queue
+from send_queue import PRIORITY_BULK, SendQueue
+from tools.fake_telegram import FakeTelegramServer
+
+
+TOKEN = "123456:TEST"
+
+
+def run_with_bot(telegram: FakeTelegramServer, queue: SendQueue, scenario):
+    async def main():
+        bot = ExtBot(TOKEN, base_url=telegram.base_url, rate_limiter=queue)
+        await bot.initialize()
+        try:
+            return await scenario(bot)
+        finally:
+            await bot.shutdown()
+
+    return asyncio.run(main())
+
+
+def texts(telegram: FakeTelegramServer, chat_id: int) -> str:
+    """Всё, что дошло до чата, одной строкой: склейка не меняет порядок текстов"""
+    return "\n\n".join(text for chat, text in telegram.messages if chat == chat_id)
+
+
+def test_retry_after_keeps_order_and_loses_nothing():
+    queue = SendQueue(global_rate=100, chat_rate=100)
+
+    async def scenario(bot):
+        expected = [f"Сообщение {i}" for i in range(6)]
+        results = []
+        for text in expected:
+            results.append(asyncio.create_task(bot.send_message(1, text)))
+            # Между сообщениями успевает уйти предыдущее — иначе они склеятся ещё до 429
+            await asyncio.sleep(0.02)
+
+        # 429 в одном чате не задерживает другой
+        started = time.monotonic()
+        await bot.send_message(2, "Другой чат")
+        other_chat = time.monotonic() - started
+
+        await asyncio.gather(*results)
+        return expected, other_chat
+
+    with FakeTelegramServer(chat_limit=2, retry_after=1) as telegram:
+        expected, other_chat = run_with_bot(telegram, queue, scenario)
+
+    assert telegram.flooded > 0
+    assert queue.retried > 0
+    assert queue.failed == 0
+    assert texts(telegram, 1) == "\n\n".join(expected)
+    assert other_chat < 0.5
+
+
+def test_interactive_reply_overtakes_broadcast():
+    queue = SendQueue(global_rate=5, chat_rate=100)
+
+    async def scenario(bot):
+        broadcast = [asyncio.create_task(bot.send_message(100 + chat, "Рассылка", rate_limit_args=PRIORITY_BULK))
+                     for chat in range(10)]
+        await asyncio.sleep(0.05)
+        await bot.send_message(1, "Ответ пользователю")
+        pending = sum(not task.done() for task in broadcast)
+        await asyncio.gather(*broadcast)
+        return pending
+
+    with FakeTelegramServer(global_limit=10) as telegram:
+        pending = run_with_bot(telegram, queue, scenario)
+
+    order = [chat for chat, _ in telegram.messages]
+    assert order.index(1) <= 2
+    assert pending >= 7
+    assert len(order) == 11
+
+
+def test_shutdown_stops_scheduler_and_fails_pending(monkeypatch, caplog):
+    monkeypatch.setattr(send_queue, "SHUTDOWN_TIMEOUT", 0.1)
+    queue = SendQueue(global_rate=100, chat_rate=0.1)
+
+    async def main():
+        with FakeTelegramServer() as telegram:
+            bot = ExtBot(TOKEN, base_url=telegram.base_url, rate_limiter=queue)
+            await bot.initialize()
+            task = queue._task
+            # Пачка из CHAT_BURST уходит сразу, следующее ждёт лимита чата
+            sends = [asyncio.create_task(bot.send_message(1, f"Сообщение {i}",
+                                                          disable_notification=bool(i % 2)))
+                     for i in range(send_queue.CHAT_BURST + 1)]
+            await asyncio.sleep(0.05)
+            await queue.shutdown()
+            # Планировщик дождались, а не бросили отменённым
+            assert task.done() and task.cancelled()
+            await bot.shutdown()
+            return await asyncio.gather(*sends, return_exceptions=True)
+
+    with caplog.at_level(logging.ERROR, logger="send_queue"):
+        results = asyncio.run(main())
+
+    failed = [result for result in results if isinstance(result, RuntimeError)]
+    assert failed
+    assert len(failed) + sum(not isinstance(result, Exception) for result in results) == len(results)
+    assert f"Не отправлено сообщений при остановке: {len(failed)}" in caplog.text
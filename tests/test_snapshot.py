@@ -0,0 +1,93 @@
+"""Снимок расписаний: запись, загрузка через mmap и отбраковка чужих или старых файлов."""
+import struct
+import time
+from datetime import datetime, timedelta
+
+from schedule_cache import ScheduleCache
+from snapshot import HEADER, Snapshot, current_entries, restore, write_snapshot
+from timetable import Timetable
+from tools.fake_yandex import MOSCOW_TZ, make_segments
+
+
+NOW = time.time()
+TODAY = datetime.fromtimestamp(NOW, MOSCOW_TZ)
+DATES = [(TODAY + timedelta(days=offset)).strftime("%Y-%m-%d") for offset in (-1, 0, 1)]
+YESTERDAY, DATE, TOMORROW = DATES
+
+
+def timetable(date: str, count: int = 30) -> Timetable:
+    return Timetable.from_response({"segments": make_segments("s9602944", "s2006004", date, count)}, date)
+
+
+def columns(value: Timetable) -> tuple:
+    return (list(value.departures), list(value.arrivals), list(value.durations),
+            [value.title(index) for index in range(len(value))],
+            list(value.departure_text), list(value.arrival_text))
+
+
+def test_round_trip_maps_columns_from_file(tmp_path):
+    path = str(tmp_path / "timetables.snap")
+    cache = ScheduleCache()
+    for index, date in enumerate([DATE, TOMORROW]):
+        cache.put(("s9602944", "s2006004", date), timetable(date, 30 + index))
+    cache.put(("s9602944", "s9603093", DATE), timetable(DATE, 0))
+    assert write_snapshot(path, current_entries(cache, NOW)) > HEADER.size
+
+    snapshot = Snapshot(path)
+    assert snapshot.load()
+    restored = ScheduleCache()
+    assert restore(restored, snapshot, NOW) == 3
+    for key, original, _ in cache.entries():
+        loaded = restored.peek(key)
+        assert columns(loaded) == columns(original)
+        assert loaded.dates == (key[2],)
+    # Колонки не копируются: это окна на отображённый файл
+    assert isinstance(restored.peek(("s9602944", "s2006004", DATE)).departures, memoryview)
+
+
+def test_damaged_or_foreign_file_is_skipped(tmp_path):
+    path = tmp_path / "timetables.snap"
+    write_snapshot(str(path), [(("s9602944", "s2006004", DATE), timetable(DATE), NOW + 600)])
+    data = path.read_bytes()
+
+    damaged = bytearray(data)
+    damaged[-1] ^= 0xFF
+    path.write_bytes(bytes(damaged))
+    assert not Snapshot(str(path)).load()
+
+    # Версия — третье поле заголовка, сразу после магии
+    other_version = bytearray(data)
+    struct.pack_into("<H", other_version, 8, 99)
+    path.write_bytes(bytes(other_version))
+    assert not Snapshot(str(path)).load()
+
+    path.write_bytes(data[:HEADER.size - 1])
+    assert not Snapshot(str(path)).load()
+
+    path.write_bytes(data)
+    assert Snapshot(str(path)).load()
+
+
+def test_past_dates_and_long_expired_entries_are_dropped(tmp_path):
+    path = str(tmp_path / "timetables.snap")
+    cache = ScheduleCache()
+    for date in DATES:
+        cache.put(("s9602944", "s2006004", date), timetable(date))
+    # Прошедшая дата в снимок не попадает
+    assert sorted(key[2] for key, _, _ in current_entries(cache, NOW)) == [DATE, TOMORROW]
+
+    # Старый снимок: вчерашняя дата и запись, истёкшая дольше stale_ttl назад
+    restored = ScheduleCache()
+    write_snapshot(path, [
+        (("s9602944", "s2006004", YESTERDAY), timetable(YESTERDAY), NOW + 600),
+        (("s9602944", "s2006004", DATE), timetable(DATE), NOW - restored.stale_ttl - 1),
+        (("s9602944", "s2006004", TOMORROW), timetable(TOMORROW), NOW - 60),
+    ])
+    snapshot = Snapshot(path)
+    assert snapshot.load()
+    assert restore(restored, snapshot, NOW) == 1
+    assert [key[2] for key, _, _ in restored.entries()] == [TOMORROW]
+    # Истёкшая недавно запись годится только как запасной ответ
+    key = ("s9602944", "s2006004", TOMORROW)
+    assert restored.peek(key) is None
+    assert restored.stale(key) is not None
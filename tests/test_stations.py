@@ -0,0 +1,42 @@
+"""Справочник станций: обновление из API и поиск."""
+import asyncio
+
+from stations import StationIndex, build_index
+from tools.bench_stations import make_stations_tree
+from tools.fake_yandex import FakeYandexServer
+from yandex_client import YandexClient
+
+
+def test_refresh_builds_index_from_raw_response(workdir):
+    async def scenario():
+        with FakeYandexServer() as server:
+            client = YandexClient("test", search_url=server.search_url, stations_url=server.stations_url)
+            index = StationIndex(str(workdir / "stations.db"))
+            try:
+                count = await index.refresh(client)
+            finally:
+                await client.aclose()
+        return index, count
+
+    index, count = asyncio.run(scenario())
+    try:
+        assert count == len(index) > 0
+        assert index.find("Клин")[0] == "s9602944"
+    finally:
+        index.close()
+
+
+def test_find_matches_full_scan(workdir):
+    path = str(workdir / "stations.db")
+    build_index(make_stations_tree(5000), path)
+    index = StationIndex(path)
+    index.load()
+    try:
+        norms = [index._norm_at(ordinal) for ordinal in range(len(index))]
+        # Длинные списки триграмм пересекаются порциями — ответ как у полного перебора
+        for needle in ["сорт", "горов", "сходк", "дкиска", "новнеч", "товарная", "клин", "ыыы"]:
+            expected = next((ordinal for ordinal, norm in enumerate(norms) if needle in norm), None)
+            code, _ = index.find(needle)
+            assert code == (index._row(expected)[0] if expected is not None else None), needle
+    finally:
+        index.close()
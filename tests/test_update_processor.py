@@ -0,0 +1,71 @@
+"""Обработка обновлений: порядок внутри пользователя и параллельность между пользователями."""
+import asyncio
+import itertools
+import time
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, MessageHandler, filters
+
+from tools.fake_telegram import FakeTelegramServer
+from update_processor import PerUserUpdateProcessor
+
+
+TOKEN = "123456:TEST"
+HANDLER_SECONDS = 0.05
+
+
+async def run_updates(server: FakeTelegramServer, processor: PerUserUpdateProcessor, messages: list) -> dict:
+    """Прогнать сообщения (user_id, текст) через Application; время ответа каждому сообщению"""
+    application = ApplicationBuilder().token(TOKEN).base_url(server.base_url) \
+        .concurrent_updates(processor).updater(None).build()
+    answered = {}
+    done = asyncio.Event()
+
+    async def handle(update: Update, context):
+        # Первые сообщения пользователя обрабатываются дольше: без блокировки они отстали бы
+        await asyncio.sleep(HANDLER_SECONDS * (2 if update.message.text.endswith(" 0") else 1))
+        await context.bot.send_message(update.effective_chat.id, update.message.text)
+        answered[update.update_id] = time.monotonic()
+        if len(answered) == len(messages):
+            done.set()
+
+    application.add_handler(MessageHandler(filters.TEXT, handle))
+    update_ids = itertools.count(1)
+    await application.initialize()
+    await application.start()
+    started = time.monotonic()
+    for user_id, text in messages:
+        update_id = next(update_ids)
+        await application.update_queue.put(Update.de_json({"update_id": update_id, "message": {
+            "message_id": update_id, "date": int(time.time()), "text": text,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+        }}, application.bot))
+    await asyncio.wait_for(done.wait(), 30)
+    await application.stop()
+    await application.shutdown()
+    return {update_id: at - started for update_id, at in answered.items()}
+
+
+def test_user_order_is_kept_and_users_run_in_parallel():
+    messages = [(user_id, f"{user_id} {index}") for index in range(5) for user_id in range(1, 21)]
+    with FakeTelegramServer() as server:
+        answered = asyncio.run(run_updates(server, PerUserUpdateProcessor(), messages))
+
+    for user_id in range(1, 21):
+        assert [text for chat_id, text in server.messages if chat_id == user_id] == \
+               [f"{user_id} {index}" for index in range(5)]
+    # Последовательно 100 обновлений заняли бы больше 5 с, по очереди внутри пользователя — 0,3 с
+    assert max(answered.values()) < 2
+
+
+def test_flooding_user_does_not_take_every_slot():
+    # Первый пользователь присылает 40 сообщений подряд, остальные — по одному следом
+    messages = [(1, f"1 {index}") for index in range(40)] + [(user_id, f"{user_id} 1") for user_id in range(2, 6)]
+    with FakeTelegramServer() as server:
+        answered = asyncio.run(run_updates(server, PerUserUpdateProcessor(max_concurrent_updates=4), messages))
+
+    # Обновления первого пользователя идут по очереди и держат один слот из четырёх;
+    # остальным не приходится ждать, пока разберётся вся его очередь (больше 2 с)
+    assert all(answered[update_id] < 1 for update_id in range(41, 45))
+    assert [text for chat_id, text in server.messages if chat_id == 1] == [f"1 {index}" for index in range(40)]
@@ -0,0 +1,163 @@
+"""Клиент API Яндекса против локального сервера с внедрёнными сбоями (tools.fake_yandex)."""
+import asyncio
+import time
+from datetime import datetime
+
+import pytest
+
+import yandex_client
+from resilience import CircuitBreaker, CircuitOpenError
+from schedule_cache import ScheduleCache
+from tools.fake_yandex import MOSCOW_TZ, FakeYandexServer
+from yandex_client import YandexClient
+
+
+DATE = datetime.now(MOSCOW_TZ).strftime("%Y-%m-%d")
+FROM, TO = "s9602944", "s2006004"
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(yandex_client, "backoff_delay", lambda attempt: 0.01)
+
+
+@pytest.fixture
+def server():
+    with FakeYandexServer() as server:
+        yield server
+
+
+def make_client(server, **kwargs) -> YandexClient:
+    kwargs.setdefault("rate_limit", 1000)
+    kwargs.setdefault("rate_burst", 1000)
+    return YandexClient("test", search_url=server.search_url, stations_url=server.stations_url, **kwargs)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_retries_until_success(server):
+    server.fail_next = 2
+
+    async def scenario():
+        client = make_client(server, retries=3)
+        try:
+            data = await client.search(FROM, TO, DATE)
+        finally:
+            await client.aclose()
+        return client, data
+
+    client, data = run(scenario())
+    assert data["segments"]
+    assert server.requests == 3
+    assert client.retried == 2
+    breaker = client.breaker(server.search_url)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+
+
+def test_exhausted_retries_count_as_one_failure(server):
+    server.error_rate = 1.0
+
+    async def scenario():
+        client = make_client(server, retries=3)
+        try:
+            with pytest.raises(Exception):
+                await client.search(FROM, TO, DATE)
+        finally:
+            await client.aclose()
+        return client
+
+    client = run(scenario())
+    assert server.requests == 4
+    assert client.breaker(server.search_url).failures == 1
+    assert client.breaker(server.search_url).state == CircuitBreaker.CLOSED
+
+
+def test_breaker_opens_then_half_open_probe_closes_it(server):
+    server.error_rate = 1.0
+
+    async def scenario():
+        client = make_client(server, retries=0)
+        breaker = client.breakers[server.search_url] = CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+        try:
+            for _ in range(2):
+                with pytest.raises(Exception):
+                    await client.search(FROM, TO, DATE)
+            assert breaker.state == CircuitBreaker.OPEN
+
+            # Разомкнутый предохранитель отклоняет запрос, не обращаясь к серверу
+            requests = server.requests
+            with pytest.raises(CircuitOpenError):
+                await client.search(FROM, TO, DATE)
+            assert server.requests == requests
+            assert breaker.rejected == 1
+
+            # Пробный запрос после reset_timeout: ошибка снова размыкает цепь
+            await asyncio.sleep(0.25)
+            with pytest.raises(Exception):
+                await client.search(FROM, TO, DATE)
+            assert breaker.state == CircuitBreaker.OPEN
+            assert server.requests == requests + 1
+
+            # Успешный пробный запрос замыкает её
+            server.error_rate = 0.0
+            await asyncio.sleep(0.25)
+            assert (await client.search(FROM, TO, DATE))["segments"]
+            assert breaker.state == CircuitBreaker.CLOSED
+            assert breaker.failures == 0
+        finally:
+            await client.aclose()
+
+    run(scenario())
+
+
+def test_serves_stale_timetable_when_api_fails(server, workdir):
+    import bot
+
+    async def scenario():
+        scheduler = bot.YandexScheduleBot("123456:TEST")
+        await scheduler.yandex.aclose()
+        scheduler.yandex = make_client(server, retries=1)
+        scheduler.schedule_cache = ScheduleCache(ttl=0.05)
+        try:
+            fresh, stale = await scheduler.fetch_schedule_or_stale(FROM, TO, DATE)
+            assert not stale and len(fresh)
+
+            server.error_rate = 1.0
+            await asyncio.sleep(0.1)
+            started = time.monotonic()
+            cached, stale = await scheduler.fetch_schedule_or_stale(FROM, TO, DATE)
+            assert stale
+            assert cached is fresh
+            assert time.monotonic() - started < yandex_client.SEARCH_DEADLINE
+
+            # Без сохранённого расписания ошибка доходит до обработчика
+            with pytest.raises(Exception):
+                await scheduler.fetch_schedule_or_stale(FROM, "s9603093", DATE)
+        finally:
+            await scheduler.yandex.aclose()
+            await scheduler.route_store.close()
+            scheduler.alerts.store.close()
+            scheduler.persistence.close()
+            scheduler.station_index.close()
+
+    run(scenario())
+
+
+def test_rate_limit_is_split_between_workers(workdir):
+    import bot
+
+    async def scenario():
+        scheduler = bot.YandexScheduleBot("123456:TEST", worker=(1, 4))
+        try:
+            return scheduler.yandex.limiter.rate
+        finally:
+            await scheduler.yandex.aclose()
+            await scheduler.route_store.close()
+            scheduler.alerts.store.close()
+            scheduler.persistence.close()
+            scheduler.station_index.close()
+
+    assert run(scenario()) == pytest.approx(yandex_client.RATE_LIMIT / 4)
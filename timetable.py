@@ -0,0 +1,105 @@
+import sys
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+
+import pytz
+
+
+MOSCOW_TZ = pytz.timezone('Europe/Moscow')
+
+
+class Timetable:
+    """Расписание пары станций на одну дату в компактном виде.
+
+    Ответ API разбирается один раз: времена хранятся в массивах секунд epoch,
+    отсортированных по отправлению, подписи «ЧЧ:ММ» по Москве считаются
+    заранее, а названия ниток интернируются. Поиск ближайших поездов — bisect.
+    """
+
+    __slots__ = ('date', 'dates', 'departures', 'arrivals', 'durations', 'title_ids', 'titles',
+                 'departure_text', 'arrival_text')
+
+    def __init__(self, date: str = ""):
+        self.date = date
+        # Даты, из которых собрано расписание (несколько — у окна из `merge`)
+        self.dates = (date,) if date else ()
+        self.departures = array('q')
+        self.arrivals = array('q')
+        self.durations = array('i')
+        self.title_ids = array('I')
+        self.titles = []
+        self.departure_text = []
+        self.arrival_text = []
+
+    @classmethod
+    def from_response(cls, data: dict, date: str = "") -> "Timetable":
+        """Разобрать ответ поиска API (пустое расписание, если сегментов нет)"""
+        parsed = []
+        for segment in data.get('segments') or []:
+            departure = datetime.strptime(segment['departure'], '%Y-%m-%dT%H:%M:%S%z')
+            arrival = datetime.strptime(segment['arrival'], '%Y-%m-%dT%H:%M:%S%z')
+            parsed.append((departure, arrival, int(segment['duration']), segment['thread']['title']))
+        parsed.sort(key=lambda item: item[0])
+
+        timetable = cls(date)
+        title_index = {}
+        for departure, arrival, duration, title in parsed:
+            title_id = title_index.get(title)
+            if title_id is None:
+                title_id = title_index[title] = len(timetable.titles)
+                timetable.titles.append(sys.intern(title))
+            timetable.departures.append(int(departure.timestamp()))
+            timetable.arrivals.append(int(arrival.timestamp()))
+            timetable.durations.append(duration)
+            timetable.title_ids.append(title_id)
+            timetable.departure_text.append(departure.astimezone(MOSCOW_TZ).strftime('%H:%M'))
+            timetable.arrival_text.append(arrival.astimezone(MOSCOW_TZ).strftime('%H:%M'))
+        return timetable
+
+    @classmethod
+    def merge(cls, timetables: list) -> "Timetable":
+        """Окно из расписаний на несколько дат — один поток, отсортированный по отправлению"""
+        timetables = [timetable for timetable in timetables if timetable is not None]
+        if len(timetables) == 1:
+            return timetables[0]
+
+        window = cls(timetables[0].date if timetables else "")
+        window.dates = tuple(date for timetable in timetables for date in timetable.dates)
+        rows = []
+        for timetable in timetables:
+            rows.extend(zip(timetable.departures, timetable.arrivals, timetable.durations,
+                            (timetable.titles[title_id] for title_id in timetable.title_ids),
+                            timetable.departure_text, timetable.arrival_text))
+        # Даты идут подряд, так что обычно поток уже упорядочен
+        if any(rows[i][0] > rows[i + 1][0] for i in range(len(rows) - 1)):
+            rows.sort(key=lambda row: row[0])
+
+        title_index = {}
+        for departure, arrival, duration, title, departure_text, arrival_text in rows:
+            title_id = title_index.get(title)
+            if title_id is None:
+                title_id = title_index[title] = len(window.titles)
+                window.titles.append(title)
+            window.departures.append(departure)
+            window.arrivals.append(arrival)
+            window.durations.append(duration)
+            window.title_ids.append(title_id)
+            window.departure_text.append(departure_text)
+            window.arrival_text.append(arrival_text)
+        return window
+
+    def __len__(self):
+        return len(self.departures)
+
+    def title(self, index: int) -> str:
+        return self.titles[self.title_ids[index]]
+
+    def index_after(self, timestamp: float) -> int:
+        """Индекс первого отправления не раньше timestamp"""
+        return bisect_left(self.departures, timestamp)
+
+    def next_after(self, timestamp: float, count: int) -> range:
+        """Индексы ближайших count отправлений не раньше timestamp"""
+        start = self.index_after(timestamp)
+        return range(start, min(start + count, len(self.departures)))
@@ -0,0 +1 @@
+"""Вспомогательные инструменты для локальной разработки: фейковые серверы, бенчмарки"""
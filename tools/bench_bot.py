@@ -0,0 +1,731 @@
+"""Офлайн-бенчмарки горячих путей бота.
+
+Обработчики YandexScheduleBot вызываются с фейковыми Update/Context, вместо
+API Яндекса — записанные ответы (фикстуры из tools.fake_yandex и
+tools.bench_stations), вместо Telegram — tools.fake_telegram. Результат —
+JSON, который удобно сравнивать между прогонами:
+
+    python -m tools.bench_bot --output before.json
+    python -m tools.bench_bot --cases show_schedule,save_routes --route-users 10000,100000
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import pickle
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import bot  # noqa: E402
+import logs  # noqa: E402
+from journeys import ConnectionTable  # noqa: E402
+from resilience import TokenBucket  # noqa: E402
+from route_store import Route, SQLiteRouteStore, WriteBehindRouteStore  # noqa: E402
+from schedule_cache import ScheduleCache  # noqa: E402
+from send_queue import CHAT_BURST, GLOBAL_RATE, PRIORITY_BULK, SendQueue  # noqa: E402
+from snapshot import Snapshot, current_entries, restore, write_snapshot  # noqa: E402
+from stations import build_index  # noqa: E402
+from timetable import Timetable  # noqa: E402
+from tools.bench_stations import make_queries, make_stations_tree  # noqa: E402
+from telegram import Bot  # noqa: E402
+from telegram.error import RetryAfter  # noqa: E402
+from telegram.ext import ExtBot  # noqa: E402
+from tools.fake_telegram import FakeTelegramServer  # noqa: E402
+from tools.fake_yandex import MOSCOW_TZ, make_segments  # noqa: E402
+from tools.loadgen import SCENARIO, percentile  # noqa: E402
+
+
+TOKEN = "123456:BENCH"
+UNLIMITED = 1e9
+# Простой цикла событий между обновлениями в бенчмарке логирования
+LOG_UPDATE_GAP = 0.0002
+CASES = ("show_schedule", "station_lookup", "save_routes", "end_to_end", "send_queue", "journeys", "snapshot",
+         "logging")
+
+
+class FixtureYandex:
+    """Заменяет YandexClient: отдаёт заранее записанные ответы без сети"""
+
+    def __init__(self, segments: int = 50, stations: dict = None):
+        self.segments = segments
+        self.stations = stations or {"countries": []}
+        self._responses = {}
+        self.requests = 0
+
+    async def search(self, from_station: str, to_station: str, date: str, limit: int = 50) -> dict:
+        self.requests += 1
+        key = (from_station, to_station, date)
+        response = self._responses.get(key)
+        if response is None:
+            response = self._responses[key] = {"segments": make_segments(from_station, to_station, date, self.segments)}
+        return response
+
+    async def stations_list(self, station_name: str = None, timeout: float = None, raw: bool = False):
+        self.requests += 1
+        return json.dumps(self.stations, ensure_ascii=False).encode("utf-8") if raw else self.stations
+
+    async def aclose(self):
+        pass
+
+
+class FakeMessage:
+    def __init__(self, text: str, user_id: int):
+        self.text = text
+        self.chat_id = user_id
+        self.from_user = SimpleNamespace(id=user_id, first_name=f"User{user_id}")
+        self.chat = SimpleNamespace(id=user_id)
+        self.replies = []
+
+    async def reply_text(self, text: str, **kwargs):
+        self.replies.append(text)
+
+
+def fake_update(text: str, user_id: int = 1) -> SimpleNamespace:
+    message = FakeMessage(text, user_id)
+    return SimpleNamespace(message=message, effective_message=message,
+                           effective_user=message.from_user, effective_chat=message.chat)
+
+
+def fake_context(user_data: dict = None, args: list = None) -> SimpleNamespace:
+    return SimpleNamespace(user_data=user_data if user_data is not None else {}, bot_data={}, args=args or [])
+
+
+def summary_us(timings: list) -> dict:
+    return {
+        "mean": round(statistics.mean(timings) * 1e6, 1),
+        "p50": round(percentile(timings, 0.5) * 1e6, 1),
+        "p99": round(percentile(timings, 0.99) * 1e6, 1),
+    }
+
+
+async def make_bot(yandex: FixtureYandex, **kwargs) -> bot.YandexScheduleBot:
+    scheduler = bot.YandexScheduleBot(TOKEN, **kwargs)
+    await scheduler.yandex.aclose()
+    scheduler.yandex = yandex
+    return scheduler
+
+
+async def close_bot(scheduler: bot.YandexScheduleBot):
+    await scheduler.route_store.close()
+    scheduler.alerts.store.close()
+    scheduler.persistence.close()
+    scheduler.station_index.close()
+
+
+async def bench_show_schedule(iterations: int, segments: int) -> dict:
+    """Разбор ответа на segments рейсов и форматирование «ближайших поездов»"""
+    yandex = FixtureYandex(segments)
+    scheduler = await make_bot(yandex)
+    # Середина дня, чтобы в ответе были и прошедшие, и будущие поезда
+    noon = datetime.now(MOSCOW_TZ).replace(hour=12, minute=0, second=0, microsecond=0)
+    scheduler.get_moscow_time = lambda: noon
+    user_data = {'from_station': 's9602944', 'to_station': 's2006004',
+                 'from_station_name': 'Клин', 'to_station_name': 'Москва'}
+    date = noon.strftime("%Y-%m-%d")
+    response = await yandex.search('s9602944', 's2006004', date)
+
+    parse = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        Timetable.from_response(response, date)
+        parse.append(time.perf_counter() - started)
+
+    cold = []
+    for _ in range(iterations):
+        scheduler.schedule_cache = bot.ScheduleCache()
+        scheduler.messages = bot.MessageCache()
+        update = fake_update("📅 Получить расписание")
+        started = time.perf_counter()
+        await scheduler.show_schedule(update, fake_context(dict(user_data)))
+        cold.append(time.perf_counter() - started)
+
+    # Расписание в кэше, сообщение собирается заново
+    warm = []
+    for _ in range(iterations):
+        scheduler.messages = bot.MessageCache()
+        update = fake_update("📅 Получить расписание")
+        started = time.perf_counter()
+        await scheduler.show_schedule(update, fake_context(dict(user_data)))
+        warm.append(time.perf_counter() - started)
+
+    # Готовое сообщение для той же пары в ту же минуту
+    rendered = []
+    for _ in range(iterations):
+        update = fake_update("📅 Получить расписание")
+        started = time.perf_counter()
+        await scheduler.show_schedule(update, fake_context(dict(user_data)))
+        rendered.append(time.perf_counter() - started)
+
+    await close_bot(scheduler)
+    return {
+        "segments": segments,
+        "iterations": iterations,
+        "parse_us": summary_us(parse),
+        "cold_us": summary_us(cold),
+        "warm_us": summary_us(warm),
+        "rendered_us": summary_us(rendered),
+        "reply_chars": len(update.message.replies[-1]),
+    }
+
+
+async def bench_station_lookup(stations: int, queries: int) -> dict:
+    """Поиск станций ботом по полному справочнику"""
+    scheduler = await make_bot(FixtureYandex())
+    build_index(make_stations_tree(stations), scheduler.station_index.path)
+    started = time.perf_counter()
+    scheduler.station_index.load()
+    load_seconds = time.perf_counter() - started
+    workload = make_queries(scheduler.station_index, queries)
+
+    search = []
+    for query in workload:
+        started = time.perf_counter()
+        scheduler.station_index.search(query, bot.STATION_CANDIDATES)
+        search.append(time.perf_counter() - started)
+
+    find = []
+    for query in workload:
+        started = time.perf_counter()
+        await scheduler.search_station(query)
+        find.append(time.perf_counter() - started)
+
+    await close_bot(scheduler)
+    return {
+        "stations": stations,
+        "queries": queries,
+        "load_s": round(load_seconds, 3),
+        "search_us": summary_us(search),
+        "search_station_us": summary_us(find),
+    }
+
+
+def make_user_routes(users: int, seed: int = 3) -> dict:
+    rnd = random.Random(seed)
+    codes = [f"s{9600000 + i}" for i in range(500)]
+    created_at = time.time()
+    return {
+        100_000 + user: [
+            Route(f"Маршрут {i}", rnd.choice(codes), "Откуда", rnd.choice(codes), "Куда", created_at)
+            for i in range(rnd.randint(1, 3))
+        ]
+        for user in range(users)
+    }
+
+
+async def bench_save_routes(users: int, saves: int) -> dict:
+    """Сохранение маршрутов при users пользователях: одно изменение и сброс всех"""
+    routes = make_user_routes(users)
+    result = {"users": users}
+
+    # Прежний формат: каждое сохранение переписывало весь pickle
+    started = time.perf_counter()
+    with open("routes.pkl", "wb") as f:
+        pickle.dump(routes, f)
+    result["pickle_dump_s"] = round(time.perf_counter() - started, 4)
+
+    backend = SQLiteRouteStore(f"routes-{users}.db")
+    started = time.perf_counter()
+    await backend.save_users(routes)
+    result["sqlite_bulk_s"] = round(time.perf_counter() - started, 4)
+
+    # Отложенная запись: сохранение одного пользователя — строка журнала
+    store = WriteBehindRouteStore(backend, f"routes-{users}.journal", batch_size=saves + 1)
+    user_ids = list(routes)
+    timings = []
+    for user_id in itertools.islice(itertools.cycle(user_ids), saves):
+        started = time.perf_counter()
+        await store.save_user(user_id, routes[user_id])
+        timings.append(time.perf_counter() - started)
+    result["save_user_us"] = summary_us(timings)
+
+    started = time.perf_counter()
+    await store.flush()
+    result["flush_s"] = round(time.perf_counter() - started, 4)
+    result["flushed_users"] = store.flushed_users
+    await store.close()
+    return result
+
+
+class TimedUpdateProcessor(bot.PerUserUpdateProcessor):
+    """Процессор бота, сообщающий о завершении обработки каждого обновления"""
+    __slots__ = ('on_done',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_done = None
+
+    async def do_process_update(self, update, coroutine) -> None:
+        try:
+            await super().do_process_update(update, coroutine)
+        finally:
+            if self.on_done is not None:
+                self.on_done(update)
+
+
+async def bench_end_to_end(users: int, rounds: int) -> dict:
+    """Пропускная способность Application: обновления от users одновременных пользователей.
+
+    Обновления идут тем же путём, что и от Updater: в application.update_queue
+    запущенного приложения, откуда их разбирает процессор бота. Каждый
+    пользователь пишет следующее сообщение, когда обработано предыдущее;
+    задержка — от постановки в очередь до конца обработки.
+    """
+    with FakeTelegramServer() as telegram:
+        # Бот создаёт процессор сам — на время создания подменяем класс
+        bot.PerUserUpdateProcessor = TimedUpdateProcessor
+        try:
+            scheduler = await make_bot(FixtureYandex(), base_url=telegram.base_url)
+        finally:
+            bot.PerUserUpdateProcessor = TimedUpdateProcessor.__base__
+        # Пользователи сценария пишут без пауз, быстрее лимитов Telegram; здесь меряется работа
+        # обработчиков, а не очередь отправки (для неё — случай send_queue)
+        scheduler.send_queue.bucket = TokenBucket(UNLIMITED, UNLIMITED)
+        scheduler.send_queue.chat_rate = UNLIMITED
+        scheduler.station_index.load()
+        application = scheduler.application
+        update_ids = itertools.count(1)
+        pending = {}
+
+        def done(update):
+            future = pending.pop(update.update_id, None)
+            if future is not None and not future.done():
+                future.set_result(time.perf_counter())
+
+        scheduler.update_processor.on_done = done
+
+        def make_update(user_id: int, text: str):
+            update_id = next(update_ids)
+            message = {
+                "message_id": update_id, "date": int(time.time()), "text": text,
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+            }
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+            return bot.Update.de_json({"update_id": update_id, "message": message}, application.bot)
+
+        latencies = []
+        loop = asyncio.get_running_loop()
+
+        async def send(user_id: int, text: str):
+            update = make_update(user_id, text)
+            finished = pending[update.update_id] = loop.create_future()
+            started = time.perf_counter()
+            await application.update_queue.put(update)
+            latencies.append(await finished - started)
+
+        async def user(user_id: int):
+            await send(user_id, "/start")
+            for _ in range(rounds):
+                for text, _ in SCENARIO:
+                    await send(user_id, text)
+
+        await application.initialize()
+        await application.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(user(10_000 + i) for i in range(users)))
+        elapsed = time.perf_counter() - started
+        await application.update_queue.join()
+        await application.stop()
+        await application.shutdown()
+        await close_bot(scheduler)
+
+    return {
+        "users": users,
+        "updates": len(latencies),
+        "seconds": round(elapsed, 3),
+        "updates_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "telegram_calls": sum(telegram.calls.values()),
+    }
+
+
+async def bench_send_queue(chats: int, per_chat: int) -> dict:
+    """Рассылка per_chat сообщений в chats чатов и ответы chats/5 пользователям на её фоне.
+
+    Фейковый Bot API отвечает 429 сверх лимитов Telegram; без очереди такие
+    сообщения теряются, с очередью — ждут, склеиваются и пропускают вперёд ответы.
+    """
+    result = {"chats": chats, "per_chat": per_chat}
+    for mode in ("direct", "queue"):
+        # Пачку из CHAT_BURST сообщений Telegram на деле пропускает, дальше — около одного в секунду
+        with FakeTelegramServer(chat_limit=CHAT_BURST + 1, global_limit=int(GLOBAL_RATE)) as telegram:
+            if mode == "queue":
+                send_queue = SendQueue()
+                telegram_bot = ExtBot(TOKEN, base_url=telegram.base_url, rate_limiter=send_queue)
+                bulk = {"rate_limit_args": PRIORITY_BULK}
+            else:
+                telegram_bot = Bot(TOKEN, base_url=telegram.base_url)
+                bulk = {}
+            await telegram_bot.initialize()
+            lost = 0
+            replies = []
+
+            async def broadcast(chat_id: int, index: int):
+                nonlocal lost
+                try:
+                    await telegram_bot.send_message(chat_id, f"Рассылка {index}", **bulk)
+                except RetryAfter:
+                    lost += 1
+
+            async def reply(chat_id: int):
+                nonlocal lost
+                await asyncio.sleep(0.05)
+                started = time.perf_counter()
+                try:
+                    await telegram_bot.send_message(chat_id, "Ответ пользователю")
+                except RetryAfter:
+                    lost += 1
+                replies.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            await asyncio.gather(
+                *(broadcast(1000 + chat, index) for chat in range(chats) for index in range(per_chat)),
+                *(reply(2000 + chat) for chat in range(max(1, chats // 5)))
+            )
+            elapsed = time.perf_counter() - started
+            await telegram_bot.shutdown()
+
+        result[mode] = {
+            "seconds": round(elapsed, 3),
+            "lost": lost,
+            "flood_429": telegram.flooded,
+            "sent": len(telegram.messages),
+            "reply_p50_ms": round(percentile(replies, 0.5) * 1000, 2),
+            "reply_p99_ms": round(percentile(replies, 0.99) * 1000, 2),
+        }
+        if mode == "queue":
+            result[mode]["merged"] = send_queue.merged
+    return result
+
+
+def make_corridor(stations: int, section: int = 5, headway: int = 20, seed: int = 5) -> list:
+    """Синтетический день на линии из stations станций: (откуда, куда, Timetable) для всех пар.
+
+    Пригородные поезда ходят по участкам из section станций (соседние участки
+    делят конечную станцию), раз в два часа — экспресс по всей линии с
+    остановкой на каждой третьей. Дальние поездки требуют пересадок.
+    """
+    rnd = random.Random(seed)
+    codes = [f"s{9700000 + i}" for i in range(stations)]
+    day = datetime.now(MOSCOW_TZ).replace(hour=5, minute=0, second=0, microsecond=0)
+    date = day.strftime("%Y-%m-%d")
+    segments = {}
+
+    def run_train(stops: list, start: datetime, title: str, hop_minutes: int):
+        times = [start + timedelta(minutes=hop_minutes * i) for i in range(len(stops))]
+        for i in range(len(stops)):
+            for j in range(i + 1, len(stops)):
+                segments.setdefault((codes[stops[i]], codes[stops[j]]), []).append({
+                    "departure": times[i].strftime('%Y-%m-%dT%H:%M:%S%z'),
+                    "arrival": times[j].strftime('%Y-%m-%dT%H:%M:%S%z'),
+                    "duration": int((times[j] - times[i]).total_seconds()),
+                    "thread": {"title": title},
+                })
+
+    sections = [list(range(start, min(start + section, stations)))
+                for start in range(0, stations - 1, section - 1)]
+    for number, stops in enumerate(sections):
+        for minutes in range(0, 19 * 60, headway):
+            start = day + timedelta(minutes=minutes + rnd.randint(0, headway // 2))
+            run_train(stops, start, f"Участок {number}", 15)
+            run_train(stops[::-1], start, f"Участок {number}, обратно", 15)
+    express = list(range(0, stations, 3))
+    for minutes in range(0, 19 * 60, 120):
+        run_train(express, day + timedelta(minutes=minutes), "Экспресс", 30)
+        run_train(express[::-1], day + timedelta(minutes=minutes), "Экспресс, обратно", 30)
+
+    return [(from_code, to_code, Timetable.from_response({"segments": items}, date))
+            for (from_code, to_code), items in segments.items()]
+
+
+async def bench_journeys(stations: int, queries: int) -> dict:
+    """Построение таблицы пересадок по синтетическому коридору и поиск маршрутов по ней"""
+    timetables = make_corridor(stations)
+    started = time.perf_counter()
+    table = ConnectionTable.build(timetables)
+    build_seconds = time.perf_counter() - started
+
+    rnd = random.Random(11)
+    codes = table.stations
+    day = datetime.now(MOSCOW_TZ).replace(hour=5, minute=0, second=0, microsecond=0).timestamp()
+    timings = []
+    transfers = []
+    for _ in range(queries):
+        origin, target = rnd.sample(codes, 2)
+        depart_after = day + rnd.randint(0, 16 * 3600)
+        started = time.perf_counter()
+        journeys = table.search(origin, target, depart_after)
+        timings.append(time.perf_counter() - started)
+        if journeys:
+            transfers.append(journeys[-1].transfers)
+    return {
+        "stations": stations,
+        "connections": len(table),
+        "build_ms": round(build_seconds * 1000, 2),
+        "queries": queries,
+        "found": len(transfers),
+        "mean_transfers": round(statistics.mean(transfers), 2) if transfers else 0,
+        "search_us": summary_us(timings),
+    }
+
+
+def traced_bytes(build) -> tuple:
+    """(результат build(), сколько байт Python-объектов он занял)"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, used
+
+
+async def bench_snapshot(pairs: int, segments: int) -> dict:
+    """Снимок кэша на pairs пар × 2 даты: запись, загрузка через mmap и память на расписание"""
+    date = datetime.now(MOSCOW_TZ).strftime("%Y-%m-%d")
+    tomorrow = (datetime.now(MOSCOW_TZ) + timedelta(days=1)).strftime("%Y-%m-%d")
+    keys = [(f"s{9600000 + i}", f"s{9700000 + i}", day) for i in range(pairs) for day in (date, tomorrow)]
+    responses, json_bytes = traced_bytes(
+        lambda: [{"segments": make_segments(key[0], key[1], key[2], segments)} for key in keys]
+    )
+    timetables, timetable_bytes = traced_bytes(
+        lambda: [Timetable.from_response(response, key[2]) for key, response in zip(keys, responses)]
+    )
+    del responses
+
+    cache = ScheduleCache(max_entries=len(keys))
+    for key, timetable in zip(keys, timetables):
+        cache.put(key, timetable)
+    started = time.perf_counter()
+    size = write_snapshot("timetables.snap", current_entries(cache))
+    write_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    snapshot = Snapshot("timetables.snap")
+    snapshot.load()
+    restored = restore(ScheduleCache(max_entries=len(keys)), snapshot)
+    load_seconds = time.perf_counter() - started
+    # Отдельная загрузка под tracemalloc: он сильно замедляет выделение памяти
+    _, snapshot_bytes = traced_bytes(Snapshot("timetables.snap").load)
+
+    loaded = snapshot.entries[0][1]
+    assert list(loaded.departures) == list(timetables[0].departures)
+    assert [loaded.departure_text[i] for i in range(len(loaded))] == timetables[0].departure_text
+    return {
+        "timetables": len(keys),
+        "segments": segments,
+        "file_bytes": size,
+        "write_ms": round(write_seconds * 1000, 1),
+        "load_ms": round(load_seconds * 1000, 1),
+        "restored": restored,
+        "json_bytes_per_timetable": json_bytes // len(keys),
+        "timetable_bytes_per_timetable": timetable_bytes // len(keys),
+        "snapshot_heap_bytes_per_timetable": snapshot_bytes // len(keys),
+        "snapshot_file_bytes_per_timetable": size // len(keys),
+    }
+
+
+class PipeSink:
+    """Pipe, который в отдельном потоке вычитывает читатель вроде log driver Docker.
+
+    delay — пауза после каждого чтения chunk байт: медленный читатель
+    заполняет буфер pipe, и запись в него начинает блокировать.
+    """
+
+    def __init__(self, chunk: int = 65536, delay: float = 0.0):
+        self._read_fd, write_fd = os.pipe()
+        self.stream = os.fdopen(write_fd, "w", encoding="utf-8")
+        self.chunk = chunk
+        self.delay = delay
+        self.received = 0
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+
+    def _drain(self):
+        while True:
+            data = os.read(self._read_fd, self.chunk)
+            if not data:
+                break
+            self.received += len(data)
+            if self.delay:
+                time.sleep(self.delay)
+
+    def close(self):
+        self.stream.close()
+        self._thread.join()
+        os.close(self._read_fd)
+
+
+def log_update_eager(log: logging.Logger, user, user_data: dict, rows: list):
+    """Записи одного обновления, как в обработчиках до logs: f-строки собираются всегда"""
+    log.info(f"Пользователь {user.first_name} начал разговор")
+    log.debug(f"Состояние пользователя {user.id}: {user_data}")
+    log.info(f"Расписание {user_data['from_station']} → {user_data['to_station']}: {len(rows)} рейсов")
+
+
+def log_update_lazy(log: logging.Logger, user, user_data: dict, rows: list):
+    """Те же записи в стиле %, с полями обработчика и выборочным событием завершения"""
+    token = logs.bind_handler("show_schedule", (None, SimpleNamespace(effective_user=user)))
+    logs.bind(pair=f"{user_data['from_station']}-{user_data['to_station']}")
+    log.info("Пользователь %s начал разговор", user.first_name)
+    log.debug("Состояние пользователя %s: %s", user.id, user_data)
+    log.info("Расписание %s → %s: %d рейсов", user_data["from_station"], user_data["to_station"], len(rows))
+    logs.handler_finished("show_schedule", 0.002)
+    logs.reset(token)
+
+
+def time_updates(log_update, updates: int, gap: float = LOG_UPDATE_GAP) -> list:
+    """Время записей каждого обновления; между обновлениями поток простаивает gap, как цикл в ожидании сети"""
+    log = logging.getLogger("bench")
+    user_data = {"from_station": "s9600213", "to_station": "s9601728", "from_station_name": "Москва",
+                 "to_station_name": "Тверь", "routes": [("s9600213", "Москва", "s9601728", "Тверь")] * 3}
+    rows = list(range(40))
+    timings = []
+    for i in range(updates):
+        user = SimpleNamespace(id=i, first_name=f"User{i}")
+        started = time.perf_counter()
+        log_update(log, user, user_data, rows)
+        timings.append(time.perf_counter() - started)
+        time.sleep(gap)
+    return timings
+
+
+def disabled_call_ns(calls: int) -> dict:
+    """Цена записи DEBUG при уровне INFO: f-строка против аргументов"""
+    log = logging.getLogger("bench")
+    user_data = {"from_station": "s9600213", "to_station": "s9601728", "history": list(range(20))}
+    started = time.perf_counter()
+    for i in range(calls):
+        log.debug(f"Состояние пользователя {i}: {user_data}")
+    eager = time.perf_counter() - started
+    started = time.perf_counter()
+    for i in range(calls):
+        log.debug("Состояние пользователя %s: %s", i, user_data)
+    lazy = time.perf_counter() - started
+    return {"fstring": round(eager / calls * 1e9), "lazy": round(lazy / calls * 1e9)}
+
+
+async def bench_logging(updates: int) -> dict:
+    """Задержка обновления на записи лога: basicConfig с f-строками против logs с очередью.
+
+    Читатель pipe быстрый (fast) или медленный (slow: 4 КБ в миллисекунду),
+    как перегруженный log driver.
+    """
+    disabled = logging.root.manager.disable
+    logging.disable(logging.NOTSET)
+    results = {"updates": updates}
+    try:
+        for sink_name, chunk, delay in (("fast", 65536, 0.0), ("slow", 4096, 0.001)):
+            sink = PipeSink(chunk, delay)
+            logs.shutdown()
+            # Как до logs: запись собирает поток и процесс
+            logging.logThreads = logging.logProcesses = logging.logMultiprocessing = True
+            logging.basicConfig(format=logs.TEXT_FORMAT, level=logging.INFO, stream=sink.stream, force=True)
+            sync = time_updates(log_update_eager, updates)
+            sink.close()
+
+            sink = PipeSink(chunk, delay)
+            handler = logs.setup(json_format=True, stream=sink.stream)
+            queued = time_updates(log_update_lazy, updates)
+            started = time.perf_counter()
+            dropped = handler.dropped
+            logs.shutdown()
+            drain_seconds = time.perf_counter() - started
+            sink.close()
+
+            results[sink_name] = {
+                "basic_config_us": summary_us(sync),
+                "queued_us": summary_us(queued),
+                "queued_dropped": dropped,
+                "queued_drain_ms": round(drain_seconds * 1000, 1),
+            }
+        logging.disable(logging.NOTSET)
+        logs.setup(stream=open(os.devnull, "w"))
+        results["disabled_debug_ns"] = disabled_call_ns(updates * 10)
+    finally:
+        logs.setup()
+        logging.disable(disabled)
+    return results
+
+
+async def run(args) -> dict:
+    cases = args.cases.split(",")
+    results = {
+        "python": platform.python_version(),
+        "started_at": datetime.now(MOSCOW_TZ).isoformat(timespec="seconds"),
+        "cases": {},
+    }
+    if "show_schedule" in cases:
+        results["cases"]["show_schedule"] = await bench_show_schedule(args.iterations, args.segments)
+    if "station_lookup" in cases:
+        results["cases"]["station_lookup"] = await bench_station_lookup(args.stations, args.queries)
+    if "save_routes" in cases:
+        results["cases"]["save_routes"] = [
+            await bench_save_routes(int(users), args.saves) for users in args.route_users.split(",")
+        ]
+    if "end_to_end" in cases:
+        results["cases"]["end_to_end"] = await bench_end_to_end(args.users, args.rounds)
+    if "send_queue" in cases:
+        results["cases"]["send_queue"] = await bench_send_queue(args.chats, args.per_chat)
+    if "snapshot" in cases:
+        results["cases"]["snapshot"] = await bench_snapshot(args.pairs, args.segments)
+    if "logging" in cases:
+        results["cases"]["logging"] = await bench_logging(args.log_updates)
+    if "journeys" in cases:
+        results["cases"]["journeys"] = [
+            await bench_journeys(int(stations), args.queries) for stations in args.corridor.split(",")
+        ]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cases", default=",".join(CASES))
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--segments", type=int, default=50)
+    parser.add_argument("--stations", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--route-users", default="10000,100000")
+    parser.add_argument("--saves", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--per-chat", type=int, default=5)
+    parser.add_argument("--pairs", type=int, default=1000)
+    parser.add_argument("--corridor", default="5,13", help="число станций в синтетических коридорах")
+    parser.add_argument("--log-updates", type=int, default=5000)
+    parser.add_argument("--output", help="куда записать JSON (по умолчанию — stdout)")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    output = os.path.abspath(args.output) if args.output else None
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        results = asyncio.run(run(args))
+        os.chdir(ROOT)
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
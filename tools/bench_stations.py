@@ -0,0 +1,130 @@
+"""Бенчмарк поиска станций по полному (синтетическому) справочнику.
+
+    python -m tools.bench_stations --stations 100000 --queries 2000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from stations import StationIndex, build_index  # noqa: E402
+
+
+SYLLABLES = ["мо", "ск", "ва", "тв", "ерь", "кли", "н", "тор", "жок", "сол", "неч", "но", "гор", "ли", "хо",
+             "сла", "вль", "бо", "ло", "гое", "ко", "на", "ко", "во", "за", "ви", "до", "ре", "дки", "ше",
+             "тни", "крю", "ко", "хи", "мки", "ов", "ри", "лоб", "ня", "сход", "фир", "са", "нов", "ка",
+             "бе", "рё", "зк", "и", "ев", "ская", "ое", "ин", "ки", "ро", "пе", "ту", "ши", "ми", "да"]
+KINDS = ["", "", "", "", " (платф.)", "-2", " 1-й", " Сортировочная", " Пасс.", " Товарная"]
+TRANSPORT_TYPES = ["train", "train", "bus", "bus", "plane", "water"]
+
+
+def make_name(rnd: random.Random) -> str:
+    name = "".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4)))
+    return name.capitalize()
+
+
+def make_stations_tree(count: int, seed: int = 1) -> dict:
+    """Дерево в формате stations_list примерно того же размера, что и настоящее"""
+    rnd = random.Random(seed)
+    settlements = []
+    while len(settlements) < count:
+        settlement = make_name(rnd)
+        stations = []
+        for _ in range(rnd.choice([1, 1, 1, 2, 3])):
+            title = settlement if rnd.random() < 0.6 else f"{settlement} {make_name(rnd)}"
+            stations.append({
+                "title": title + rnd.choice(KINDS),
+                "transport_type": rnd.choice(TRANSPORT_TYPES),
+                "codes": {"yandex_code": f"s{1000000 + len(settlements) * 4 + len(stations)}"},
+            })
+        settlements.append({"title": settlement, "stations": stations})
+    settlements.append({"title": "Клин", "stations": [{
+        "title": "Клин", "transport_type": "train", "codes": {"yandex_code": "s9602944"}}]})
+    return {"countries": [{"regions": [{"settlements": settlements}]}]}
+
+
+def make_queries(index: StationIndex, count: int, seed: int = 2) -> list:
+    """Смесь точных, префиксных и опечатанных запросов"""
+    rnd = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        norm = index._norm_at(rnd.randrange(len(index)))
+        kind = rnd.random()
+        if kind < 0.3:
+            queries.append(norm)
+        elif kind < 0.6:
+            queries.append(norm[:rnd.randint(2, max(2, len(norm)))])
+        else:
+            position = rnd.randrange(len(norm))
+            queries.append(norm[:position] + rnd.choice("абвгдеклмнор") + norm[position + 1:])
+    return queries
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run(stations: int, queries: int, limit: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "stations.db")
+        started = time.perf_counter()
+        build_index(make_stations_tree(stations), path)
+        build_seconds = time.perf_counter() - started
+
+        index = StationIndex(path)
+        started = time.perf_counter()
+        index.load()
+        load_seconds = time.perf_counter() - started
+
+        workload = make_queries(index, queries)
+        timings = []
+        for query in workload:
+            started = time.perf_counter()
+            index.search(query, limit)
+            timings.append((time.perf_counter() - started) * 1e6)
+
+        find_timings = []
+        for query in workload:
+            started = time.perf_counter()
+            index.find(query)
+            find_timings.append((time.perf_counter() - started) * 1e6)
+        index.close()
+
+    return {
+        "stations": stations,
+        "queries": queries,
+        "build_s": round(build_seconds, 3),
+        "load_s": round(load_seconds, 3),
+        "search_us": {
+            "mean": round(statistics.mean(timings), 1),
+            "p50": round(percentile(timings, 0.5), 1),
+            "p99": round(percentile(timings, 0.99), 1),
+        },
+        "find_us": {
+            "mean": round(statistics.mean(find_timings), 1),
+            "p50": round(percentile(find_timings, 0.5), 1),
+            "p99": round(percentile(find_timings, 0.99), 1),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stations", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(run(args.stations, args.queries, args.limit), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
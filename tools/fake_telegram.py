@@ -0,0 +1,131 @@
+"""Локальная замена Telegram Bot API.
+
+Отвечает на getMe, sendMessage и прочие методы, запоминает отправленные
+сообщения и умеет сообщать о них через колбэк — для нагрузочных прогонов
+без настоящего Telegram. С chat_limit/global_limit изображает flood control:
+сообщения сверх лимита за последнюю секунду получают 429 с retry_after.
+"""
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "TrainBot", "username": "train_bot"}
+
+
+class FakeTelegramServer:
+    """Фейковый Bot API в отдельном потоке; base_url для Application — `server.base_url`"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, on_message=None,
+                 chat_limit: int = 0, global_limit: int = 0, retry_after: int = 1):
+        # on_message(method, params) вызывается для каждого исходящего сообщения
+        self.on_message = on_message
+        # Сообщений в секунду на чат и на бота (0 — без ограничения)
+        self.chat_limit = chat_limit
+        self.global_limit = global_limit
+        self.retry_after = retry_after
+        self.calls = {}
+        self.messages = []
+        self.flooded = 0
+        self._sent_at = {}
+        self._global_sent_at = deque()
+        self._lock = threading.Lock()
+        self._message_ids = iter(range(1, 1 << 62))
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.url}/bot"
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length).decode("utf-8") if length else ""
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    params = json.loads(body or "{}")
+                else:
+                    params = {key: values[0] for key, values in parse_qs(body).items()}
+                status, result = server.handle(self.path.rsplit("/", 1)[-1], params)
+                payload = json.dumps(result).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def handle(self, method: str, params: dict) -> tuple:
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getMe":
+            return 200, {"ok": True, "result": BOT_USER}
+        if method in ("sendMessage", "editMessageText"):
+            chat_id = int(params.get("chat_id", 0))
+            if self._flooded(chat_id):
+                return 429, {"ok": False, "error_code": 429,
+                             "description": f"Too Many Requests: retry after {self.retry_after}",
+                             "parameters": {"retry_after": self.retry_after}}
+            with self._lock:
+                message_id = next(self._message_ids)
+                self.messages.append((chat_id, params.get("text", "")))
+            if self.on_message:
+                self.on_message(method, params)
+            return 200, {"ok": True, "result": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }}
+        return 200, {"ok": True, "result": True}
+
+    def _flooded(self, chat_id: int) -> bool:
+        """Превышен ли лимит; отправки засчитываются только принятые"""
+        now = time.monotonic()
+        with self._lock:
+            chat = self._sent_at.setdefault(chat_id, deque())
+            for window in (chat, self._global_sent_at):
+                while window and window[0] <= now - 1:
+                    window.popleft()
+            if (self.chat_limit and len(chat) >= self.chat_limit
+                    or self.global_limit and len(self._global_sent_at) >= self.global_limit):
+                self.flooded += 1
+                return True
+            chat.append(now)
+            self._global_sent_at.append(now)
+            return False
+
+    def start(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,259 @@
+"""Локальный фейковый сервер API Яндекс.Расписаний.
+
+Отдаёт синтетическое расписание и список станций, умеет искусственно
+задерживать ответы и отвечать ошибками — этого достаточно, чтобы офлайн
+проверить, что бот обслуживает пользователей параллельно, а при сбоях API
+быстро отвечает из кэша.
+
+Запуск проверки конкурентности:
+    python -m tools.fake_yandex --users 50 --delay 0.5
+Проверка поведения при сбое (доля ответов 503):
+    python -m tools.fake_yandex --users 200 --error-rate 1.0
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytz
+
+
+MOSCOW_TZ = pytz.timezone('Europe/Moscow')
+
+STATIONS_FIXTURE = {
+    "countries": [{
+        "title": "Россия",
+        "regions": [{
+            "title": "Московская область",
+            "settlements": [
+                {"title": "Москва", "stations": [
+                    {"title": "Москва (Ленинградский вокзал)", "transport_type": "train",
+                     "station_type": "train_station", "codes": {"yandex_code": "s2006004"}},
+                ]},
+                {"title": "Солнечногорск", "stations": [
+                    {"title": "Подсолнечная", "transport_type": "train",
+                     "station_type": "station", "codes": {"yandex_code": "s9603468"}},
+                ]},
+                {"title": "Клин", "stations": [
+                    {"title": "Клин", "transport_type": "train",
+                     "station_type": "station", "codes": {"yandex_code": "s9602944"}},
+                ]},
+            ],
+        }, {
+            "title": "Тверская область",
+            "settlements": [
+                {"title": "Тверь", "stations": [
+                    {"title": "Тверь", "transport_type": "train",
+                     "station_type": "station", "codes": {"yandex_code": "s9603093"}},
+                ]},
+                {"title": "Торжок", "stations": [
+                    {"title": "Торжок", "transport_type": "train",
+                     "station_type": "station", "codes": {"yandex_code": "s9603013"}},
+                ]},
+            ],
+        }],
+    }]
+}
+
+
+def make_segments(from_station: str, to_station: str, date: str, count: int = 50) -> list:
+    """Синтетическое расписание: поезда каждые 20 минут начиная с 05:00"""
+    day = MOSCOW_TZ.localize(datetime.strptime(date, "%Y-%m-%d").replace(hour=5))
+    segments = []
+    for i in range(count):
+        departure = day + timedelta(minutes=20 * i)
+        duration = 3600 + (i % 4) * 300
+        arrival = departure + timedelta(seconds=duration)
+        segments.append({
+            "departure": departure.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            "arrival": arrival.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            "duration": duration,
+            "from": {"code": from_station},
+            "to": {"code": to_station},
+            "thread": {"title": f"Тверь — Москва ({i % 7})", "uid": f"thread-{i}"},
+        })
+    return segments
+
+
+class FakeYandexServer:
+    """Фейковый API в отдельном потоке.
+
+    `delay` — искусственная задержка каждого ответа в секундах;
+    `error_rate` — доля запросов, на которые отвечает `error_status`
+    (или рвёт соединение, если error_status=0); `fail_next` — сколько
+    ближайших запросов завершить ошибкой независимо от error_rate.
+    Всё это можно менять на ходу.
+    Используется как контекстный менеджер: `with FakeYandexServer() as server: ...`
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, delay: float = 0.0, segments: int = 50,
+                 error_rate: float = 0.0, error_status: int = 503, seed: int = None, fail_next: int = 0):
+        self.delay = delay
+        self.segments = segments
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.fail_next = fail_next
+        self._random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def search_url(self) -> str:
+        return f"{self.url}/v3.0/search/"
+
+    @property
+    def stations_url(self) -> str:
+        return f"{self.url}/v3.0/stations_list/"
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                    server._in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server._in_flight)
+                try:
+                    if server.delay:
+                        time.sleep(server.delay)
+                    if server._should_fail():
+                        if not server.error_status:
+                            self.close_connection = True
+                            return
+                        status, body = server.error_status, {"error": {"text": "injected failure"}}
+                    else:
+                        status, body = server.handle(urlparse(self.path))
+                    payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json; charset=utf-8")
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                finally:
+                    with server._lock:
+                        server._in_flight -= 1
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+            elif not (self.error_rate and self._random.random() < self.error_rate):
+                return False
+            self.errors += 1
+            return True
+
+    def handle(self, url) -> tuple:
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path.rstrip("/") == "/v3.0/search":
+            segments = make_segments(query.get("from", ""), query.get("to", ""), query["date"], self.segments)
+            limit = int(query.get("limit", 100))
+            return 200, {"segments": segments[:limit]}
+        if url.path.rstrip("/") == "/v3.0/stations_list":
+            return 200, STATIONS_FIXTURE
+        return 404, {"error": {"text": "not found"}}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+async def check_concurrency(users: int, delay: float):
+    from yandex_client import YandexClient
+
+    with FakeYandexServer(delay=delay) as server:
+        client = YandexClient("test", search_url=server.search_url, stations_url=server.stations_url)
+        date = datetime.now(MOSCOW_TZ).strftime("%Y-%m-%d")
+        started = time.perf_counter()
+        await asyncio.gather(*(client.search("s9602944", "s2006004", date) for _ in range(users)))
+        elapsed = time.perf_counter() - started
+        await client.aclose()
+
+    print(f"{users} запросов по {delay:.2f} с: {elapsed:.2f} с, одновременно на сервере: {server.max_in_flight}")
+
+
+async def check_faults(users: int, delay: float, error_rate: float):
+    from yandex_client import YandexClient
+
+    with FakeYandexServer(delay=delay, error_rate=error_rate) as server:
+        client = YandexClient("test", search_url=server.search_url, stations_url=server.stations_url,
+                              rate_limit=1000, rate_burst=1000)
+        date = datetime.now(MOSCOW_TZ).strftime("%Y-%m-%d")
+        latencies = []
+        failed = 0
+
+        async def one():
+            nonlocal failed
+            started = time.perf_counter()
+            try:
+                await client.search("s9602944", "s2006004", date)
+            except Exception:
+                failed += 1
+            latencies.append(time.perf_counter() - started)
+
+        for _ in range(users):
+            await one()
+        await client.aclose()
+
+    latencies.sort()
+    print(json.dumps({
+        "users": users,
+        "error_rate": error_rate,
+        "failed": failed,
+        "upstream_requests": server.requests,
+        "retried": client.retried,
+        "rejected_by_breaker": sum(b.rejected for b in client.breakers.values()),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+    }, ensure_ascii=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    if args.error_rate:
+        asyncio.run(check_faults(args.users, args.delay, args.error_rate))
+    else:
+        asyncio.run(check_concurrency(args.users, args.delay))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""Нагрузочный прогон режима webhook на синтетических обновлениях.
+
+Поднимает фейковые Yandex API и Telegram Bot API, запускает кластер
+(приёмник + воркеры) и гоняет через него виртуальных пользователей, каждый
+из которых проходит диалог поиска расписания. Печатает JSON с числом
+обновлений в секунду и задержками p50/p99 от отправки обновления до
+последнего ответа бота.
+
+    python -m tools.loadgen --workers 4 --users 200 --rounds 5
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from tools.fake_telegram import FakeTelegramServer  # noqa: E402
+from tools.fake_yandex import FakeYandexServer  # noqa: E402
+
+
+TOKEN = "123456:LOADTEST"
+
+# Шаги диалога: текст сообщения и сколько ответов бота на него ждать
+SCENARIO = [
+    ("📅 Получить расписание", 1),
+    ("Клин", 1),
+    ("Москва (Ленинградский вокзал)", 2),
+    ("❌ Не сохранять", 1),
+]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class LoadGenerator:
+    def __init__(self, webhook_url: str, users: int, rounds: int):
+        self.webhook_url = webhook_url
+        self.users = users
+        self.rounds = rounds
+        self.update_ids = itertools.count(1)
+        self.replies = {}
+        self.latencies = []
+        self.loop = None
+
+    def on_message(self, method: str, params: dict):
+        queue = self.replies.get(int(params.get("chat_id", 0)))
+        if queue is not None:
+            self.loop.call_soon_threadsafe(queue.put_nowait, params.get("text", ""))
+
+    def make_update(self, user_id: int, text: str) -> dict:
+        update_id = next(self.update_ids)
+        message = {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": update_id, "message": message}
+
+    async def send(self, client: httpx.AsyncClient, user_id: int, text: str, replies: int, timeout: float = 30.0):
+        queue = self.replies[user_id]
+        started = time.perf_counter()
+        response = await client.post(self.webhook_url, json=self.make_update(user_id, text))
+        response.raise_for_status()
+        for _ in range(replies):
+            await asyncio.wait_for(queue.get(), timeout)
+        return time.perf_counter() - started
+
+    async def user(self, client: httpx.AsyncClient, user_id: int):
+        for _ in range(self.rounds):
+            for text, replies in SCENARIO:
+                self.latencies.append(await self.send(client, user_id, text, replies))
+
+    async def run(self) -> dict:
+        self.loop = asyncio.get_running_loop()
+        user_ids = [10_000 + i for i in range(self.users)]
+        for user_id in user_ids:
+            self.replies[user_id] = asyncio.Queue()
+
+        limits = httpx.Limits(max_connections=100, max_keepalive_connections=100)
+        async with httpx.AsyncClient(limits=limits, timeout=30.0) as client:
+            await self._wait_ready(client)
+            # Прогрев: /start для каждого пользователя, в замеры не входит
+            await asyncio.gather(*(self.send(client, user_id, "/start", 1) for user_id in user_ids))
+            started = time.perf_counter()
+            await asyncio.gather(*(self.user(client, user_id) for user_id in user_ids))
+            elapsed = time.perf_counter() - started
+
+        return {
+            "users": self.users,
+            "updates": len(self.latencies),
+            "seconds": round(elapsed, 3),
+            "updates_per_second": round(len(self.latencies) / elapsed, 1),
+            "p50_ms": round(percentile(self.latencies, 0.5) * 1000, 1),
+            "p99_ms": round(percentile(self.latencies, 0.99) * 1000, 1),
+        }
+
+    async def _wait_ready(self, client: httpx.AsyncClient, timeout: float = 60.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                await client.post(self.webhook_url, content=b"")
+                return
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--yandex-delay", type=float, default=0.0)
+    args = parser.parse_args()
+
+    import webhook
+
+    workdir = tempfile.TemporaryDirectory()
+    os.chdir(workdir.name)
+    port = free_port()
+    generator = LoadGenerator(f"http://127.0.0.1:{port}{webhook.WEBHOOK_PATH}", args.users, args.rounds)
+
+    with FakeYandexServer(delay=args.yandex_delay) as yandex, FakeTelegramServer(on_message=generator.on_message) as telegram:
+        cluster = multiprocessing.get_context("spawn").Process(
+            target=webhook.run_cluster,
+            args=(TOKEN, "127.0.0.1", port, args.workers),
+            kwargs={
+                "settings": {"API_URL": yandex.search_url, "STATIONS_URL": yandex.stations_url},
+                "base_url": telegram.base_url,
+            },
+        )
+        cluster.start()
+        try:
+            result = asyncio.run(generator.run())
+        finally:
+            os.kill(cluster.pid, signal.SIGTERM)
+            cluster.join(60)
+
+    result["workers"] = args.workers
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Параллельная обработка обновлений с сохранением порядка внутри пользователя.
+
+Application с concurrent_updates обрабатывает каждое обновление в своей
+задаче, поэтому ожидание API у одного пользователя не задерживает других.
+Но обновления одного пользователя должны идти по очереди — иначе
+ConversationHandler увидит второе сообщение раньше, чем первое сменит
+состояние. PerUserUpdateProcessor держит на каждого пользователя
+asyncio.Lock: блокировка честная (FIFO), а задачи создаются в порядке
+прихода обновлений, так что порядок пользователя сохраняется.
+
+Слот из max_concurrent_updates берётся уже под блокировкой пользователя:
+обновления, ждущие своей очереди, слотов не занимают, и пользователь,
+приславший сотню сообщений подряд, держит один слот, а не все.
+Общий семафор Application при этом ограничивает только число обновлений,
+ждущих в процессоре (max_pending_updates).
+"""
+import asyncio
+
+from telegram.ext import BaseUpdateProcessor
+
+
+# Сколько обновлений обрабатывается одновременно
+MAX_CONCURRENT_UPDATES = 256
+# Сколько обновлений может быть в процессоре вместе с ждущими очереди своего пользователя
+MAX_PENDING_UPDATES = 10000
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    __slots__ = ('_locks', '_waiting', '_slots', '_running')
+
+    def __init__(self, max_concurrent_updates: int = MAX_CONCURRENT_UPDATES,
+                 max_pending_updates: int = MAX_PENDING_UPDATES):
+        # Семафор базового класса — на ждущие обновления, слоты обработки — свои
+        super().__init__(max_pending_updates)
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._running = 0
+        self._locks = {}
+        # Сколько обновлений пользователя ждёт или держит блокировку: по нулю она удаляется
+        self._waiting = {}
+
+    @property
+    def current_concurrent_updates(self) -> int:
+        """Обновления, которые обрабатываются сейчас (без ждущих очереди пользователя)"""
+        return self._running
+
+    async def _run(self, coroutine):
+        async with self._slots:
+            self._running += 1
+            try:
+                await coroutine
+            finally:
+                self._running -= 1
+
+    async def do_process_update(self, update, coroutine) -> None:
+        user = getattr(update, "effective_user", None)
+        if user is None:
+            await self._run(coroutine)
+            return
+        key = user.id
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+        try:
+            async with lock:
+                await self._run(coroutine)
+        finally:
+            self._waiting[key] -= 1
+            if not self._waiting[key]:
+                del self._waiting[key]
+                del self._locks[key]
+
+    @property
+    def users(self) -> int:
+        return len(self._locks)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,204 @@
+"""Режим webhook: приём обновлений по HTTP и раздача их процессам-воркерам.
+
+Приёмник разбирает только id пользователя и кладёт тело обновления в
+очередь воркера `user_id % workers`, поэтому все обновления одного
+пользователя обрабатывает один и тот же процесс и состояние
+ConversationHandler остаётся согласованным. Состояние диалогов и маршруты
+лежат в общих SQLite-файлах.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import signal
+
+from telegram import Bot, Update
+
+import logs
+
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH = "/telegram"
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+MAX_BODY_SIZE = 1024 * 1024
+
+# Поля обновления, в которых Telegram передаёт пользователя
+USER_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query", "chosen_inline_result",
+    "shipping_query", "pre_checkout_query", "poll_answer", "my_chat_member", "chat_member",
+    "chat_join_request", "channel_post", "edited_channel_post",
+)
+
+
+def update_user_id(update: dict) -> int:
+    """id пользователя (или чата), по которому обновление закрепляется за воркером"""
+    for field in USER_FIELDS:
+        payload = update.get(field)
+        if payload:
+            user = payload.get("from") or payload.get("user")
+            if user:
+                return user["id"]
+            chat = payload.get("chat")
+            if chat:
+                return chat["id"]
+    return update.get("update_id", 0)
+
+
+class WebhookReceiver:
+    """Минимальный HTTP/1.1-сервер для POST-запросов Telegram с поддержкой keep-alive"""
+
+    def __init__(self, queues: list, secret_token: str = None, path: str = WEBHOOK_PATH):
+        self.queues = queues
+        self.secret_token = secret_token
+        self.path = path
+        self.received = 0
+
+    def dispatch(self, body: bytes):
+        update = json.loads(body)
+        self.queues[update_user_id(update) % len(self.queues)].put(body)
+        self.received += 1
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY_SIZE:
+                    await self._respond(writer, 413)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                if method != "POST" or path.split("?", 1)[0] != self.path:
+                    status = 404
+                elif self.secret_token and headers.get(SECRET_HEADER) != self.secret_token:
+                    status = 403
+                else:
+                    try:
+                        self.dispatch(body)
+                        status = 200
+                    except (ValueError, KeyError, TypeError):
+                        status = 400
+                await self._respond(writer, status)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int):
+        reason = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 413: "Payload Too Large"}[status]
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Length: 0\r\n\r\n".encode("latin-1"))
+        await writer.drain()
+
+
+def run_worker(token: str, index: int, count: int, queue, settings: dict, base_url: str = None):
+    """Точка входа процесса-воркера"""
+    # Останавливает воркеров приёмник (пустым сообщением в очереди), а не Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import bot
+
+    for name, value in settings.items():
+        setattr(bot, name, value)
+    try:
+        asyncio.run(_serve_worker(bot.YandexScheduleBot(token, worker=(index, count), base_url=base_url), queue))
+    finally:
+        # Процесс multiprocessing завершается без atexit — очередь логов дописываем сами
+        logs.shutdown()
+
+
+async def _serve_worker(scheduler, queue):
+    application = scheduler.application
+    loop = asyncio.get_running_loop()
+    await application.initialize()
+    await scheduler.post_init(application)
+    await application.start()
+    try:
+        while True:
+            body = await loop.run_in_executor(None, queue.get)
+            if body is None:
+                break
+            try:
+                update = Update.de_json(json.loads(body), application.bot)
+            except Exception as e:
+                logger.error("Некорректное обновление: %s", e)
+                continue
+            await application.update_queue.put(update)
+    finally:
+        await application.stop()
+        await scheduler.post_stop(application)
+        await application.shutdown()
+        await scheduler.post_shutdown(application)
+
+
+async def _serve_receiver(token: str, receiver: WebhookReceiver, listen: str, port: int,
+                          webhook_url: str, secret_token: str, base_url: str):
+    server = await asyncio.start_server(receiver.handle_connection, listen, port)
+    if webhook_url:
+        kwargs = {"base_url": base_url} if base_url else {}
+        async with Bot(token, **kwargs) as telegram_bot:
+            await telegram_bot.set_webhook(
+                webhook_url, secret_token=secret_token, allowed_updates=Update.ALL_TYPES
+            )
+    logger.info("Webhook слушает %s:%d%s", listen, port, receiver.path)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    async with server:
+        await stop.wait()
+
+
+async def _migrate_routes():
+    import bot
+
+    store = bot.SQLiteRouteStore(bot.ROUTES_DB)
+    try:
+        store.migrate_pickle(bot.ROUTES_FILE)
+    except Exception as e:
+        logger.error("Ошибка переноса маршрутов из %s: %s", bot.ROUTES_FILE, e)
+    finally:
+        await store.close()
+
+
+def run_cluster(token: str, listen: str, port: int, workers: int, webhook_url: str = None,
+                secret_token: str = None, settings: dict = None, base_url: str = None):
+    """Запустить приёмник webhook и workers процессов-воркеров (блокирует до SIGINT/SIGTERM)"""
+    # Разовый перенос старого pickle до запуска воркеров, чтобы они не делали его наперегонки
+    asyncio.run(_migrate_routes())
+
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue() for _ in range(workers)]
+    processes = [
+        context.Process(
+            target=run_worker,
+            args=(token, index, workers, queues[index], settings or {}, base_url),
+            name=f"bot-worker-{index}",
+        )
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    receiver = WebhookReceiver(queues, secret_token)
+    try:
+        asyncio.run(_serve_receiver(token, receiver, listen, port, webhook_url, secret_token, base_url))
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join()
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import time
+
+import httpx
+
+import metrics
+from resilience import RETRY_ATTEMPTS, CircuitBreaker, TokenBucket, backoff_delay
+
+
+logger = logging.getLogger(__name__)
+
+SEARCH_URL = "https://api.rasp.yandex-net.ru/v3.0/search/"
+STATIONS_URL = "https://api.rasp.yandex.net/v3.0/stations_list/"
+
+# Параметры пула соединений и таймауты по умолчанию
+MAX_CONNECTIONS = 20
+MAX_KEEPALIVE_CONNECTIONS = 10
+KEEPALIVE_EXPIRY = 30.0
+MAX_CONCURRENCY = 10
+REQUEST_TIMEOUT = 10.0
+CONNECT_TIMEOUT = 5.0
+STATIONS_TIMEOUT = 60.0
+# Общий бюджет времени на запрос расписания вместе с повторами
+SEARCH_DEADLINE = 6.0
+# Квота API: запросов в секунду и допустимый всплеск — на весь бот, воркеры делят её поровну
+RATE_LIMIT = 10.0
+RATE_BURST = 20.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class YandexClient:
+    """Общий асинхронный клиент API Яндекс.Расписаний.
+
+    Держит постоянный пул keep-alive соединений и ограничивает число
+    одновременных запросов к API, чтобы обработчики не блокировали цикл событий.
+    Сетевые ошибки и ответы 429/5xx повторяются с джиттером в пределах
+    бюджета времени; на каждый адрес API — свой предохранитель, который при
+    серии ошибок отклоняет запросы сразу, а общий token bucket держит
+    частоту запросов в рамках квоты. Предохранитель считает запросы, а не
+    попытки: неудачей считается запрос, у которого кончились повторы.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        search_url: str = SEARCH_URL,
+        stations_url: str = STATIONS_URL,
+        max_connections: int = MAX_CONNECTIONS,
+        max_keepalive_connections: int = MAX_KEEPALIVE_CONNECTIONS,
+        max_concurrency: int = MAX_CONCURRENCY,
+        timeout: float = REQUEST_TIMEOUT,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        retries: int = RETRY_ATTEMPTS,
+        rate_limit: float = RATE_LIMIT,
+        rate_burst: float = RATE_BURST,
+    ):
+        self.api_key = api_key
+        self.search_url = search_url
+        self.stations_url = stations_url
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.timeout = timeout
+        self.retries = retries
+        self.limiter = TokenBucket(rate_limit, rate_burst)
+        self.breakers = {}
+        self.retried = 0
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        breaker = self.breakers.get(url)
+        if breaker is None:
+            breaker = self.breakers[url] = CircuitBreaker()
+        return breaker
+
+    def _observe(self, url: str, started: float, response):
+        endpoint = url.rstrip("/").rsplit("/", 1)[-1]
+        metrics.UPSTREAM_SECONDS.observe(time.perf_counter() - started, endpoint)
+        metrics.UPSTREAM_RESPONSES.inc(endpoint, str(response.status_code) if response is not None else "error")
+
+    async def get_json(self, url: str, params: dict, timeout: float = None, raise_for_status: bool = False,
+                       deadline: float = None, raw: bool = False):
+        """GET-запрос к API с общими параметрами (apikey, format, lang).
+
+        deadline — общий бюджет в секундах на все попытки; по его истечении
+        (или при разомкнутом предохранителе) ошибка возвращается сразу.
+        raw=True — вернуть тело ответа байтами, не разбирая JSON на цикле событий.
+        """
+        query = {"apikey": self.api_key, "format": "json", "lang": "ru_RU"}
+        query.update(params)
+        timeout = timeout if timeout is not None else self.timeout
+        breaker = self.breaker(url)
+        expires_at = time.monotonic() + deadline if deadline is not None else None
+
+        # Повторы одного запроса не проверяют предохранитель заново: он решает, пускать ли запрос целиком
+        breaker.check()
+        attempt = 0
+        while True:
+            remaining = expires_at - time.monotonic() if expires_at is not None else None
+            await self.limiter.acquire(max_wait=remaining)
+            try:
+                if expires_at is not None:
+                    remaining = expires_at - time.monotonic()
+                    if remaining <= 0:
+                        raise httpx.TimeoutException("бюджет времени запроса исчерпан")
+                async with self._semaphore:
+                    started = time.perf_counter()
+                    response = None
+                    try:
+                        response = await self._client.get(
+                            url,
+                            params=query,
+                            timeout=min(timeout, remaining) if expires_at is not None else timeout,
+                        )
+                    finally:
+                        if metrics.ENABLED:
+                            self._observe(url, started, response)
+                if response.status_code in RETRY_STATUSES:
+                    response.raise_for_status()
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                delay = backoff_delay(attempt)
+                if isinstance(e, httpx.HTTPStatusError):
+                    retry_after = e.response.headers.get("Retry-After", "")
+                    if retry_after.isdigit():
+                        delay = max(delay, float(retry_after))
+                attempt += 1
+                if attempt > self.retries or (
+                    expires_at is not None and time.monotonic() + delay >= expires_at
+                ):
+                    breaker.record_failure()
+                    raise
+                self.retried += 1
+                # В тексте HTTPStatusError есть URL с apikey — в лог он не попадает
+                reason = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else type(e).__name__
+                logger.warning("Повтор запроса к API через %.2f с: %s", delay, reason)
+                await asyncio.sleep(delay)
+                continue
+
+            breaker.record_success()
+            if raise_for_status:
+                response.raise_for_status()
+            return response.content if raw else response.json()
+
+    async def search(self, from_station: str, to_station: str, date: str, limit: int = 50) -> dict:
+        """Расписание электричек между двумя станциями на дату"""
+        params = {
+            "from": from_station,
+            "to": to_station,
+            "date": date,
+            "transport_types": "suburban",
+            "limit": limit,
+        }
+        return await self.get_json(self.search_url, params, deadline=SEARCH_DEADLINE)
+
+    async def stations_list(self, station_name: str = None, timeout: float = STATIONS_TIMEOUT, raw: bool = False):
+        """Полный список станций (страна → регион → населённый пункт → станция); raw — см. get_json"""
+        params = {}
+        if station_name:
+            params["station"] = station_name
+        return await self.get_json(self.stations_url, params, timeout=timeout, raise_for_status=True, raw=raw)
+
+    async def aclose(self):
+        await self._client.aclose()